@@ -0,0 +1,358 @@
+import os
+import logging
+import sys
+import time
+import asyncio
+import concurrent.futures
+from botocore.exceptions import ClientError
+
+try:
+    from aiobotocore.session import get_session
+    from aiobotocore.config import AioConfig
+    AIOBOTOCORE_AVAILABLE = True
+except ImportError:
+    AIOBOTOCORE_AVAILABLE = False
+
+from silent_print_s3 import (
+    S3_BUCKET_NAME, S3_ENDPOINT_URL, PRINTED_LOG_FILE, S3_REGION, S3_WATCH_PREFIX, CHECK_INTERVAL_SECONDS, TEMPLATES,
+    REQUIRED_MODULES, preflight, load_printed_files, save_printed_file, is_text_key, decode_object,
+    MessagePages, message_result, build_sinks, output_name, OUTPUT_SINKS, JOB_PRINTED, JOB_FAILED, JOB_RETRY,
+    RETRY_DELAY_SECONDS, process_bundle, PrintJobWatcher, on_print_job_completed,
+)
+from pipeline import PageStream, fan_out
+from text_payload import is_bundle_key, max_object_bytes
+from checkpoint import load_checkpoint, save_checkpoint, CHECKPOINT_INTERVAL_SECONDS
+from snapshot_diff import Snapshot, SnapshotBuilder, iter_changes
+from scheduler import JobScheduler, LIVE, BACKLOG
+from processed_mover import ProcessedMover, MOVE_PROCESSED_OBJECTS
+from metrics import time_stage, start_metrics_server, JOBS_TOTAL, QUEUE_SIZE, METRICS_ENABLED
+from job_trace import JobTrace, finish_trace
+from logging_setup import setup_logging, RATE_LIMITED
+from startup import check_modules
+from s3_throttle import S3_THROTTLE, CLIENT_RETRIES
+from job_leases import LeaseManager, LEASES_ENABLED, LEASE_ACQUIRED, LEASE_DONE
+from memory_monitor import MemoryMonitor, MEMORY_MONITOR_ENABLED
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_FLIGHT_REQUESTS = 64  # Максимум одновременных запросов к S3 (и соединений в пуле)
+MAX_ACTIVE_JOBS = 16  # Максимум одновременно обрабатываемых файлов
+RENDER_WORKERS = os.cpu_count() or 4  # Потоки для рендеринга изображений
+
+async def fetch_bytes(client, bucket_name, key, semaphore):
+    """Асинхронно скачивает объект S3 и возвращает (содержимое, метаданные, Content-Encoding) или None."""
+    async with semaphore:
+        try:
+            with time_stage('download'):
+                response = await client.get_object(Bucket=bucket_name, Key=key)
+                # Как и в fetch_object, слишком большой объект целиком не читаем
+                async with response['Body'] as stream:
+                    data = await stream.read(max_object_bytes(key) + 1)
+        except ClientError as e:
+            logger.error("Ошибка при скачивании файла %s из S3: %s", key, e)
+            return None
+    return data, response.get('Metadata', {}), response.get('ContentEncoding')
+
+class AsyncWatcher:
+    """Асинхронный наблюдатель за бакетом.
+
+    Листинг и скачивание идут через один пул соединений aiobotocore с
+    множеством одновременных запросов. Рендеринг выполняется в пуле
+    потоков, а готовые страницы раздаются получателям sinks (принтер,
+    предпросмотр, галерея, архив) так же, как в синхронном режиме; у
+    каждого получателя один поток, поэтому вызовы GDI идут на принтер
+    последовательно, а сообщения отдаются получателям целиком по одному.
+    Порядок запуска заданий определяет JobScheduler.
+    """
+
+    def __init__(self, client, sinks, bucket_name=S3_BUCKET_NAME, mover=None, leases=None, memory=None,
+                 printed_log_file=PRINTED_LOG_FILE):
+        self.client = client
+        self.sinks = sinks
+        self.bucket_name = bucket_name
+        self.mover = mover
+        self.leases = leases
+        self.memory = memory
+        self.printed_log_file = printed_log_file
+        self.printed_files = load_printed_files(printed_log_file)
+        self.known_files = Snapshot()
+        self.pending = {}
+        self.scheduler = JobScheduler()
+        self.wakeup = asyncio.Event()
+        self.in_flight = set()
+        self.semaphore = asyncio.Semaphore(MAX_IN_FLIGHT_REQUESTS)
+        self.render_executor = concurrent.futures.ThreadPoolExecutor(RENDER_WORKERS, thread_name_prefix='render')
+        # Один поток доставки: сообщения уходят получателям целиком по
+        # очереди, иначе страницы разных сообщений перемешаются на бумаге
+        self.delivery_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='deliver')
+        self.tasks = set()
+        self.traces = {}
+        self.job_watcher = PrintJobWatcher(on_print_job_completed).start()
+        QUEUE_SIZE.set_function(lambda: self.scheduler.sizes()[LIVE], queue=LIVE)
+        QUEUE_SIZE.set_function(lambda: self.scheduler.sizes()[BACKLOG], queue=BACKLOG)
+        QUEUE_SIZE.set_function(lambda: len(self.in_flight), queue='in_flight')
+        QUEUE_SIZE.set_function(lambda: len(self.pending), queue='pending')
+        if memory:
+            memory.track('printed_files', lambda: len(self.printed_files))
+            memory.track('known_files', lambda: len(self.known_files))
+            memory.track('pending', lambda: len(self.pending))
+            memory.track('traces', lambda: len(self.traces))
+
+    def restore(self):
+        """Восстанавливает состояние из контрольной точки, если она есть."""
+        logger.info("Загружено %s записей о ранее напечатанных файлах.", len(self.printed_files))
+        checkpoint = load_checkpoint()
+        if checkpoint is not None:
+            self.known_files = checkpoint['snapshot']
+            self.pending = {key: last_modified for key, last_modified in checkpoint['pending'].items()
+                            if key not in self.printed_files}
+            logger.info("Восстановлена контрольная точка: %s файлов, %s необработанных",
+                        len(self.known_files), len(self.pending))
+            for key, last_modified in self.pending.items():
+                self.submit(key, last_modified, BACKLOG)
+
+    def submit(self, key, last_modified, job_class=None):
+        """Ставит файл в очередь планировщика, если он еще не обрабатывается."""
+        if key in self.in_flight or key in self.printed_files:
+            return False
+        self.pending[key] = last_modified
+        if self.scheduler.push(key, last_modified, job_class):
+            self.traces[key] = JobTrace(key, last_modified)
+            self.wakeup.set()
+            return True
+        return False
+
+    async def dispatch(self):
+        """Запускает задания из планировщика, пока есть свободные слоты."""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.in_flight) < MAX_ACTIVE_JOBS:
+                job = self.scheduler.pop()
+                if job is None:
+                    break
+                key, last_modified, _ = job
+                self.in_flight.add(key)
+                trace = self.traces.pop(key, None) or JobTrace(key, last_modified)
+                task = asyncio.create_task(self.run_job(key, trace))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def run_job(self, key, trace):
+        """Берет аренду файла, если бакет делят несколько станций, и обрабатывает его."""
+        if self.leases:
+            lease = await asyncio.to_thread(self.leases.acquire, key)
+            if lease != LEASE_ACQUIRED:
+                self.in_flight.discard(key)
+                self.wakeup.set()
+                if lease == LEASE_DONE:
+                    # Файл уже обработан другой станцией, запоминаем его локально
+                    save_printed_file(key, self.printed_log_file)
+                    self.printed_files.add(key)
+                    self.pending.pop(key, None)
+                elif key in self.pending:
+                    # Файл печатает другая станция: проверим позже, закончила ли она
+                    asyncio.get_running_loop().call_later(
+                        RETRY_DELAY_SECONDS, self.submit, key, self.pending[key], BACKLOG)
+                return
+        result = await self.process_file(key, trace)
+        if self.memory:
+            # Задания идут параллельно, поэтому учитывается только рост за окно заданий
+            self.memory.job_finished(key)
+        if self.leases:
+            if result == JOB_RETRY:
+                await asyncio.to_thread(self.leases.release, key)
+            else:
+                await asyncio.to_thread(self.leases.complete, key, result == JOB_FAILED)
+
+    async def print_message(self, key, text_content, template, trace):
+        """Рендерит текст и отдает его страницы получателям.
+
+        Страницы рендерятся по одной в пуле потоков и сразу уходят
+        получателям: первая печатается, пока раскладываются следующие.
+        Доставка идет в одном потоке, поэтому страницы разных сообщений
+        не перемешиваются; пока сообщение ждет очереди, его страницы
+        рендерятся впрок. Возвращает JOB_PRINTED, JOB_FAILED (текст не
+        рендерится) или JOB_RETRY.
+        """
+        loop = asyncio.get_running_loop()
+        pages = MessagePages(key, text_content, template, trace)
+        stream = PageStream()
+        rendering = loop.run_in_executor(self.render_executor, stream.fill, pages)
+        try:
+            delivered = await loop.run_in_executor(self.delivery_executor, fan_out, stream, self.sinks)
+        finally:
+            stream.close()
+            await rendering
+        return message_result(pages, delivered)
+
+    async def print_bundle(self, key, data, metadata, content_encoding, trace):
+        """Печатает сообщения пакета через process_bundle, а каждое сообщение — через print_message."""
+        loop = asyncio.get_running_loop()
+
+        def deliver(entry_key, text_content, template, sinks, trace):
+            # process_bundle идет в отдельном потоке, а печать — в цикле событий
+            return asyncio.run_coroutine_threadsafe(
+                self.print_message(entry_key, text_content, template, trace), loop).result()
+
+        return await asyncio.to_thread(process_bundle, key, data, metadata, content_encoding, self.printed_files,
+                                       self.sinks, self.mover, trace, self.printed_log_file, deliver)
+
+    async def process_file(self, key, trace):
+        """Скачивает, рендерит и печатает один файл (все его страницы) или пакет. Возвращает результат."""
+        result = JOB_RETRY
+        try:
+            trace.mark('fetch_start')
+            fetched = await fetch_bytes(self.client, self.bucket_name, key, self.semaphore)
+            trace.mark('fetch_end')
+            if fetched is None:
+                return result
+            data, metadata, content_encoding = fetched
+            if is_bundle_key(key):
+                # process_bundle сам записывает пакет в историю и переносит его
+                result = await self.print_bundle(key, data, metadata, content_encoding, trace)
+                if result != JOB_RETRY:
+                    self.pending.pop(key, None)
+                return result
+            with time_stage('read'):
+                text_content = decode_object(key, data, content_encoding)
+            if text_content is None:
+                result = JOB_FAILED
+            else:
+                result = await self.print_message(key, text_content, TEMPLATES.select(key, metadata), trace)
+            if result == JOB_FAILED:
+                self.finish_failed(key)
+            elif result == JOB_PRINTED:
+                save_printed_file(key, self.printed_log_file)
+                self.printed_files.add(key)
+                self.pending.pop(key, None)
+                if self.mover:
+                    self.mover.move(key)
+                logger.info("Файл %s успешно обработан и напечатан", key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка при обработке файла %s: %s", key, e)
+        finally:
+            JOBS_TOTAL.inc(result=result)
+            if result == JOB_RETRY and key in self.pending:
+                # Повторяем позже, а не ждем изменения файла или перезапуска
+                asyncio.get_running_loop().call_later(
+                    RETRY_DELAY_SECONDS, self.submit, key, self.pending[key], BACKLOG)
+            if result == JOB_PRINTED and trace.print_job:
+                self.job_watcher.watch(trace)
+            else:
+                finish_trace(trace, result)
+            self.in_flight.discard(key)
+            self.wakeup.set()
+        return result
+
+    def finish_failed(self, key):
+        """Убирает файл, который невозможно напечатать, из необработанных."""
+        self.pending.pop(key, None)
+        if self.mover:
+            self.mover.move(key, failed=True)
+
+    async def poll_once(self):
+        """Один проход листинга: запускает обработку новых и измененных файлов."""
+        current_files = SnapshotBuilder()
+        paginator = self.client.get_paginator('list_objects_v2')
+        try:
+            with time_stage('list'):
+                async for page in paginator.paginate(Bucket=self.bucket_name, Prefix=S3_WATCH_PREFIX):
+                    for key, last_modified in iter_changes((page,), self.known_files, current_files, is_text_key):
+                        # Как и в poll_s3_changes: файл уже ждет обработки или повтора
+                        if self.pending.get(key) == last_modified:
+                            continue
+                        if self.submit(key, last_modified):
+                            logger.info("Новый текстовый файл в S3: %s", key)
+        except ClientError as e:
+            logger.error("Ошибка при получении списка файлов из S3: %s", e, extra=RATE_LIMITED)
+            return
+        self.known_files = current_files.build()
+
+    async def run(self):
+        """Основной цикл мониторинга."""
+        self.restore()
+        logger.info("Отслеживаем S3 бакет '%s' (асинхронный режим)...", self.bucket_name)
+        last_checkpoint_time = time.monotonic()
+        dispatcher = asyncio.create_task(self.dispatch())
+        self.tasks.add(dispatcher)
+        try:
+            while True:
+                await self.poll_once()
+                if time.monotonic() - last_checkpoint_time >= CHECKPOINT_INTERVAL_SECONDS:
+                    save_checkpoint(self.known_files, self.pending)
+                    last_checkpoint_time = time.monotonic()
+                await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """Отменяет незавершенные задачи и сохраняет контрольную точку."""
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.render_executor.shutdown(wait=False, cancel_futures=True)
+        self.delivery_executor.shutdown(wait=False, cancel_futures=True)
+        for sink in self.sinks:
+            await asyncio.to_thread(sink.stop)
+        if self.mover:
+            await asyncio.to_thread(self.mover.stop)
+        if self.leases:
+            await asyncio.to_thread(self.leases.stop)
+        if self.memory:
+            await asyncio.to_thread(self.memory.stop)
+        save_checkpoint(self.known_files, self.pending)
+
+async def async_main(sync_client, outputs=OUTPUT_SINKS):
+    session = get_session()
+    config = AioConfig(max_pool_connections=MAX_IN_FLIGHT_REQUESTS, retries=CLIENT_RETRIES)
+    async with session.create_client('s3', endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION,
+                                     config=config) as client:
+        # Темп запросов общий с синхронным клиентом переноса
+        S3_THROTTLE.attach_async(client)
+        # Как и в синхронном режиме, без принтера файлы не переносятся и не арендуются
+        printing = 'printer' in [output_name(output) for output in outputs]
+        mover = None
+        if MOVE_PROCESSED_OBJECTS and printing:
+            # Перенос выполняется синхронным клиентом boto3 в фоновом потоке
+            mover = ProcessedMover(sync_client, S3_BUCKET_NAME).start()
+        leases = None
+        if LEASES_ENABLED and printing:
+            # Аренды берутся синхронным клиентом в потоках, как и перенос
+            leases = LeaseManager(sync_client, S3_BUCKET_NAME).start()
+        memory = MemoryMonitor().start() if MEMORY_MONITOR_ENABLED else None
+        if METRICS_ENABLED:
+            start_metrics_server()
+        # Архив пишет синхронный клиент из потока своего получателя
+        sinks = build_sinks(sync_client, outputs)
+        await AsyncWatcher(client, sinks, mover=mover, leases=leases, memory=memory).run()
+
+def main(outputs=OUTPUT_SINKS):
+    setup_logging()
+    if 'printer' in outputs and not sys.platform.startswith('win32'):
+        logger.error("Печать работает только на Windows.")
+        return
+    required_modules = dict(REQUIRED_MODULES, aiobotocore='aiobotocore')
+    if 'printer' not in outputs:
+        del required_modules['win32print']
+    if 'gallery' in outputs:
+        required_modules['aiohttp'] = 'aiohttp'
+    if not check_modules(required_modules):
+        return
+    if not AIOBOTOCORE_AVAILABLE:
+        logger.error("Для асинхронного режима установите 'aiobotocore'.")
+        return
+    # Шаблон, шрифты и учетные данные S3 проверяются параллельно
+    sync_client = preflight()
+    if sync_client is None:
+        logger.error("Невозможно продолжить, исправьте ошибки выше.")
+        return
+    try:
+        asyncio.run(async_main(sync_client, outputs))
+    except KeyboardInterrupt:
+        logger.info("Остановлено.")
+
+if __name__ == "__main__":
+    main()
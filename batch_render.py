@@ -0,0 +1,117 @@
+"""Офлайн-рендеринг текстовых файлов в PNG/PDF без S3 и принтера.
+
+Использует тот же шаблон и шрифты, что и silent_print_s3.py, и
+распределяет файлы по всем ядрам. Пример:
+
+    python batch_render.py messages/ "proof/*.txt" -o rendered --format pdf
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import concurrent.futures
+from PIL import Image
+
+import silent_print_s3
+from silent_print_s3 import TEMPLATE_IMAGE, TXT_EXTENSION, read_text_from_file, render_pages
+from text_payload import TEXT_SUFFIXES, strip_text_suffix
+from logging_setup import setup_logging, LOG_LEVEL
+
+OUTPUT_FORMATS = ('png', 'pdf')
+DEFAULT_DPI = 144  # Разрешение шаблона A5 (840x1190 пикселей)
+
+def collect_input_files(patterns):
+    """Раскрывает директории и glob-шаблоны в отсортированный список .txt файлов (в том числе сжатых)."""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*' + TXT_EXTENSION + '*')
+        files.extend(path for path in glob.glob(pattern) if path.lower().endswith(TEXT_SUFFIXES))
+    return sorted(set(files))
+
+def render_file(txt_path, output_dir, output_format, template_path, use_cache=False):
+    """Рендерит один файл. Выполняется в отдельном процессе.
+
+    По умолчанию кэш страниц не используется: иначе повторный прогон
+    мерил бы чтение кэша, а не рендеринг. Возвращает (путь к файлу, путь
+    к результату или None, число страниц, секунды).
+    """
+    started = time.perf_counter()
+    text_content = read_text_from_file(txt_path)
+    if text_content is None:
+        return txt_path, None, 0, time.perf_counter() - started
+    pages = list(render_pages(template_path, text_content, use_cache=use_cache))
+    if use_cache and silent_print_s3.RENDER_CACHE is not None:
+        # Процесс может завершиться раньше фоновой записи кэша на диск
+        silent_print_s3.RENDER_CACHE.flush()
+    if not pages or pages[-1] is None:
+        return txt_path, None, 0, time.perf_counter() - started
+    base_name = strip_text_suffix(os.path.basename(txt_path))
+    output_path = os.path.join(output_dir, f"{base_name}.{output_format}")
+    if output_format == 'pdf':
+        dpi = pages[0].info.get('dpi', (DEFAULT_DPI, DEFAULT_DPI))[0]
+        # Как и при печати, накладываем прозрачные области на белый фон
+        rgb_pages = []
+        for img in pages:
+            if img.mode == 'RGBA':
+                rgb = Image.new("RGB", img.size, (255, 255, 255))
+                rgb.paste(img, mask=img.split()[3])
+            else:
+                rgb = img.convert('RGB')
+            rgb_pages.append(rgb)
+        # Все страницы файла — в одном PDF
+        rgb_pages[0].save(output_path, 'PDF', resolution=dpi, save_all=True, append_images=rgb_pages[1:])
+    else:
+        # Первая страница — base.png, следующие — base-2.png, base-3.png...
+        for number, img in enumerate(pages, 1):
+            suffix = f"-{number}" if number > 1 else ''
+            img.save(os.path.join(output_dir, f"{base_name}{suffix}.png"), 'PNG')
+    return txt_path, output_path, len(pages), time.perf_counter() - started
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный рендеринг .txt файлов по шаблону печати.")
+    parser.add_argument('inputs', nargs='+', help="директории или glob-шаблоны с .txt файлами")
+    parser.add_argument('-o', '--output', default='rendered', help="директория для результатов")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='png', help="формат страниц")
+    parser.add_argument('--template', default=TEMPLATE_IMAGE, help="путь к шаблону изображения")
+    parser.add_argument('--cache', action='store_true',
+                        help="использовать кэш страниц (скорость тогда не отражает рендеринг)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="число процессов")
+    args = parser.parse_args(argv)
+    # Отчет выводится в консоль, журнал пишут только сервисы печати
+    setup_logging(log_file=None)
+
+    files = collect_input_files(args.inputs)
+    if not files:
+        print("Не найдено ни одного .txt файла.")
+        return 1
+    if not os.path.exists(args.template):
+        print(f"Ошибка: шаблон изображения не найден по пути '{args.template}'")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    print(f"Рендеринг {len(files)} файлов в {args.workers} процессах...")
+    started = time.perf_counter()
+    total_pages = 0
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=setup_logging,
+                                                initargs=(LOG_LEVEL, None)) as executor:
+        futures = [executor.submit(render_file, path, args.output, args.format, args.template, args.cache)
+                   for path in files]
+        for future in concurrent.futures.as_completed(futures):
+            txt_path, output_path, pages, seconds = future.result()
+            if output_path is None:
+                failed += 1
+                print(f"ОШИБКА  {txt_path} ({seconds * 1000:.0f} мс)")
+            else:
+                total_pages += pages
+                print(f"{seconds * 1000:7.0f} мс  {txt_path} -> {output_path}")
+    elapsed = time.perf_counter() - started
+
+    print(f"Готово: {total_pages} страниц за {elapsed:.2f} с "
+          f"({total_pages / elapsed if elapsed else 0:.2f} стр/с), ошибок: {failed}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
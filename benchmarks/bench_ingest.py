@@ -0,0 +1,37 @@
+"""Бенчмарки приема: листинг бакета moto и сравнение снимков."""
+import pytest
+
+from silent_print_s3 import iter_s3_listing_pages, is_text_key
+from snapshot_diff import Snapshot, SnapshotBuilder, iter_changes
+from conftest import make_listing_pages, BUCKET_SIZES
+
+def run_diff(pages, snapshot):
+    builder = SnapshotBuilder()
+    changes = sum(1 for _ in iter_changes(pages, snapshot, builder, is_text_key))
+    return changes, builder.build()
+
+def list_and_diff(s3_client, bucket_name):
+    # Тот же путь, что у poll_s3_changes: листинг сразу сравнивается со снимком
+    return run_diff(iter_s3_listing_pages(s3_client, bucket_name), Snapshot())
+
+@pytest.mark.benchmark(group='list')
+def bench_list_bucket(benchmark, s3_bucket):
+    s3_client, bucket_name, size = s3_bucket
+    changes, snapshot = benchmark.pedantic(list_and_diff, args=(s3_client, bucket_name), rounds=3)
+    assert changes == size and len(snapshot) == size
+
+@pytest.mark.benchmark(group='snapshot-diff')
+@pytest.mark.parametrize('size', BUCKET_SIZES, ids=lambda size: f"{size}keys")
+def bench_snapshot_diff_unchanged(benchmark, size):
+    pages = make_listing_pages(size)
+    _, snapshot = run_diff(pages, Snapshot())
+    changes, _ = benchmark(run_diff, pages, snapshot)
+    assert changes == 0
+
+@pytest.mark.benchmark(group='snapshot-diff')
+@pytest.mark.parametrize('size', BUCKET_SIZES, ids=lambda size: f"{size}keys")
+def bench_snapshot_diff_few_changes(benchmark, size):
+    _, snapshot = run_diff(make_listing_pages(size), Snapshot())
+    pages = make_listing_pages(size, changed=10)
+    changes, _ = benchmark(run_diff, pages, snapshot)
+    assert changes == 10
@@ -0,0 +1,47 @@
+"""Бенчмарки аренд заданий: несколько станций делят один бакет moto."""
+import itertools
+import concurrent.futures
+
+import pytest
+
+from job_leases import LeaseManager, LEASE_ACQUIRED
+
+LEASE_BUCKET_NAME = 'bench-leases'
+LEASE_KEYS = 200
+STATIONS = [1, 2, 4]
+# Номера раундов общие для всех тестов: состояние moto может пережить тест,
+# если бакеты других бенчмарков держат mock_aws на всю сессию
+ROUNDS = itertools.count()
+
+@pytest.fixture
+def lease_client():
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=LEASE_BUCKET_NAME)
+        yield client
+
+def claim_all(managers, keys):
+    """Каждая станция пытается взять каждый ключ; возвращает {станция: взятые ключи}."""
+    def station(manager):
+        return manager.owner, [key for key in keys if manager.acquire(key) == LEASE_ACQUIRED]
+    with concurrent.futures.ThreadPoolExecutor(len(managers)) as executor:
+        return dict(executor.map(station, managers))
+
+@pytest.mark.benchmark(group='leases')
+@pytest.mark.parametrize('stations', STATIONS, ids=lambda count: f"{count}stations")
+def bench_claim_exactly_once(benchmark, lease_client, stations):
+    keys = [f"messages/{i:04d}.txt" for i in range(LEASE_KEYS)]
+
+    def run():
+        # Каждый раунд — свой префикс аренд, как новый набор файлов
+        prefix = f"leases-{next(ROUNDS)}/"
+        managers = [LeaseManager(lease_client, LEASE_BUCKET_NAME, prefix=prefix, owner=f"station-{i}")
+                    for i in range(stations)]
+        return claim_all(managers, keys)
+
+    claimed = benchmark.pedantic(run, rounds=3)
+    # Каждый файл взят ровно одной станцией
+    all_claimed = [key for keys in claimed.values() for key in keys]
+    assert len(all_claimed) == len(set(all_claimed)) == LEASE_KEYS
@@ -0,0 +1,60 @@
+"""Бенчмарки этапов рендеринга: декодирование, эмодзи, раскладка по страницам, отрисовка."""
+import os
+import gzip
+
+import pytest
+
+from silent_print_s3 import (TEMPLATE_IMAGE, TEMPLATES, EMOJI_FALLBACK_FONTS, decode_text, decode_object, emojize_text,
+                             load_fonts, iter_page_lines, render_text_image)
+from emoji_atlas import load_atlas
+from line_raster import LineRasterizer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(autouse=True)
+def run_from_repo_root(monkeypatch):
+    # Шаблон задан относительным путем, как и в production
+    monkeypatch.chdir(ROOT_DIR)
+
+@pytest.fixture
+def template_fonts():
+    """Шаблон, шрифты и атлас эмодзи, как их берет render_pages."""
+    template = TEMPLATES.for_image(TEMPLATE_IMAGE)
+    atlas = load_atlas(template.emoji_height)
+    font, emoji_font = load_fonts(template, load_emoji=atlas is None)
+    return template, font, emoji_font, atlas
+
+def lay_out(template, text, font, emoji_font, atlas):
+    # Растеризатор создается на каждое сообщение, как в render_pages
+    raster = LineRasterizer(template, font, emoji_font, EMOJI_FALLBACK_FONTS, atlas)
+    return list(iter_page_lines(template, text, raster))
+
+@pytest.mark.benchmark(group='decode')
+def bench_decode_utf8(benchmark, text_case):
+    data = text_case[1].encode('utf-8')
+    benchmark(decode_text, data)
+
+@pytest.mark.benchmark(group='decode')
+def bench_decode_cp1251(benchmark):
+    from conftest import CYRILLIC_TEXT
+    benchmark(decode_text, CYRILLIC_TEXT.encode('cp1251'))
+
+@pytest.mark.benchmark(group='decode')
+def bench_decode_gzip(benchmark, text_case):
+    data = gzip.compress(text_case[1].encode('utf-8'))
+    assert benchmark(decode_object, 'messages/text.txt.gz', data) == text_case[1].replace('\r\n', '\n')
+
+@pytest.mark.benchmark(group='emojize')
+def bench_emojize(benchmark, text_case):
+    benchmark(emojize_text, text_case[1])
+
+@pytest.mark.benchmark(group='wrap')
+def bench_wrap(benchmark, text_case, template_fonts):
+    template, font, emoji_font, atlas = template_fonts
+    text = emojize_text(text_case[1])
+    assert benchmark(lay_out, template, text, font, emoji_font, atlas)
+
+@pytest.mark.benchmark(group='render')
+def bench_render(benchmark, text_case):
+    result = benchmark(render_text_image, TEMPLATE_IMAGE, text_case[1])
+    assert result is not None
@@ -0,0 +1,68 @@
+"""Бенчмарки ограничителя запросов S3 под троттлингом.
+
+ThrottlingStub отвечает на часть запросов к бакету moto ошибкой 503
+SlowDown, как перегруженное хранилище, не отправляя их дальше.
+"""
+import random
+
+import pytest
+
+from s3_throttle import S3Throttle, AdaptiveRateLimiter, RetryBudget, CLIENT_RETRIES
+# Ответ SlowDown общий с тестами; у бенчмарков свой conftest, поэтому полный путь
+from tests.conftest import slowdown_response
+
+THROTTLE_BUCKET_NAME = 'bench-throttle'
+THROTTLE_OBJECTS = 20
+
+class ThrottlingStub:
+    """Отвечает SlowDown на долю ratio запросов клиента."""
+
+    def __init__(self, ratio, seed=0):
+        self.ratio = ratio
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+
+    def attach(self, client):
+        # Раньше moto, иначе ответ moto будет выбран первым
+        client.meta.events.register_first('before-send.s3', self.before_send)
+        return self
+
+    def before_send(self, request, **kwargs):
+        self.requests += 1
+        if self.random.random() >= self.ratio:
+            return None
+        self.throttled += 1
+        return slowdown_response(request)
+
+@pytest.fixture
+def throttled_bucket():
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    from botocore.config import Config
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1', config=Config(retries=CLIENT_RETRIES))
+        client.create_bucket(Bucket=THROTTLE_BUCKET_NAME)
+        for i in range(THROTTLE_OBJECTS):
+            client.put_object(Bucket=THROTTLE_BUCKET_NAME, Key=f"messages/{i:03d}.txt", Body=b'x')
+        yield client
+
+def fetch_all(client):
+    for i in range(THROTTLE_OBJECTS):
+        client.get_object(Bucket=THROTTLE_BUCKET_NAME, Key=f"messages/{i:03d}.txt")['Body'].read()
+
+@pytest.mark.benchmark(group='throttle')
+@pytest.mark.parametrize('ratio', [0.0, 0.3], ids=lambda ratio: f"slowdown{int(ratio * 100)}")
+def bench_fetch_under_throttling(benchmark, throttled_bucket, ratio):
+    limiter = AdaptiveRateLimiter(rate=400, min_rate=50, max_rate=1000)
+    throttle = S3Throttle(limiter, RetryBudget(capacity=1000), max_attempts=10,
+                          backoff_base=0.001, backoff_max=0.01)
+    throttle.attach(throttled_bucket)
+    stub = ThrottlingStub(ratio).attach(throttled_bucket)
+    benchmark.pedantic(fetch_all, args=(throttled_bucket,), rounds=3)
+    if ratio:
+        # Все объекты скачаны несмотря на отказы, а темп снижен
+        assert stub.throttled > 0
+        assert limiter.rate < 400
+    else:
+        assert limiter.rate > 400
@@ -0,0 +1,84 @@
+import os
+import sys
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Результаты сохраняются рядом с бенчмарками, из какой бы директории ни запускали pytest
+RESULTS_STORAGE = 'file://' + os.path.join(os.path.dirname(os.path.abspath(__file__)), '.results')
+DEFAULT_STORAGE = 'file://./.benchmarks'  # Значение --benchmark-storage по умолчанию в pytest-benchmark
+
+# Размеры бакета для бенчмарков листинга; 100000 заполняется заметно дольше
+BUCKET_SIZES = [int(size) for size in os.environ.get('BENCH_BUCKET_SIZES', '10000').split(',')]
+BENCH_BUCKET_NAME = 'bench-bucket'
+
+SHORT_TEXT = "Спасибо, что зашли к нам на стенд!"
+LONG_TEXT = " ".join(["Lorem ipsum dolor sit amet, consectetur adipiscing elit."] * 60)
+CYRILLIC_TEXT = "\n".join(["Съешь же ещё этих мягких французских булок, да выпей чаю."] * 25)
+EMOJI_TEXT = " ".join(["Отличный день :smile: :rocket: 🎉 ❤️ 👍🏽"] * 30)
+
+TEXTS = {
+    'short': SHORT_TEXT,
+    'long': LONG_TEXT,
+    'cyrillic': CYRILLIC_TEXT,
+    'emoji': EMOJI_TEXT,
+}
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # Явно указанный --benchmark-storage не трогаем
+    if getattr(config.option, 'benchmark_storage', None) == DEFAULT_STORAGE:
+        config.option.benchmark_storage = RESULTS_STORAGE
+
+@pytest.fixture(params=sorted(TEXTS))
+def text_case(request):
+    """Возвращает (имя, текст) для каждого набора текстов."""
+    return request.param, TEXTS[request.param]
+
+def populate_bucket(s3_client, bucket_name, count):
+    """Заполняет бакет moto объектами; по возможности напрямую через backend moto."""
+    try:
+        from moto.core import DEFAULT_ACCOUNT_ID
+        from moto.s3.models import s3_backends
+        backend = s3_backends[DEFAULT_ACCOUNT_ID]['aws']
+        put = lambda key: backend.put_object(bucket_name, key, b'x')
+    except (ImportError, KeyError):
+        put = lambda key: s3_client.put_object(Bucket=bucket_name, Key=key, Body=b'x')
+    for i in range(count):
+        put(f"messages/{i:07d}.txt")
+
+@pytest.fixture(scope='session', params=BUCKET_SIZES, ids=lambda size: f"{size}keys")
+def s3_bucket(request):
+    """Бакет moto с заданным числом объектов: (клиент, имя бакета, размер)."""
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    mock = moto.mock_aws()
+    mock.start()
+    try:
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        bucket_name = f"{BENCH_BUCKET_NAME}-{request.param}"
+        s3_client.create_bucket(Bucket=bucket_name)
+        populate_bucket(s3_client, bucket_name, request.param)
+        yield s3_client, bucket_name, request.param
+    finally:
+        mock.stop()
+
+def make_listing_pages(count, changed=0, page_size=1000):
+    """Строит страницы ответа list_objects_v2 без обращения к S3.
+
+    Последние changed объектов получают более позднее время изменения.
+    """
+    base = datetime.datetime(2025, 5, 1, tzinfo=datetime.timezone.utc)
+    later = base + datetime.timedelta(minutes=5)
+    pages = []
+    for start in range(0, count, page_size):
+        contents = []
+        for i in range(start, min(start + page_size, count)):
+            contents.append({
+                'Key': f"messages/{i:07d}.txt",
+                'LastModified': later if i >= count - changed else base,
+            })
+        pages.append({'Contents': contents})
+    return pages
@@ -0,0 +1,281 @@
+"""Нагрузочный и длительный (soak) прогон наблюдателя с локальным S3.
+
+Поднимает moto server (или использует MinIO по --endpoint), загружает
+синтетические сообщения с заданным темпом и составом и запускает
+настоящий цикл silent_print_s3.main с имитацией принтера. Периодически
+выводит устойчивую пропускную способность, рост бэклога и перцентили
+задержки от загрузки до печати. Пример:
+
+    python benchmarks/soak.py --duration 3600 --rate 2 --emoji-density 0.2 --report soak.jsonl
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import _thread
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import silent_print_s3
+from pipeline import Sink
+from job_trace import LatencyTracker, LATENCY_QUANTILES
+from memory_monitor import rss_bytes
+
+SOAK_BUCKET_NAME = 'soak-bucket'
+SOAK_PREFIX = 'soak/'
+MOTO_PORT = 5055
+LATENCY_WINDOW = 1000  # Сколько последних заданий учитывать в перцентилях окна
+
+WORDS = ("привет спасибо выставка стенд встреча команда будущее идея проект друзья "
+         "hello thanks expo booth meeting team future idea project friends").split()
+EMOJI = ['😀', '🎉', '❤️', '👍🏽', '🚀', '☀', '✂', ':smile:', ':rocket:', '👨‍👩‍👧']
+# Число слов в сообщении для каждого размера
+SIZES = {'short': (3, 12), 'medium': (40, 120), 'long': (400, 1200)}
+
+def parse_mix(value):
+    """'short=6,medium=3,long=1' -> {'short': 6.0, 'medium': 3.0, 'long': 1.0}."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def pick(rng, mix):
+    return rng.choices(list(mix), weights=list(mix.values()))[0]
+
+def make_message(rng, size, emoji_density):
+    low, high = SIZES[size]
+    words = []
+    for i in range(rng.randint(low, high)):
+        words.append(rng.choice(WORDS))
+        if rng.random() < emoji_density:
+            words.append(rng.choice(EMOJI))
+        if i % 15 == 14:
+            words.append('\n')
+    return ' '.join(words).replace(' \n ', '\n')
+
+def encode_message(text, encoding):
+    if encoding == 'cp1251':
+        # В cp1251 нет эмодзи — их отправляют только в UTF-8
+        return text.encode('cp1251', errors='ignore')
+    return text.encode(encoding)
+
+class SoakStats:
+    """Счетчики прогона: загрузки, напечатанные файлы и задержки."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uploaded = {}  # {ключ: время загрузки}
+        self.printed = set()
+        self.pages = 0
+        self.window = LatencyTracker(LATENCY_WINDOW)
+        self.latencies = []
+
+    def upload(self, key):
+        with self.lock:
+            self.uploaded[key] = time.time()
+
+    def page(self, key, number):
+        with self.lock:
+            self.pages += 1
+            uploaded = self.uploaded.get(key)
+            if number != 1 or uploaded is None or key in self.printed:
+                return
+            self.printed.add(key)
+            seconds = time.time() - uploaded
+            self.latencies.append(seconds)
+        self.window.add(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return len(self.uploaded), len(self.printed), self.pages, list(self.latencies)
+
+class FakePrinterSink(Sink):
+    """Имитация принтера: «печатает» страницу за заданное время."""
+    name = 'printer'
+
+    def __init__(self, stats, seconds_per_page, failure_rate=0.0, seed=0):
+        super().__init__(required=True)
+        self.stats = stats
+        self.seconds_per_page = seconds_per_page
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def handle(self, page):
+        if page.trace:
+            page.trace.mark('spool_start')
+        time.sleep(self.seconds_per_page * self.random.uniform(0.8, 1.2))
+        if self.random.random() < self.failure_rate:
+            return False
+        if page.trace:
+            page.trace.mark('spool_end')
+        self.stats.page(page.key, page.number)
+        return True
+
+def upload_loop(s3_client, bucket, stats, args, stop):
+    """Загружает сообщения с пуассоновским потоком темпа args.rate в секунду."""
+    rng = random.Random(args.seed)
+    sizes = parse_mix(args.sizes)
+    encodings = parse_mix(args.encodings)
+    number = 0
+    while not stop.is_set():
+        if stop.wait(rng.expovariate(args.rate)):
+            return
+        size = pick(rng, sizes)
+        body = encode_message(make_message(rng, size, args.emoji_density), pick(rng, encodings))
+        key = f"{SOAK_PREFIX}{number:08d}-{size}.txt"
+        number += 1
+        try:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+        except Exception as e:
+            print(f"Ошибка загрузки {key}: {e}", file=sys.stderr)
+            continue
+        stats.upload(key)
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {str(quantile): None for quantile in LATENCY_QUANTILES}
+    return {str(quantile): round(values[max(1, int(-(-quantile * len(values) // 1))) - 1], 3)
+            for quantile in LATENCY_QUANTILES}
+
+def report_loop(stats, args, started, stop):
+    """Раз в args.report_interval секунд выводит и записывает показатели."""
+    previous = (0, 0, started, rss_bytes())
+    while not stop.wait(args.report_interval):
+        record = make_record(stats, started, previous)
+        previous = (record['uploaded'], record['printed'], time.monotonic(), record['rss_bytes'])
+        emit(record, args.report)
+
+def make_record(stats, started, previous):
+    uploaded, printed, pages, latencies = stats.snapshot()
+    now = time.monotonic()
+    rss = rss_bytes()
+    prev_uploaded, prev_printed, prev_time, prev_rss = previous
+    interval = max(now - prev_time, 1e-9)
+    backlog = uploaded - printed
+    prev_backlog = prev_uploaded - prev_printed
+    return {
+        'elapsed_seconds': round(now - started, 1),
+        'uploaded': uploaded,
+        'printed': printed,
+        'pages': pages,
+        'backlog': backlog,
+        'throughput_per_minute': round((printed - prev_printed) * 60 / interval, 2),
+        'average_throughput_per_minute': round(printed * 60 / max(now - started, 1e-9), 2),
+        'backlog_growth_per_minute': round((backlog - prev_backlog) * 60 / interval, 2),
+        'latency_window_seconds': {str(quantile): value and round(value, 3)
+                                   for quantile, value in stats.window.percentiles().items()},
+        'latency_total_seconds': percentiles(latencies),
+        'rss_bytes': rss,
+        'rss_growth_per_minute': None if rss is None or prev_rss is None else round((rss - prev_rss) * 60 / interval),
+        'traced_bytes': tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+    }
+
+def emit(record, report_path):
+    latency = record['latency_window_seconds']
+    print(f"[{record['elapsed_seconds']:>8.0f} с] загружено {record['uploaded']}, напечатано {record['printed']} "
+          f"({record['pages']} стр.), бэклог {record['backlog']} ({record['backlog_growth_per_minute']:+.1f}/мин), "
+          f"{record['throughput_per_minute']:.1f} файлов/мин, задержка p50/p95/p99: "
+          + '/'.join('-' if value is None else f"{value:.1f}" for value in latency.values()) + " с, "
+          f"RSS {(record['rss_bytes'] or 0) / 2**20:.0f} МБ ({(record['rss_growth_per_minute'] or 0) / 2**20:+.1f} МБ/мин)",
+          flush=True)
+    if report_path:
+        with open(report_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def start_moto_server(port):
+    from moto.server import ThreadedMotoServer
+    # Журнал каждого запроса к moto заглушает отчеты прогона
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон наблюдателя с локальным S3 и имитацией принтера.")
+    parser.add_argument('--duration', type=float, default=600, help="длительность прогона, секунд")
+    parser.add_argument('--rate', type=float, default=1.0, help="загрузок в секунду (в среднем)")
+    parser.add_argument('--sizes', default='short=6,medium=3,long=1', help="доли размеров сообщений")
+    parser.add_argument('--encodings', default='utf-8=9,cp1251=1', help="доли кодировок сообщений")
+    parser.add_argument('--emoji-density', type=float, default=0.1, help="вероятность эмодзи после слова")
+    parser.add_argument('--page-seconds', type=float, default=0.5, help="время печати одной страницы")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="доля неудачных «печатей»")
+    parser.add_argument('--endpoint', help="S3 endpoint (например, MinIO); по умолчанию запускается moto server")
+    parser.add_argument('--bucket', default=SOAK_BUCKET_NAME)
+    parser.add_argument('--report', help="файл JSONL для периодических отчетов")
+    parser.add_argument('--report-interval', type=float, default=60, help="интервал отчетов, секунд")
+    parser.add_argument('--render-cache', action='store_true', help="не отключать кэш страниц")
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='FRAMES',
+                        help="включить tracemalloc с такой глубиной стека: отчеты о памяти покажут растущие строки")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.endpoint:
+        endpoint = args.endpoint
+    else:
+        # moto принимает любые учетные данные
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'soak')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'soak')
+        server, endpoint = start_moto_server(MOTO_PORT)
+    os.chdir(ROOT_DIR)
+    work_dir = tempfile.mkdtemp(prefix='soak-')
+
+    # Настоящий наблюдатель, направленный на локальное хранилище
+    silent_print_s3.S3_ENDPOINT_URL = endpoint
+    silent_print_s3.S3_REGION = 'us-east-1'
+    silent_print_s3.S3_BUCKET_NAME = args.bucket
+    silent_print_s3.S3_WATCH_PREFIX = SOAK_PREFIX
+    if not args.render_cache:
+        silent_print_s3.RENDER_CACHE = None
+    s3_client = silent_print_s3.get_s3_client()
+    try:
+        s3_client.create_bucket(Bucket=args.bucket)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    if args.tracemalloc:
+        # Наблюдатель замечает включенный tracemalloc и меряет рост памяти Python
+        tracemalloc.start(args.tracemalloc)
+
+    stats = SoakStats()
+    printer = FakePrinterSink(stats, args.page_seconds, args.failure_rate, args.seed)
+    stop = threading.Event()
+    started = time.monotonic()
+    start_rss = rss_bytes()
+    threads = [
+        threading.Thread(target=upload_loop, args=(s3_client, args.bucket, stats, args, stop), daemon=True),
+        threading.Thread(target=report_loop, args=(stats, args, started, stop), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    # По окончании прогона останавливаем наблюдатель так же, как Ctrl+C
+    timer = threading.Timer(args.duration, _thread.interrupt_main)
+    timer.start()
+    try:
+        silent_print_s3.main((printer,), os.path.join(work_dir, 'printed_files.txt'),
+                             os.path.join(work_dir, 'checkpoint.json'))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        timer.cancel()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if server:
+            server.stop()
+    record = make_record(stats, started, (0, 0, started, start_rss))
+    print("Итог прогона:")
+    emit(record, args.report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
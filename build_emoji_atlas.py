@@ -0,0 +1,54 @@
+"""Сборка атласа эмодзи: все эмодзи заранее отрисовываются в один файл.
+
+Для каждой высоты эмодзи из шаблонов (src/templates.json) все эмодзи из
+таблицы пакета emoji рисуются шрифтами эмодзи и уменьшаются до нужной
+высоты. Сервис печати отображает атлас в память и не загружает шрифт
+эмодзи. Пересобирайте атлас после смены шрифтов эмодзи, пакета emoji
+или размеров эмодзи в шаблонах, остановив сервисы печати. Пример:
+
+    python build_emoji_atlas.py --font src/font/NotoColorEmoji-Regular.ttf
+"""
+import os
+import sys
+import time
+import argparse
+
+from silent_print_s3 import TEMPLATES, EMOJI_FONT_FILES
+from emoji_atlas import build_atlas, EMOJI_ATLAS_DIR
+from logging_setup import setup_logging
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сборка атласа эмодзи для шаблонов печати.")
+    parser.add_argument('--font', action='append', dest='fonts',
+                        help="шрифт эмодзи (можно несколько, в порядке предпочтения); "
+                             "по умолчанию найденные шрифты из EMOJI_FONT_FILES")
+    parser.add_argument('--height', type=int, help="высота эмодзи; по умолчанию все высоты из шаблонов")
+    parser.add_argument('--font-size', type=int, help="размер шрифта эмодзи для --height")
+    parser.add_argument('-o', '--output', default=EMOJI_ATLAS_DIR, help="директория атласов")
+    args = parser.parse_args(argv)
+    setup_logging(log_file=None)
+
+    fonts = args.fonts or [path for path in EMOJI_FONT_FILES if os.path.exists(path)]
+    missing = [path for path in fonts if not os.path.exists(path)]
+    if not fonts or missing:
+        print(f"Ошибка: не найдены шрифты эмодзи: {', '.join(missing or EMOJI_FONT_FILES)}")
+        return 1
+    if args.height:
+        sizes = {args.height: args.font_size or args.height}
+    else:
+        # Высота эмодзи -> размер шрифта, которым они рисуются
+        sizes = {template.emoji_height: template.emoji_font_size
+                 for template in TEMPLATES.load().templates.values()}
+
+    for emoji_height, emoji_font_size in sorted(sizes.items()):
+        started = time.perf_counter()
+        data_path, count = build_atlas(fonts, emoji_font_size, emoji_height, args.output)
+        if not count:
+            print(f"Ошибка: в шрифтах {', '.join(fonts)} не нашлось ни одного эмодзи")
+            return 1
+        print(f"{data_path}: {count} эмодзи высотой {emoji_height} пикселей, "
+              f"{os.path.getsize(data_path) / 1024 / 1024:.1f} МБ за {time.perf_counter() - started:.1f} с")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import os
+import logging
+import json
+import tempfile
+import datetime
+from snapshot_diff import Snapshot
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = 'watcher_checkpoint.json'  # Файл контрольной точки наблюдателя
+CHECKPOINT_INTERVAL_SECONDS = 30  # Как часто сохранять контрольную точку
+CHECKPOINT_VERSION = 3
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """Загружает контрольную точку наблюдателя.
+
+    Возвращает словарь с ключами:
+        watermark: максимальное LastModified среди известных файлов (или None)
+        snapshot: последний снимок бакета (Snapshot)
+        pending: словарь {ключ: LastModified} файлов, которые были замечены, но не обработаны
+    Если контрольной точки нет или она повреждена, возвращает None.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != CHECKPOINT_VERSION:
+            logger.warning("Контрольная точка '%s' имеет неизвестную версию, игнорируем её", path)
+            return None
+        watermark = data.get('watermark')
+        return {
+            'watermark': datetime.datetime.fromisoformat(watermark) if watermark else None,
+            'snapshot': Snapshot.from_dict(data['snapshot']),
+            'pending': {key: datetime.datetime.fromisoformat(value) if value else None
+                        for key, value in data.get('pending', {}).items()},
+        }
+    except Exception as e:
+        logger.error("Ошибка при чтении контрольной точки '%s': %s", path, e)
+        return None
+
+def save_checkpoint(snapshot, pending, path=CHECKPOINT_FILE):
+    """Атомарно сохраняет снимок бакета и водяной знак листинга.
+
+    Данные пишутся во временный файл в той же директории и затем
+    подменяют старую контрольную точку через os.replace, поэтому при
+    падении посреди записи на диске остаётся предыдущая целая версия.
+    """
+    watermark = snapshot.watermark()
+    data = {
+        'version': CHECKPOINT_VERSION,
+        'saved_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'watermark': watermark.isoformat() if watermark else None,
+        'snapshot': snapshot.to_dict(),
+        'pending': {key: value.isoformat() if value else None for key, value in pending.items()},
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(prefix='.checkpoint-', suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return True
+    except Exception as e:
+        logger.error("Ошибка при сохранении контрольной точки '%s': %s", path, e)
+        if temp_path and os.path.exists(temp_path):
+            try:
+                os.unlink(temp_path)
+            except Exception:
+                pass
+        return False
@@ -0,0 +1,156 @@
+import os
+import json
+import mmap
+import logging
+import tempfile
+import threading
+
+from startup import lazy_import
+from line_raster import Sprite, render_sprite
+from render_cache import file_fingerprint
+
+Image = lazy_import('PIL.Image')
+ImageFont = lazy_import('PIL.ImageFont')
+emoji = lazy_import('emoji')
+
+logger = logging.getLogger(__name__)
+
+EMOJI_ATLAS_ENABLED = True  # Брать спрайты эмодзи из собранного атласа, если он есть
+EMOJI_ATLAS_DIR = os.path.join('src', 'emoji_atlas')  # Где лежат атласы (собираются build_emoji_atlas.py)
+ATLAS_FORMAT_VERSION = 1
+
+def atlas_paths(emoji_height, directory=EMOJI_ATLAS_DIR):
+    """Пути к данным и индексу атласа для высоты эмодзи emoji_height."""
+    base = os.path.join(directory, f"emoji-{emoji_height}")
+    return base + '.rgba', base + '.json'
+
+class EmojiAtlas:
+    """Заранее отрисованные спрайты эмодзи в одном файле, отображенном в память.
+
+    Файл данных — подряд записанные RGBA-растры спрайтов, индекс (JSON) —
+    смещение, размеры и подъем над базовой линией каждого спрайта.
+    Спрайты создаются поверх отображения без копирования, поэтому шрифт
+    эмодзи при работе не нужен, а процессы рендеринга делят одни и те же
+    страницы памяти. Пока атлас открыт, его файл нельзя заменить (Windows).
+    """
+
+    def __init__(self, data_path, index):
+        self.data_path = data_path
+        self.emoji_height = index['emoji_height']
+        self.entries = index['sprites']  # {последовательность: [смещение, ширина, высота, подъем]}
+        with open(data_path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mapping)
+        self.sprites = {}  # Уже созданные спрайты, общие для всех заданий
+
+    @classmethod
+    def open(cls, emoji_height, directory=EMOJI_ATLAS_DIR):
+        """Открывает атлас для высоты emoji_height; None, если его нет или он не подходит."""
+        data_path, index_path = atlas_paths(emoji_height, directory)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != ATLAS_FORMAT_VERSION or index.get('emoji_height') != emoji_height:
+                logger.warning("Атлас эмодзи %s собран другой версией, пересоберите его: python build_emoji_atlas.py",
+                               index_path)
+                return None
+            if os.path.getsize(data_path) != index['size']:
+                logger.warning("Данные атласа эмодзи %s не совпадают с индексом, пересоберите атлас", data_path)
+                return None
+            atlas = cls(data_path, index)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Не удалось открыть атлас эмодзи %s: %s", index_path, e)
+            return None
+        logger.info("Атлас эмодзи %s: %s спрайтов высотой %s пикселей (%s)",
+                    data_path, len(atlas.entries), emoji_height, ', '.join(index.get('fonts', [])))
+        return atlas
+
+    def __contains__(self, sequence):
+        return sequence in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sprite(self, sequence):
+        """Спрайт эмодзи или None, если его нет в атласе."""
+        sprite = self.sprites.get(sequence)
+        if sprite is None:
+            entry = self.entries.get(sequence)
+            if entry is None:
+                return None
+            offset, width, height, ascent = entry
+            data = self.buffer[offset:offset + width * height * 4]
+            image = Image.frombuffer('RGBA', (width, height), data, 'raw', 'RGBA', 0, 1)
+            sprite = self.sprites[sequence] = Sprite(image, ascent)
+        return sprite
+
+_ATLASES = {}  # {высота эмодзи: EmojiAtlas или None}
+_ATLASES_LOCK = threading.Lock()
+
+def load_atlas(emoji_height, directory=EMOJI_ATLAS_DIR):
+    """Общий для процесса атлас для высоты emoji_height (открывается один раз) или None."""
+    if not EMOJI_ATLAS_ENABLED:
+        return None
+    with _ATLASES_LOCK:
+        if emoji_height not in _ATLASES:
+            _ATLASES[emoji_height] = EmojiAtlas.open(emoji_height, directory)
+        return _ATLASES[emoji_height]
+
+def build_atlas(font_paths, emoji_font_size, emoji_height, directory=EMOJI_ATLAS_DIR, sequences=None):
+    """Отрисовывает все эмодзи шрифтами font_paths и сохраняет атлас.
+
+    Каждая последовательность берется из первого шрифта, где есть ее
+    глиф. По умолчанию рисуются все эмодзи из таблицы пакета emoji.
+    Файлы заменяются атомарно. Возвращает (путь к данным, число спрайтов).
+    """
+    from pillow_features import probe_pillow_features
+    pillow = probe_pillow_features()
+    fonts = [ImageFont.truetype(path, emoji_font_size, **pillow.truetype_kwargs(complex_layout=True))
+             for path in font_paths]
+    if sequences is None:
+        sequences = sorted(emoji.EMOJI_DATA)
+    data_path, index_path = atlas_paths(emoji_height, directory)
+    os.makedirs(directory, exist_ok=True)
+    entries = {}
+    offset = 0
+    temp_data = temp_index = None
+    try:
+        fd, temp_data = tempfile.mkstemp(prefix='.atlas-', suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            for sequence in sequences:
+                for font in fonts:
+                    sprite = render_sprite(font, sequence, emoji_height)
+                    if sprite is not None:
+                        break
+                else:
+                    continue
+                data = sprite.image.tobytes()
+                f.write(data)
+                entries[sequence] = [offset, sprite.image.width, sprite.image.height, sprite.ascent]
+                offset += len(data)
+        index = {
+            'version': ATLAS_FORMAT_VERSION,
+            'emoji_height': emoji_height,
+            'emoji_font_size': emoji_font_size,
+            'fonts': [os.path.basename(path) for path in font_paths],
+            'font_fingerprints': [file_fingerprint(path) for path in font_paths],
+            'emoji_version': getattr(emoji, '__version__', None),
+            'size': offset,
+            'sprites': entries,
+        }
+        fd, temp_index = tempfile.mkstemp(prefix='.atlas-', suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        # mkstemp создает файлы только для владельца, а атлас читают все сервисы печати
+        os.chmod(temp_data, 0o644)
+        os.chmod(temp_index, 0o644)
+        # Индекс заменяется последним: до этого старый индекс не совпадет с данными по размеру
+        os.replace(temp_data, data_path)
+        os.replace(temp_index, index_path)
+    finally:
+        for path in (temp_data, temp_index):
+            if path and os.path.exists(path):
+                os.unlink(path)
+    return data_path, len(entries)
@@ -0,0 +1,235 @@
+import io
+import json
+import time
+import asyncio
+import logging
+import threading
+import collections
+
+from startup import lazy_import, module_available
+from pipeline import Sink
+from metrics import time_stage
+
+Image = lazy_import('PIL.Image')
+# aiohttp нужен только серверу галереи и импортируется при его запуске
+web = lazy_import('aiohttp.web')
+AIOHTTP_AVAILABLE = module_available('aiohttp')
+
+logger = logging.getLogger(__name__)
+
+GALLERY_HOST = '127.0.0.1'  # Галерея доступна только локально
+GALLERY_PORT = 9109
+GALLERY_CAPACITY = 200  # Сколько последних страниц держать в памяти
+GALLERY_MAX_BYTES = 128 * 1024 * 1024  # Предел памяти под страницы и миниатюры
+GALLERY_THUMBNAIL_SIZE = (280, 400)  # Размер миниатюры в индексе
+GALLERY_KEEPALIVE_SECONDS = 15  # Как часто слать пустое событие, чтобы соединение не закрылось
+
+INDEX_HTML = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>Предпросмотр печати</title>
+<style>
+body { font-family: sans-serif; margin: 16px; background: #f4f4f4; }
+#pages { display: flex; flex-wrap: wrap; gap: 12px; }
+figure { margin: 0; background: #fff; padding: 8px; box-shadow: 0 1px 3px #0003; }
+figcaption { font-size: 12px; max-width: 280px; overflow-wrap: anywhere; }
+</style>
+</head>
+<body>
+<h1>Последние страницы</h1>
+<div id="pages"></div>
+<script>
+async function refresh() {
+  const pages = await (await fetch('api/pages')).json();
+  const container = document.getElementById('pages');
+  container.innerHTML = '';
+  for (const page of pages) {
+    const figure = document.createElement('figure');
+    const link = document.createElement('a');
+    link.href = 'pages/' + page.id + '.png';
+    link.target = '_blank';
+    const img = document.createElement('img');
+    img.src = 'thumbs/' + page.id + '.jpg';
+    img.loading = 'lazy';
+    link.appendChild(img);
+    const caption = document.createElement('figcaption');
+    const number = page.number > 1 ? ', стр. ' + page.number : '';
+    caption.textContent = page.key + number + ' — ' + new Date(page.created * 1000).toLocaleTimeString();
+    figure.appendChild(link);
+    figure.appendChild(caption);
+    container.appendChild(figure);
+  }
+}
+new EventSource('events').onmessage = refresh;
+refresh();
+</script>
+</body>
+</html>
+"""
+
+class GalleryStore:
+    """LRU последних страниц: закодированные миниатюры и полные PNG в памяти.
+
+    Страница вытесняется, когда превышено число записей или объем памяти;
+    просмотр страницы продлевает ей жизнь. Слушатели (listeners)
+    вызываются после каждого добавления.
+    """
+
+    def __init__(self, capacity=GALLERY_CAPACITY, max_bytes=GALLERY_MAX_BYTES):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.next_id = 1
+        self.version = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add(self, key, thumbnail, full_page, number=1):
+        with self.lock:
+            page_id = self.next_id
+            self.next_id += 1
+            self.entries[page_id] = {
+                'id': page_id,
+                'key': key,
+                'number': number,
+                'created': time.time(),
+                'thumbnail': thumbnail,
+                'page': full_page,
+            }
+            self.total_bytes += len(thumbnail) + len(full_page)
+            while self.entries and (len(self.entries) > self.capacity or self.total_bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted['thumbnail']) + len(evicted['page'])
+            self.version += 1
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+        return page_id
+
+    def get(self, page_id):
+        with self.lock:
+            entry = self.entries.get(page_id)
+            if entry is not None:
+                self.entries.move_to_end(page_id)
+            return entry
+
+    def list(self):
+        """Описания страниц в памяти, новые первыми."""
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda entry: entry['id'], reverse=True)
+        return [{'id': entry['id'], 'key': entry['key'], 'number': entry['number'], 'created': entry['created']}
+                for entry in entries]
+
+class GallerySink(Sink):
+    """Кладет страницы в память галереи вместо файлов и окон просмотра."""
+    name = 'gallery'
+
+    def __init__(self, store, required=False):
+        super().__init__(required)
+        self.store = store
+
+    def handle(self, page):
+        with time_stage('gallery'):
+            thumbnail = page.image.copy()
+            thumbnail.thumbnail(GALLERY_THUMBNAIL_SIZE)
+            if thumbnail.mode == 'RGBA':
+                # JPEG не поддерживает прозрачность — кладем на белый фон
+                background = Image.new('RGB', thumbnail.size, (255, 255, 255))
+                background.paste(thumbnail, mask=thumbnail.split()[3])
+                thumbnail = background
+            elif thumbnail.mode != 'RGB':
+                thumbnail = thumbnail.convert('RGB')
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, 'JPEG', quality=80)
+            self.store.add(page.key, buffer.getvalue(), page.png_bytes(), page.number)
+        return True
+
+class GalleryServer:
+    """HTTP галерея на aiohttp в отдельном потоке со своим циклом событий.
+
+    Индекс обновляется сам: страница подписана на /events (Server-Sent
+    Events), куда сервер сообщает о каждой новой странице в хранилище.
+    """
+
+    def __init__(self, store, host=GALLERY_HOST, port=GALLERY_PORT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.changed = None
+        self.thread = threading.Thread(target=self.run, name='gallery-http', daemon=True)
+
+    def start(self):
+        if not AIOHTTP_AVAILABLE:
+            logger.error("Для галереи предпросмотра установите 'aiohttp'.")
+            return self
+        self.thread.start()
+        return self
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.changed = asyncio.Event()
+        app = web.Application()
+        app.add_routes([
+            web.get('/', self.index),
+            web.get('/api/pages', self.pages),
+            web.get('/pages/{id:\\d+}.png', self.page),
+            web.get('/thumbs/{id:\\d+}.jpg', self.thumbnail),
+            web.get('/events', self.events),
+        ])
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        try:
+            self.loop.run_until_complete(web.TCPSite(runner, self.host, self.port).start())
+        except OSError as e:
+            logger.error("Не удалось запустить галерею на %s:%s: %s", self.host, self.port, e)
+            self.loop.run_until_complete(runner.cleanup())
+            return
+        self.store.listeners.append(self.notify)
+        logger.info("Галерея предпросмотра доступна по адресу http://%s:%s/", self.host, self.port)
+        self.loop.run_forever()
+
+    def notify(self):
+        """Вызывается из потока получателя: будит подписчиков /events."""
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def index(self, request):
+        return web.Response(text=INDEX_HTML, content_type='text/html')
+
+    async def pages(self, request):
+        return web.json_response(self.store.list(), dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+    def _entry(self, request):
+        entry = self.store.get(int(request.match_info['id']))
+        if entry is None:
+            raise web.HTTPNotFound(text="Страница уже вытеснена из памяти")
+        return entry
+
+    async def page(self, request):
+        return web.Response(body=self._entry(request)['page'], content_type='image/png')
+
+    async def thumbnail(self, request):
+        return web.Response(body=self._entry(request)['thumbnail'], content_type='image/jpeg')
+
+    async def events(self, request):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        try:
+            while True:
+                changed = self.changed
+                try:
+                    await asyncio.wait_for(changed.wait(), GALLERY_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    await response.write(b': keepalive\n\n')
+                    continue
+                await response.write(f"data: {self.store.version}\n\n".encode('utf-8'))
+        except ConnectionResetError:
+            pass
+        return response
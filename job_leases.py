@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from botocore.exceptions import ClientError
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LEASES_ENABLED = False  # Включите, если один бакет обслуживают несколько станций печати
+LEASE_PREFIX = 'leases/'  # Префикс объектов аренды в бакете
+LEASE_SUFFIX = '.lease'  # Не .txt, чтобы аренда не попала в листинг заданий
+LEASE_TTL_SECONDS = 120  # Через сколько секунд без продления аренду может забрать другая станция
+LEASE_HEARTBEAT_SECONDS = 30  # Как часто продлевать удерживаемые аренды
+STATION_ID = f"{socket.gethostname()}:{os.getpid()}"  # Имя станции в объектах аренды
+
+# Результаты попытки взять задание
+LEASE_ACQUIRED = 'acquired'  # Аренда наша, файл можно печатать
+LEASE_BUSY = 'busy'  # Файл сейчас печатает другая станция
+LEASE_DONE = 'done'  # Файл уже обработан (на этой или другой станции)
+LEASE_ERROR = 'error'  # Не удалось связаться с хранилищем, стоит повторить позже
+
+# Состояния в объекте аренды
+STATE_ACTIVE = 'active'
+STATE_RELEASED = 'released'
+STATE_PRINTED = 'printed'
+STATE_FAILED = 'failed'
+FINAL_STATES = (STATE_PRINTED, STATE_FAILED)
+
+# Коды S3, означающие, что условие If-None-Match / If-Match не выполнено
+CONDITION_FAILED_CODES = {'PreconditionFailed', 'ConditionalRequestConflict'}
+
+LEASE_OPERATIONS = REGISTRY.counter(
+    'silent_print_lease_operations_total', "Операции с арендами заданий по результату", ('operation', 'outcome'))
+
+def _condition_failed(error):
+    return error.response.get('Error', {}).get('Code') in CONDITION_FAILED_CODES
+
+class LeaseManager:
+    """Аренды заданий в бакете, чтобы несколько станций делили один бакет.
+
+    Станция берет файл key, создавая объект LEASE_PREFIX + key + LEASE_SUFFIX
+    условной записью (If-None-Match: *): из нескольких станций ее создаст
+    только одна. В аренде записаны владелец, срок и состояние. Владелец
+    продлевает свои аренды в фоне; аренду, срок которой истек (станция
+    упала), другая станция забирает условной записью по ETag (If-Match).
+    После обработки аренда остается с итоговым состоянием, и файл больше
+    никто не берет; если итоговую запись отправить не удалось, фоновый
+    поток повторяет ее вместо продления. Часы станций должны быть
+    синхронизированы.
+    """
+
+    def __init__(self, s3_client, bucket_name, prefix=LEASE_PREFIX, ttl=LEASE_TTL_SECONDS,
+                 heartbeat=LEASE_HEARTBEAT_SECONDS, owner=STATION_ID):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.owner = owner
+        self.held = {}  # {ключ файла: ETag нашей аренды}
+        self.unsent = {}  # {ключ файла: (состояние, срок, операция)} — итоговые записи, которые не удалось отправить
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='lease-heartbeat', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает продление и отпускает удерживаемые аренды."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        for key in list(self.held):
+            if not self._retry_unsent(key):
+                self.release(key)
+
+    def lease_key(self, key):
+        return f"{self.prefix}{key}{LEASE_SUFFIX}"
+
+    def _put(self, key, state, expires, **condition):
+        body = json.dumps({'key': key, 'owner': self.owner, 'state': state, 'expires': expires})
+        response = self.s3_client.put_object(Bucket=self.bucket_name, Key=self.lease_key(key),
+                                             Body=body.encode('utf-8'), ContentType='application/json',
+                                             **condition)
+        return response['ETag']
+
+    def _read(self, key):
+        """Текущая аренда (запись, ETag) или None, если ее нет."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.lease_key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read()), response['ETag']
+
+    def acquire(self, key):
+        """Пытается взять файл. Возвращает LEASE_ACQUIRED, LEASE_BUSY, LEASE_DONE или LEASE_ERROR."""
+        try:
+            outcome = self._acquire(key)
+        except (ClientError, ValueError) as e:
+            logger.error("Ошибка при получении аренды %s: %s", key, e)
+            outcome = LEASE_ERROR
+        LEASE_OPERATIONS.inc(operation='acquire', outcome=outcome)
+        return outcome
+
+    def _hold(self, key, etag):
+        with self.lock:
+            self.held[key] = etag
+
+    def _acquire(self, key):
+        # Запросы к S3 идут без self.lock, чтобы не задерживать продление
+        # других аренд; сама аренда условная, и гонку решает хранилище
+        expires = time.time() + self.ttl
+        # Два круга: аренду могли удалить между неудачной записью и чтением
+        for _ in range(2):
+            try:
+                self._hold(key, self._put(key, STATE_ACTIVE, expires, IfNoneMatch='*'))
+                return LEASE_ACQUIRED
+            except ClientError as e:
+                if not _condition_failed(e):
+                    raise
+            current = self._read(key)
+            if current is None:
+                continue
+            record, etag = current
+            if record.get('state') in FINAL_STATES:
+                return LEASE_DONE
+            if record.get('state') == STATE_ACTIVE and record.get('expires', 0) > time.time():
+                return LEASE_BUSY
+            # Аренда отпущена или просрочена — забираем, если никто не успел раньше
+            try:
+                self._hold(key, self._put(key, STATE_ACTIVE, expires, IfMatch=etag))
+            except ClientError as e:
+                if not _condition_failed(e):
+                    raise
+                return LEASE_BUSY
+            if record.get('state') == STATE_ACTIVE:
+                logger.warning("Аренда %s станции %s просрочена, забираем задание", key, record.get('owner'))
+            return LEASE_ACQUIRED
+        return LEASE_BUSY
+
+    def _update(self, key, state, expires, operation):
+        """Условно перезаписывает свою аренду. Возвращает False, если ее уже забрали или запись не удалась.
+
+        Неудавшаяся итоговая запись (завершение или освобождение)
+        запоминается в unsent, и фоновый поток повторяет ее.
+        """
+        with self.lock:
+            etag = self.held.get(key)
+            if etag is None:
+                return False
+            if state == STATE_ACTIVE and key in self.unsent:
+                # Продление затерло бы итоговое состояние, которое еще не записано
+                return False
+            try:
+                new_etag = self._put(key, state, expires, IfMatch=etag)
+            except ClientError as e:
+                if _condition_failed(e):
+                    self.held.pop(key, None)
+                    self.unsent.pop(key, None)
+                    logger.warning("Аренду %s забрала другая станция", key)
+                    LEASE_OPERATIONS.inc(operation=operation, outcome='lost')
+                    return False
+                if state != STATE_ACTIVE:
+                    self.unsent[key] = (state, expires, operation)
+                logger.error("Ошибка при обновлении аренды %s: %s", key, e)
+                LEASE_OPERATIONS.inc(operation=operation, outcome=LEASE_ERROR)
+                return False
+            if state == STATE_ACTIVE:
+                self.held[key] = new_etag
+            else:
+                self.held.pop(key, None)
+                self.unsent.pop(key, None)
+        LEASE_OPERATIONS.inc(operation=operation, outcome='ok')
+        return True
+
+    def renew(self, key):
+        """Продлевает аренду на ttl секунд."""
+        return self._update(key, STATE_ACTIVE, time.time() + self.ttl, 'renew')
+
+    def complete(self, key, failed=False):
+        """Отмечает файл обработанным: другие станции его больше не возьмут."""
+        return self._update(key, STATE_FAILED if failed else STATE_PRINTED, None, 'complete')
+
+    def release(self, key):
+        """Отпускает аренду, чтобы файл сразу могла взять любая станция."""
+        return self._update(key, STATE_RELEASED, 0, 'release')
+
+    def _retry_unsent(self, key):
+        """Повторяет итоговую запись key, если она не была отправлена. Возвращает, была ли такая запись."""
+        unsent = self.unsent.get(key)
+        if unsent is None:
+            return False
+        state, expires, operation = unsent
+        self._update(key, state, expires, operation)
+        return True
+
+    def beat(self):
+        """Продлевает удерживаемые аренды, а для обработанных файлов повторяет итоговую запись."""
+        for key in list(self.held):
+            if not self._retry_unsent(key):
+                self.renew(key)
+
+    def run(self):
+        while not self.stopped.wait(self.heartbeat):
+            self.beat()
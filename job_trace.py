@@ -0,0 +1,130 @@
+import json
+import logging
+import math
+import threading
+import datetime
+import collections
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+JOB_TRACE_FILE = 'job_traces.jsonl'  # Структурированные записи о каждом задании
+LATENCY_WINDOW = 500  # Сколько последних заданий учитывать в скользящих перцентилях
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+END_TO_END_SECONDS = REGISTRY.histogram(
+    'silent_print_upload_to_paper_seconds', "Время от загрузки в S3 до выхода страницы",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600))
+END_TO_END_QUANTILES = REGISTRY.gauge(
+    'silent_print_upload_to_paper_rolling_seconds', "Скользящие перцентили времени от загрузки до печати",
+    ('quantile',))
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+class JobTrace:
+    """Отметки времени одного задания печати.
+
+    s3_last_modified — время загрузки объекта, остальные события
+    (discovered, fetch_start, fetch_end, render_start, render_end,
+    spool_start, spool_end, completed) ставятся по мере обработки.
+    """
+
+    def __init__(self, key, s3_last_modified=None):
+        self.key = key
+        self.s3_last_modified = s3_last_modified
+        self.events = {}
+        self.print_job = None  # (имя принтера, id задания в спулере), если известно
+        self.completion_source = None
+        self.mark('discovered')
+
+    def mark(self, event):
+        """Ставит отметку события текущим временем."""
+        self.events[event] = _now()
+
+    def end_to_end_seconds(self):
+        """Время от LastModified объекта до завершения печати или None."""
+        completed = self.events.get('completed')
+        if completed is None or self.s3_last_modified is None:
+            return None
+        return (completed - self.s3_last_modified).total_seconds()
+
+    def to_record(self, result):
+        return {
+            'key': self.key,
+            'result': result,
+            's3_last_modified': self.s3_last_modified.isoformat() if self.s3_last_modified else None,
+            'events': {name: value.isoformat() for name, value in self.events.items()},
+            'completion_source': self.completion_source,
+            'end_to_end_seconds': self.end_to_end_seconds(),
+        }
+
+class LatencyTracker:
+    """Скользящее окно значений задержки с перцентилями по рангу."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.values = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.values.append(seconds)
+
+    def percentile(self, quantile):
+        with self.lock:
+            values = sorted(self.values)
+        if not values:
+            return None
+        rank = max(1, math.ceil(quantile * len(values)))
+        return values[rank - 1]
+
+    def percentiles(self):
+        return {quantile: self.percentile(quantile) for quantile in LATENCY_QUANTILES}
+
+class TraceWriter:
+    """Дописывает записи о заданиях в JSONL файл (потокобезопасно)."""
+
+    def __init__(self, path=JOB_TRACE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            except Exception as e:
+                logger.error("Ошибка при записи трассировки задания: %s", e)
+
+LATENCY = LatencyTracker()
+TRACE_WRITER = TraceWriter()
+
+for _quantile in LATENCY_QUANTILES:
+    END_TO_END_QUANTILES.set_function(
+        lambda quantile=_quantile: LATENCY.percentile(quantile) or 0.0, quantile=str(_quantile))
+
+def finish_trace(trace, result, completion_source='spool'):
+    """Завершает трассировку: пишет запись и обновляет статистику задержек.
+
+    Если завершение печати не отмечено отдельно (принтер не сообщил о
+    нем), за него принимается момент окончания постановки в спулер.
+    """
+    if 'completed' not in trace.events and result == 'printed':
+        trace.events['completed'] = trace.events.get('spool_end', _now())
+    if trace.completion_source is None:
+        trace.completion_source = completion_source
+    TRACE_WRITER.write(trace.to_record(result))
+    seconds = trace.end_to_end_seconds()
+    if seconds is not None:
+        LATENCY.add(seconds)
+        END_TO_END_SECONDS.observe(seconds)
+
+def format_latency_summary():
+    """Строка со скользящими p50/p95/p99 для вывода в консоль."""
+    parts = []
+    for quantile, value in LATENCY.percentiles().items():
+        label = f"p{int(quantile * 100)}"
+        parts.append(f"{label}={value:.1f}с" if value is not None else f"{label}=—")
+    return ', '.join(parts)
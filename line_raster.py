@@ -0,0 +1,160 @@
+import os
+import logging
+
+from startup import lazy_import
+from pillow_features import probe_pillow_features
+from logging_setup import RATE_LIMITED
+
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+ImageFont = lazy_import('PIL.ImageFont')
+emoji = lazy_import('emoji')
+
+logger = logging.getLogger(__name__)
+
+class Sprite:
+    """Отрисованный эмодзи, уменьшенный до высоты эмодзи шаблона.
+
+    ascent — расстояние от верха спрайта до базовой линии, advance — ширина,
+    на которую эмодзи сдвигает следующий текст.
+    """
+
+    def __init__(self, image, ascent):
+        self.image = image
+        self.ascent = ascent
+        self.advance = image.width
+
+def render_sprite(font, sequence, emoji_height):
+    """Рисует эмодзи шрифтом font и уменьшает до высоты emoji_height.
+
+    Возвращает Sprite или None, если в шрифте нет глифа.
+    """
+    ascent, descent = font.getmetrics()
+    width = int(font.getlength(sequence) + 0.5)
+    if width <= 0 or ascent + descent <= 0:
+        return None
+    canvas = Image.new('RGBA', (width, ascent + descent), (0, 0, 0, 0))
+    ImageDraw.Draw(canvas).text((0, 0), sequence, font=font, fill=(0, 0, 0, 255),
+                                **probe_pillow_features().text_kwargs(color=True))
+    if canvas.getbbox() is None:
+        return None
+    scale = emoji_height / font.size
+    size = (max(1, round(width * scale)), max(1, round((ascent + descent) * scale)))
+    return Sprite(canvas.resize(size, Image.LANCZOS), round(ascent * scale))
+
+class LineRasterizer:
+    """Раскладывает строки на прогоны шрифтов и рисует их за один проход.
+
+    Строка делится на прогоны обычного текста и эмодзи. Смещение каждого
+    прогона — накопленная сумма ширин предыдущих, поэтому ширина считается
+    один раз на прогон, а не для каждого префикса строки. Текст рисуется
+    шрифтом шаблона, эмодзи — спрайтами, которые накладываются на
+    страницу одним общим слоем. Спрайты берутся из собранного атласа
+    atlas (EmojiAtlas), а чего в нем нет — рисуются шрифтами эмодзи.
+    """
+
+    def __init__(self, template, font, emoji_font=None, fallback_emoji_paths=(), atlas=None):
+        self.template = template
+        self.font = font
+        self.emoji_font = emoji_font
+        self.atlas = atlas
+        used_path = getattr(emoji_font, 'path', None)
+        self.fallback_emoji_paths = [path for path in fallback_emoji_paths
+                                     if path != used_path and os.path.exists(path)]
+        self.fallback_fonts = None
+        self.text_ascent = font.getmetrics()[0] if hasattr(font, 'getmetrics') else 0
+        self.sprites = {}  # {последовательность эмодзи: Sprite или None}
+
+    def _emoji_fonts(self):
+        if self.fallback_fonts is None:
+            pillow = probe_pillow_features()
+            self.fallback_fonts = []
+            for path in self.fallback_emoji_paths:
+                try:
+                    self.fallback_fonts.append(ImageFont.truetype(path, self.template.emoji_font_size,
+                                                                  **pillow.truetype_kwargs(complex_layout=True)))
+                except OSError as e:
+                    logger.warning("Не удалось загрузить запасной шрифт эмодзи %s: %s", path, e, extra=RATE_LIMITED)
+        return [font for font in [self.emoji_font] + self.fallback_fonts if font is not None]
+
+    def sprite(self, sequence):
+        """Спрайт эмодзи из атласа или первого шрифта, где он есть (один раз на последовательность)."""
+        if sequence not in self.sprites:
+            sprite = self.atlas.sprite(sequence) if self.atlas is not None else None
+            if sprite is not None:
+                self.sprites[sequence] = sprite
+                return sprite
+            for font in self._emoji_fonts():
+                sprite = render_sprite(font, sequence, self.template.emoji_height)
+                if sprite is not None:
+                    break
+            else:
+                logger.debug("Эмодзи %r нет в шрифтах эмодзи, рисуем шрифтом текста", sequence)
+            self.sprites[sequence] = sprite
+        return self.sprites[sequence]
+
+    def runs(self, line):
+        """Делит строку на прогоны: (текст, None) и (эмодзи, Sprite)."""
+        if self.emoji_font is None and self.atlas is None:
+            return [(line, None)] if line else []
+        runs = []
+        text_start = 0
+        for match in emoji.emoji_list(line):
+            sprite = self.sprite(match['emoji'])
+            if sprite is None:
+                # Без спрайта эмодзи остается частью текстового прогона
+                continue
+            if match['match_start'] > text_start:
+                runs.append((line[text_start:match['match_start']], None))
+            runs.append((match['emoji'], sprite))
+            text_start = match['match_end']
+        if text_start < len(line):
+            runs.append((line[text_start:], None))
+        return runs
+
+    def layout(self, line):
+        """Прогоны строки с накопленными смещениями: [(x, текст, Sprite или None)] и ширина."""
+        placed = []
+        x = 0
+        for run, sprite in self.runs(line):
+            placed.append((x, run, sprite))
+            x += sprite.advance if sprite is not None else self.font.getlength(run)
+        return placed, x
+
+    def measure(self, line):
+        """Ширина строки в пикселях с учетом ширины эмодзи."""
+        return self.layout(line)[1]
+
+    def draw_lines(self, img, lines, x, y, line_height):
+        """Рисует строки на странице начиная с (x, y).
+
+        Каждый текстовый прогон рисуется один раз со своим смещением, а
+        эмодзи собираются на одном прозрачном слое по размеру занятой ими
+        области, который накладывается на страницу одной операцией.
+        """
+        draw = ImageDraw.Draw(img)
+        placements = []
+        baseline = self.text_ascent
+        for i, line in enumerate(lines):
+            line_y = y + i * line_height
+            placed, _ = self.layout(line)
+            for offset, run, sprite in placed:
+                if sprite is None:
+                    draw.text((x + offset, line_y), run, fill=self.template.color, font=self.font)
+                else:
+                    placements.append((sprite, max(0, int(x + offset)),
+                                       max(0, int(line_y + baseline - sprite.ascent))))
+        if not placements:
+            return img
+        left = min(px for _, px, _ in placements)
+        top = min(py for _, _, py in placements)
+        right = max(px + sprite.image.width for sprite, px, _ in placements)
+        bottom = max(py + sprite.image.height for sprite, _, py in placements)
+        overlay = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+        for sprite, px, py in placements:
+            overlay.alpha_composite(sprite.image, (px - left, py - top))
+        if img.mode == 'RGBA' and right <= img.width and bottom <= img.height:
+            img.alpha_composite(overlay, (left, top))
+        else:
+            img.paste(overlay, (left, top), overlay)
+        return img
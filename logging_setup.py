@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LOG_LEVEL = os.environ.get('SILENT_PRINT_LOG_LEVEL', 'INFO')  # Уровень логирования (DEBUG для отладки рендеринга)
+LOG_FILE = 'silent_print.log'  # Файл журнала; None — только консоль
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+LOG_RATE_LIMIT_SECONDS = 60  # Повторяющиеся сообщения (extra=RATE_LIMITED) выводятся не чаще раза за этот интервал
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+# Пометка повторяющихся сообщений (эмодзи, шрифты, недоступный S3):
+# logger.warning("...", arg, extra=RATE_LIMITED). Остальные сообщения не ограничиваются.
+RATE_LIMITED = {'rate_limit': True}
+
+_listener = None
+_listener_pid = None
+
+class RateLimitFilter(logging.Filter):
+    """Подавляет повторы сообщений, помеченных extra=RATE_LIMITED.
+
+    Помеченные сообщения сравниваются по логгеру и шаблону (без
+    подстановки аргументов), поэтому, например, ошибки отрисовки разных
+    эмодзи считаются повторами. Непомеченные сообщения (обработка
+    файлов, ошибки скачивания) проходят всегда. Когда интервал истекает,
+    следующее сообщение получает пометку о числе подавленных повторов.
+    """
+
+    def __init__(self, interval=LOG_RATE_LIMIT_SECONDS):
+        super().__init__()
+        self.interval = interval
+        self.last_seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.interval <= 0 or not getattr(record, 'rate_limit', False):
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            state = self.last_seen.get(key)
+            if state is not None and now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            suppressed = state[1] if state is not None else 0
+            self.last_seen[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{record.msg} (повторилось еще {suppressed} раз)"
+        return True
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE):
+    """Настраивает логирование: консоль и файл через фоновый поток.
+
+    Вызывающий поток только подставляет аргументы в сообщение
+    (QueueHandler.prepare) и кладет запись в очередь; форматирование
+    строки журнала и запись в консоль и файл выполняет QueueListener в
+    отдельном потоке, поэтому медленная консоль Windows не тормозит
+    обработку. Повторная настройка в том же процессе ничего не делает.
+    """
+    global _listener, _listener_pid
+    # После fork поток слушателя в дочернем процессе не существует
+    if _listener is not None and _listener_pid == os.getpid():
+        return _listener
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(formatter)
+    handlers.append(console)
+    if log_file:
+        try:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        except OSError as e:
+            print(f"Не удалось открыть файл журнала '{log_file}': {e}")
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    # Отладочные сообщения Pillow о разборе PNG бесполезны и очень многословны
+    logging.getLogger('PIL').setLevel(max(root.level, logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,222 @@
+import os
+import sys
+import logging
+import threading
+import contextlib
+import tracemalloc
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MONITOR_ENABLED = True  # Следить ли за памятью процесса
+MEMORY_REPORT_INTERVAL_SECONDS = 600  # Как часто выводить отчет о памяти
+TRACEMALLOC_ENABLED = False  # Подробный учет выделений Python; замедляет работу, включайте для поиска утечек
+TRACEMALLOC_FRAMES = 1  # Глубина стека, сохраняемого для каждого выделения
+MEMORY_TOP_ALLOCATIONS = 10  # Сколько строк кода с наибольшим ростом показывать в отчете
+MEMORY_GROWTH_WARMUP_JOBS = 20  # Первые задания прогревают кэши и шрифты, их рост не учитывается
+MEMORY_GROWTH_WINDOW_JOBS = 50  # За сколько заданий оценивается рост памяти
+MEMORY_GROWTH_WARN_BYTES_PER_JOB = 256 * 1024  # Порог роста на задание для предупреждения
+
+MEMORY_RSS = REGISTRY.gauge(
+    'silent_print_memory_rss_bytes', "Резидентная память процесса")
+MEMORY_TRACED = REGISTRY.gauge(
+    'silent_print_memory_traced_bytes', "Память, выделенная Python (при включенном tracemalloc)")
+MEMORY_GROWTH = REGISTRY.gauge(
+    'silent_print_memory_growth_per_job_bytes', "Рост памяти на задание за последнее окно заданий")
+JOB_MEMORY_DELTA = REGISTRY.histogram(
+    'silent_print_job_memory_delta_bytes', "Изменение памяти за обработку одного файла",
+    buckets=(0, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864))
+TRACKED_ITEMS = REGISTRY.gauge(
+    'silent_print_tracked_items', "Размер долгоживущих коллекций (история печати, снимок бакета)", ('collection',))
+
+def rss_bytes():
+    """Резидентная память процесса в байтах или None, если ее не узнать."""
+    if sys.platform.startswith('win32'):
+        return _windows_rss_bytes()
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _windows_rss_bytes():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    try:
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+    except (OSError, AttributeError):
+        return None
+
+def format_bytes(value):
+    if value is None:
+        return '?'
+    for unit in ('Б', 'КБ', 'МБ'):
+        if abs(value) < 1024:
+            return f"{value:.0f} {unit}" if unit == 'Б' else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ГБ"
+
+class MemoryMonitor:
+    """Следит за памятью долго работающего наблюдателя.
+
+    Раз в interval секунд выводит резидентную память, размеры долгоживущих
+    коллекций (track) и, если включен tracemalloc, строки кода с
+    наибольшим ростом выделений с прошлого отчета. Для каждого задания
+    (job) замеряет изменение памяти, а после прогрева раз в window заданий
+    оценивает рост на задание и предупреждает, если он выше порога. При
+    включенном tracemalloc меряется память Python, иначе — RSS, которая
+    растет и из-за буферов Pillow и FreeType.
+    """
+
+    def __init__(self, interval=MEMORY_REPORT_INTERVAL_SECONDS, trace=TRACEMALLOC_ENABLED,
+                 frames=TRACEMALLOC_FRAMES, top=MEMORY_TOP_ALLOCATIONS, warmup=MEMORY_GROWTH_WARMUP_JOBS,
+                 window=MEMORY_GROWTH_WINDOW_JOBS, threshold=MEMORY_GROWTH_WARN_BYTES_PER_JOB):
+        self.interval = interval
+        self.trace = trace
+        self.frames = frames
+        self.top = top
+        self.warmup = warmup
+        self.window = window
+        self.threshold = threshold
+        self.collections = {}  # {название: функция, возвращающая размер}
+        self.jobs = 0
+        self.window_start = None  # Память в начале текущего окна заданий
+        self.growth_per_job = None
+        self.growth_snapshot = None  # Снимок tracemalloc в начале окна
+        self.report_snapshot = None  # Снимок tracemalloc прошлого отчета
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='memory-monitor', daemon=True)
+
+    def start(self):
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            logger.info("Учет выделений памяти (tracemalloc) включен, глубина стека %s", self.frames)
+        self.report_snapshot = self.snapshot()
+        MEMORY_RSS.set_function(rss_bytes)
+        MEMORY_TRACED.set_function(lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.report()
+
+    def track(self, name, size_function):
+        """Добавляет в отчеты и метрики размер коллекции, например истории печати."""
+        self.collections[name] = size_function
+        TRACKED_ITEMS.set_function(size_function, collection=name)
+
+    def usage(self):
+        """Текущая память: выделенная Python при tracemalloc, иначе RSS."""
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return rss_bytes()
+
+    def snapshot(self):
+        if not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def top_growth(self, since):
+        """Строки кода с наибольшим ростом выделений со снимка since."""
+        current = self.snapshot()
+        if current is None or since is None:
+            return current, []
+        stats = [stat for stat in current.compare_to(since, 'lineno') if stat.size_diff > 0]
+        return current, stats[:self.top]
+
+    @contextlib.contextmanager
+    def job(self, key):
+        """Замеряет изменение памяти за обработку файла key.
+
+        Фоновые потоки (получатели страниц, перенос объектов) работают
+        одновременно, поэтому отдельный замер приблизителен; надежна
+        оценка роста за окно заданий.
+        """
+        before = self.usage()
+        try:
+            yield
+        finally:
+            after = self.usage()
+            delta = None if before is None or after is None else after - before
+            if delta is not None:
+                JOB_MEMORY_DELTA.observe(delta)
+                logger.debug("Память после файла %s: %s (%+d Б)", key, format_bytes(after), delta)
+            self.job_finished(key, after)
+
+    def job_finished(self, key, usage=None):
+        """Учитывает завершенное задание и раз в окно оценивает рост памяти на задание."""
+        if usage is None:
+            usage = self.usage()
+        if usage is None:
+            return
+        with self.lock:
+            self.jobs += 1
+            if self.jobs < self.warmup:
+                return
+            if self.window_start is None or self.jobs - self.window_start[0] >= self.window:
+                previous, self.window_start = self.window_start, (self.jobs, usage)
+                previous_snapshot, self.growth_snapshot = self.growth_snapshot, self.snapshot()
+            else:
+                return
+        if previous is None:
+            return
+        jobs, start_usage = previous
+        self.growth_per_job = (usage - start_usage) / (self.jobs - jobs)
+        MEMORY_GROWTH.set(self.growth_per_job)
+        if self.growth_per_job <= self.threshold:
+            return
+        logger.warning("Память растет на %s на файл (за последние %s файлов, сейчас %s) — возможна утечка",
+                       format_bytes(self.growth_per_job), self.jobs - jobs, format_bytes(usage))
+        if previous_snapshot is not None:
+            stats = [stat for stat in self.growth_snapshot.compare_to(previous_snapshot, 'lineno')
+                     if stat.size_diff > 0][:self.top]
+            for stat in stats:
+                logger.warning("  %s", stat)
+
+    def report(self):
+        """Выводит память процесса, размеры коллекций и рост выделений с прошлого отчета."""
+        parts = [f"RSS {format_bytes(rss_bytes())}"]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            parts.append(f"Python {format_bytes(current)} (пик {format_bytes(peak)})")
+        if self.growth_per_job is not None:
+            parts.append(f"рост {format_bytes(self.growth_per_job)}/файл")
+        for name, size_function in self.collections.items():
+            try:
+                parts.append(f"{name}: {size_function()}")
+            except Exception:
+                continue
+        logger.info("Память: %s, файлов обработано: %s", ', '.join(parts), self.jobs)
+        self.report_snapshot, stats = self.top_growth(self.report_snapshot)
+        if stats:
+            logger.info("Наибольший рост выделений с прошлого отчета:\n%s", '\n'.join(f"  {stat}" for stat in stats))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                logger.error("Ошибка при отчете о памяти: %s", e)
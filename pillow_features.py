@@ -0,0 +1,74 @@
+import inspect
+import logging
+import threading
+
+from startup import lazy_import
+
+ImageDraw = lazy_import('PIL.ImageDraw')
+ImageFont = lazy_import('PIL.ImageFont')
+PIL_features = lazy_import('PIL.features')
+
+logger = logging.getLogger(__name__)
+
+COLOR_FONT_FREETYPE_VERSION = (2, 10)  # Цветные шрифты (CBDT/COLR) FreeType рисует начиная с 2.10
+
+def _version_tuple(version):
+    parts = []
+    for part in (version or '').split('.'):
+        if not part.isdigit():
+            break
+        parts.append(int(part))
+    return tuple(parts)
+
+def _accepts(function, name):
+    try:
+        return name in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+
+class PillowFeatures:
+    """Возможности установленного Pillow для рендеринга текста.
+
+    Определяются один раз (probe_pillow_features), после чего рендеринг
+    вызывает ImageFont.truetype и ImageDraw.text сразу с подходящими
+    аргументами, без цепочек try/except на каждый вызов.
+    """
+
+    def __init__(self):
+        self.raqm = bool(PIL_features.check('raqm'))
+        # Pillow 10+ хранит движки в ImageFont.Layout, старые версии — в LAYOUT_*
+        layout = getattr(ImageFont, 'Layout', None)
+        self.raqm_layout = getattr(layout, 'RAQM', None) if layout else getattr(ImageFont, 'LAYOUT_RAQM', None)
+        self.truetype_layout_engine = _accepts(ImageFont.truetype, 'layout_engine')
+        self.text_embedded_color = _accepts(ImageDraw.ImageDraw.text, 'embedded_color')
+        freetype = _version_tuple(PIL_features.version('freetype2'))
+        self.color_fonts = self.text_embedded_color and freetype >= COLOR_FONT_FREETYPE_VERSION
+
+    def truetype_kwargs(self, complex_layout=False):
+        """Аргументы ImageFont.truetype: движок RAQM, если он нужен и доступен."""
+        if complex_layout and self.raqm and self.truetype_layout_engine and self.raqm_layout is not None:
+            return {'layout_engine': self.raqm_layout}
+        return {}
+
+    def text_kwargs(self, color=False):
+        """Аргументы ImageDraw.text: цветные глифы, если они нужны и поддерживаются."""
+        if color and self.color_fonts:
+            return {'embedded_color': True}
+        return {}
+
+    def describe(self):
+        return (f"RAQM: {'да' if self.raqm else 'нет'}, "
+                f"цветные шрифты: {'да' if self.color_fonts else 'нет'}")
+
+_features = None
+_features_lock = threading.Lock()
+
+def probe_pillow_features():
+    """Возвращает возможности Pillow, определяя их при первом вызове."""
+    global _features
+    if _features is None:
+        with _features_lock:
+            if _features is None:
+                _features = PillowFeatures()
+                logger.info("Возможности Pillow: %s", _features.describe())
+    return _features
@@ -0,0 +1,222 @@
+import io
+import os
+import logging
+import queue
+import datetime
+import threading
+import concurrent.futures
+from botocore.exceptions import ClientError
+
+from metrics import time_stage
+from text_payload import strip_text_suffix
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_DIR = 'previews'  # Директория для сохранения предпросмотров
+PREVIEW_OPEN_VIEWER = True  # Открывать ли предпросмотр в программе просмотра (только Windows)
+ARCHIVE_PREFIX = 'archive/'  # Префикс в бакете, куда архивируются готовые страницы
+
+class RenderedPage:
+    """Готовая страница одного файла, общая для всех получателей.
+
+    Получатели только читают изображение; PNG кодируется один раз при
+    первом запросе и переиспользуется. paper_size — формат бумаги шаблона,
+    number — номер страницы в файле (с 1).
+    """
+
+    def __init__(self, key, image, trace=None, paper_size='A5', number=1):
+        self.key = key
+        self.image = image
+        self.trace = trace
+        self.paper_size = paper_size
+        self.number = number
+        self.lock = threading.Lock()
+        self._png = None
+
+    def suffix(self):
+        """Суффикс имени файла для второй и следующих страниц ('' для первой)."""
+        return f"-{self.number}" if self.number > 1 else ''
+
+    def png_bytes(self):
+        with self.lock:
+            if self._png is None:
+                buffer = io.BytesIO()
+                self.image.save(buffer, 'PNG')
+                self._png = buffer.getvalue()
+            return self._png
+
+class Sink:
+    """Получатель готовых страниц со своей очередью и потоком.
+
+    Медленный получатель (например, архив в S3) не задерживает остальных.
+    required — от результата получателя зависит, считается ли файл
+    обработанным: fan_out ждет только обязательных получателей.
+    """
+    name = 'sink'
+
+    def __init__(self, required=False):
+        self.required = required
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=f'sink-{self.name}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, page):
+        """Ставит страницу в очередь и возвращает Future с результатом handle."""
+        future = concurrent.futures.Future()
+        self.queue.put((page, future))
+        return future
+
+    def stop(self):
+        """Дожидается обработки всех страниц в очереди."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            page, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = bool(self.handle(page))
+            except Exception as e:
+                logger.error("Ошибка получателя '%s' для %s: %s", self.name, page.key, e)
+                result = False
+            future.set_result(result)
+
+    def handle(self, page):
+        """Обрабатывает страницу; возвращает True при успехе."""
+        raise NotImplementedError
+
+class PreviewSink(Sink):
+    """Сохраняет предпросмотр страницы в директорию."""
+    name = 'preview'
+
+    def __init__(self, directory=PREVIEW_DIR, open_viewer=PREVIEW_OPEN_VIEWER, required=False):
+        super().__init__(required)
+        self.directory = directory
+        self.open_viewer = open_viewer
+
+    def handle(self, page):
+        with time_stage('preview'):
+            os.makedirs(self.directory, exist_ok=True)
+            # Имя файла на основе оригинального имени и временной метки
+            base_name = strip_text_suffix(os.path.basename(page.key))
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            preview_path = os.path.join(self.directory, f"{base_name}_{timestamp}{page.suffix()}.png")
+            with open(preview_path, 'wb') as f:
+                f.write(page.png_bytes())
+        logger.info("Предпросмотр сохранен: %s", preview_path)
+        if self.open_viewer and hasattr(os, 'startfile'):
+            # Открываем изображение в программе просмотра по умолчанию
+            os.startfile(preview_path)
+        return True
+
+class ArchiveSink(Sink):
+    """Сохраняет готовую страницу в бакет под префиксом ARCHIVE_PREFIX."""
+    name = 'archive'
+
+    def __init__(self, s3_client, bucket_name, prefix=ARCHIVE_PREFIX, required=False):
+        super().__init__(required)
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def handle(self, page):
+        archive_key = f"{self.prefix}{strip_text_suffix(page.key)}{page.suffix()}.png"
+        try:
+            with time_stage('archive'):
+                self.s3_client.put_object(Bucket=self.bucket_name, Key=archive_key,
+                                          Body=page.png_bytes(), ContentType='image/png')
+        except ClientError as e:
+            logger.error("Ошибка при архивировании %s в %s: %s", page.key, archive_key, e)
+            return False
+        logger.debug("Страница %s сохранена в архив: %s", page.key, archive_key)
+        return True
+
+class PageStream:
+    """Страницы одного сообщения, которые рендерит один поток, а получателям отдает другой.
+
+    fill складывает готовые страницы в очередь и не ждет получателей,
+    поэтому сообщение, ожидающее своей очереди на доставку, продолжает
+    рендериться. Итерация отдает страницы по мере готовности; close
+    (его вызывает fan_out, когда доставка прервана) останавливает
+    рендеринг после текущей страницы.
+    """
+    _END = object()
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.closed = threading.Event()
+
+    def fill(self, pages):
+        try:
+            for page in pages:
+                if self.closed.is_set():
+                    break
+                self.queue.put(page)
+        finally:
+            self.queue.put(self._END)
+
+    def __iter__(self):
+        while (page := self.queue.get()) is not self._END:
+            yield page
+
+    def close(self):
+        self.closed.set()
+
+def _succeeded(future):
+    try:
+        return future.result()
+    except concurrent.futures.CancelledError:
+        return False
+
+def fan_out(pages, sinks):
+    """Отдает страницы всем получателям.
+
+    pages — страница или итерируемое страниц (например, генератор, который
+    рендерит их по одной): каждая страница уходит получателям сразу, не
+    дожидаясь следующих. Необязательные получатели работают в фоне;
+    возвращает True, если все обязательные получатели обработали все
+    страницы успешно. Как только обязательный получатель не справился,
+    файл все равно будет повторен целиком, поэтому следующие страницы
+    больше не рендерятся, а еще не напечатанные снимаются с очереди
+    обязательных получателей — иначе они вышли бы на бумагу дважды.
+    """
+    if isinstance(pages, RenderedPage):
+        pages = (pages,)
+    lock = threading.Lock()
+    required = []  # Future обязательных получателей по всем страницам
+    failed = False
+
+    def page_done(future):
+        nonlocal failed
+        if _succeeded(future):
+            return
+        with lock:
+            failed = True
+            pending = list(required)
+        for other in pending:
+            other.cancel()
+
+    try:
+        for page in pages:
+            with lock:
+                if failed:
+                    break
+                futures = [(sink, sink.submit(page)) for sink in sinks]
+                required.extend(future for sink, future in futures if sink.required)
+            for sink, future in futures:
+                if sink.required:
+                    future.add_done_callback(page_done)
+    finally:
+        if hasattr(pages, 'close'):
+            pages.close()
+    # Дожидаемся страниц, которые уже печатаются, даже если одна не удалась
+    return all([_succeeded(future) for future in required])
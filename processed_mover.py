@@ -0,0 +1,91 @@
+import time
+import logging
+import queue
+import threading
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+MOVE_PROCESSED_OBJECTS = False  # Переносить обработанные объекты из отслеживаемого префикса
+PRINTED_PREFIX = 'printed/'  # Куда переносятся напечатанные объекты
+FAILED_PREFIX = 'failed/'  # Куда переносятся объекты, которые не удалось отрендерить
+MOVE_BATCH_SIZE = 1000  # Максимум ключей в одном запросе delete_objects
+MOVE_FLUSH_INTERVAL_SECONDS = 5  # Как часто удалять накопленные оригиналы
+
+def is_processed_key(key):
+    """Проверяет, лежит ли объект в одном из префиксов для обработанных файлов."""
+    return key.startswith(PRINTED_PREFIX) or key.startswith(FAILED_PREFIX)
+
+class ProcessedMover:
+    """Фоновый перенос обработанных объектов в printed/ или failed/.
+
+    Объект копируется на стороне сервера (copy_object) сразу, а оригиналы
+    удаляются пачками через delete_objects. Работает в отдельном потоке,
+    поэтому не задерживает печать.
+    """
+
+    def __init__(self, s3_client, bucket_name):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.queue = queue.Queue()
+        self.to_delete = []
+        self.last_flush_time = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name='processed-mover', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def move(self, key, failed=False):
+        """Ставит объект в очередь на перенос."""
+        self.queue.put((key, failed))
+
+    def stop(self):
+        """Дожидается переноса всех поставленных в очередь объектов."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=MOVE_FLUSH_INTERVAL_SECONDS)
+            except queue.Empty:
+                item = False
+            if item is None:
+                self.flush()
+                return
+            if item:
+                self.copy(*item)
+            if (len(self.to_delete) >= MOVE_BATCH_SIZE or
+                    time.monotonic() - self.last_flush_time >= MOVE_FLUSH_INTERVAL_SECONDS):
+                self.flush()
+
+    def copy(self, key, failed):
+        """Копирует объект в целевой префикс и откладывает удаление оригинала."""
+        destination = (FAILED_PREFIX if failed else PRINTED_PREFIX) + key
+        try:
+            self.s3_client.copy_object(
+                Bucket=self.bucket_name,
+                Key=destination,
+                CopySource={'Bucket': self.bucket_name, 'Key': key},
+            )
+            self.to_delete.append(key)
+        except ClientError as e:
+            logger.error("Ошибка при копировании %s в %s: %s", key, destination, e)
+
+    def flush(self):
+        """Удаляет накопленные оригиналы пачками."""
+        self.last_flush_time = time.monotonic()
+        while self.to_delete:
+            batch = self.to_delete[:MOVE_BATCH_SIZE]
+            del self.to_delete[:MOVE_BATCH_SIZE]
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True},
+                )
+                for error in response.get('Errors', ()):
+                    logger.error("Ошибка при удалении %s: %s", error.get('Key'), error.get('Message'))
+            except ClientError as e:
+                logger.error("Ошибка при пакетном удалении обработанных объектов: %s", e)
@@ -0,0 +1,231 @@
+import os
+import json
+import logging
+import hashlib
+import queue
+import tempfile
+import threading
+import collections
+
+from startup import lazy_import
+from metrics import REGISTRY
+
+Image = lazy_import('PIL.Image')
+PngImagePlugin = lazy_import('PIL.PngImagePlugin')
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_ENABLED = True  # Кэшировать ли готовые страницы
+RENDER_CACHE_DIR = 'render_cache'  # Директория дискового уровня кэша
+RENDER_CACHE_MEMORY_BYTES = 128 * 1024 * 1024  # Предел памяти под растры страниц
+RENDER_CACHE_DISK_BYTES = 1024 * 1024 * 1024  # Предел размера дискового уровня
+RENDER_CACHE_WRITE_QUEUE = 32  # Сколько страниц может ждать записи на диск; лишние на диск не попадают
+MESSAGE_PAGES_INFO = 'silent-print-pages'  # Текстовый фрагмент PNG первой страницы с числом страниц сообщения
+
+RENDER_CACHE_REQUESTS = REGISTRY.counter(
+    'silent_print_render_cache_requests_total', "Обращения к кэшу страниц по уровню попадания", ('tier',))
+
+def file_fingerprint(path):
+    """Путь, размер и время изменения файла (или None, если его нет)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def cache_key(text_content, template_path, font_paths, layout):
+    """Ключ по содержимому: текст, шаблон, шрифты и параметры раскладки.
+
+    Шаблон и шрифты учитываются по размеру и времени изменения, поэтому
+    замена файла делает старые записи недостижимыми.
+    """
+    payload = json.dumps([
+        text_content,
+        file_fingerprint(template_path),
+        [file_fingerprint(path) for path in font_paths],
+        layout,
+    ], ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+def _image_bytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+class RenderCache:
+    """Двухуровневый кэш готовых страниц: LRU растров в памяти и PNG на диске.
+
+    Сообщение хранится целиком (put_message): его страницы лежат под
+    ключами ключ-1, ключ-2..., а первая помнит, сколько их всего.
+
+    Оба уровня ограничены по объему и вытесняют самые давно
+    использованные записи. Дисковый уровень переживает перезапуск и
+    может разделяться несколькими процессами: файлы пишутся атомарно.
+    PNG для диска кодируется в фоновом потоке, чтобы промах кэша не
+    задерживал страницу на пути к принтеру. Возвращаемые изображения
+    общие, их нельзя изменять.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, memory_bytes=RENDER_CACHE_MEMORY_BYTES,
+                 disk_bytes=RENDER_CACHE_DISK_BYTES, write_queue=RENDER_CACHE_WRITE_QUEUE):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = collections.OrderedDict()
+        self.memory_used = 0
+        self.disk = None  # {ключ: размер файла}, читается с диска при первом обращении
+        self.disk_used = 0
+        self.lock = threading.Lock()
+        self.writes = queue.Queue(write_queue)
+        self.writer = None  # Поток записи на диск, запускается при первой записи
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def _load_disk_index(self):
+        # Вызывается под self.lock
+        if self.disk is not None:
+            return
+        self.disk = collections.OrderedDict()
+        self.disk_used = 0
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith('.png')]
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning("Не удалось прочитать кэш страниц '%s': %s", self.directory, e)
+            return
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            size = entry.stat().st_size
+            self.disk[entry.name[:-len('.png')]] = size
+            self.disk_used += size
+
+    def get(self, key):
+        """Возвращает готовую страницу или None."""
+        with self.lock:
+            img = self.memory.get(key)
+            if img is not None:
+                self.memory.move_to_end(key)
+                RENDER_CACHE_REQUESTS.inc(tier='memory')
+                return img
+            self._load_disk_index()
+            on_disk = key in self.disk
+            if on_disk:
+                self.disk.move_to_end(key)
+        if on_disk:
+            path = self._path(key)
+            try:
+                img = Image.open(path)
+                img.load()
+                # Отмечаем использование для вытеснения после перезапуска
+                os.utime(path)
+            except (OSError, ValueError) as e:
+                logger.warning("Не удалось прочитать страницу из кэша '%s': %s", path, e)
+                with self.lock:
+                    self.disk_used -= self.disk.pop(key, 0)
+            else:
+                self._remember(key, img)
+                RENDER_CACHE_REQUESTS.inc(tier='disk')
+                return img
+        RENDER_CACHE_REQUESTS.inc(tier='miss')
+        return None
+
+    def put(self, key, img):
+        """Сохраняет страницу в память сразу, а на диск — в фоне."""
+        self._remember(key, img)
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name='render-cache-writer', daemon=True)
+                self.writer.start()
+        try:
+            self.writes.put_nowait((key, img))
+        except queue.Full:
+            # Диск не успевает: страница останется только в памяти
+            logger.debug("Очередь записи кэша страниц заполнена, %s не сохранена на диск", key)
+
+    def get_message(self, key):
+        """Все страницы сообщения key или None, если в кэше есть не все."""
+        first = self.get(f"{key}-1")
+        if first is None:
+            return None
+        try:
+            count = int(first.info[MESSAGE_PAGES_INFO])
+        except (KeyError, ValueError):
+            return None
+        pages = [first]
+        for number in range(2, count + 1):
+            img = self.get(f"{key}-{number}")
+            if img is None:
+                return None
+            pages.append(img)
+        return pages
+
+    def put_message(self, key, pages):
+        """Сохраняет все страницы сообщения key."""
+        pages[0].info[MESSAGE_PAGES_INFO] = str(len(pages))
+        for number, img in enumerate(pages, 1):
+            self.put(f"{key}-{number}", img)
+
+    def flush(self):
+        """Дожидается записи на диск всех поставленных страниц."""
+        self.writes.join()
+
+    def _write_loop(self):
+        while True:
+            key, img = self.writes.get()
+            try:
+                self._write(key, img)
+            except Exception as e:
+                logger.warning("Не удалось сохранить страницу в кэш: %s", e)
+            finally:
+                self.writes.task_done()
+
+    def _write(self, key, img):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.page-', suffix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    # Быстрое сжатие: страница пишется на каждый промах кэша
+                    params = {'compress_level': 1}
+                    if 'dpi' in img.info:
+                        params['dpi'] = img.info['dpi']
+                    if MESSAGE_PAGES_INFO in img.info:
+                        pnginfo = PngImagePlugin.PngInfo()
+                        pnginfo.add_text(MESSAGE_PAGES_INFO, img.info[MESSAGE_PAGES_INFO])
+                        params['pnginfo'] = pnginfo
+                    img.save(f, 'PNG', **params)
+                os.replace(temp_path, self._path(key))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            size = os.path.getsize(self._path(key))
+        except OSError as e:
+            logger.warning("Не удалось сохранить страницу в кэш: %s", e)
+            return
+        with self.lock:
+            self._load_disk_index()
+            self.disk_used += size - self.disk.pop(key, 0)
+            self.disk[key] = size
+            evicted = []
+            while self.disk_used > self.disk_bytes and len(self.disk) > 1:
+                old_key, old_size = self.disk.popitem(last=False)
+                self.disk_used -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.unlink(self._path(old_key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Не удалось удалить страницу из кэша: %s", e)
+
+    def _remember(self, key, img):
+        with self.lock:
+            previous = self.memory.pop(key, None)
+            if previous is not None:
+                self.memory_used -= _image_bytes(previous)
+            self.memory[key] = img
+            self.memory_used += _image_bytes(img)
+            while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+                _, old_img = self.memory.popitem(last=False)
+                self.memory_used -= _image_bytes(old_img)
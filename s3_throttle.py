@@ -0,0 +1,190 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+
+from botocore.exceptions import ConnectionError as BotocoreConnectionError, HTTPClientError
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+S3_RATE_INITIAL = 50.0  # Начальный темп запросов к S3, запросов в секунду
+S3_RATE_MIN = 1.0  # Ниже этого темпа при троттлинге не опускаемся
+S3_RATE_MAX = 500.0  # Выше этого темпа не разгоняемся
+S3_RATE_INCREASE = 2.0  # Аддитивный прирост темпа (запросов в секунду за секунду успешной работы)
+S3_RATE_DECREASE = 0.5  # Во сколько раз снижать темп при троттлинге
+S3_DECREASE_COOLDOWN_SECONDS = 1.0  # Одна волна отказов снижает темп только один раз
+S3_MAX_ATTEMPTS = 5  # Сколько раз пробовать один запрос (включая первую попытку)
+S3_RETRY_BUDGET = 20.0  # Запас повторов; пополняется успешными запросами
+S3_RETRY_BUDGET_RATIO = 0.1  # Сколько повторов зарабатывает один успешный запрос
+S3_BACKOFF_BASE_SECONDS = 0.2
+S3_BACKOFF_MAX_SECONDS = 20.0
+
+# Ответы, которыми S3 (и совместимые хранилища) просят снизить нагрузку
+THROTTLE_STATUSES = {429, 503}
+THROTTLE_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+                  'RequestLimitExceeded', 'TooManyRequests', 'TooManyRequestsException', 'ServiceUnavailable'}
+# Временные ошибки, которые стоит повторить без снижения темпа
+TRANSIENT_STATUSES = {500, 502, 504}
+
+S3_REQUEST_RATE = REGISTRY.gauge(
+    'silent_print_s3_request_rate', "Текущий допустимый темп запросов к S3, запросов в секунду")
+S3_RETRY_BUDGET_TOKENS = REGISTRY.gauge(
+    'silent_print_s3_retry_budget', "Оставшийся запас повторов запросов к S3")
+S3_THROTTLED = REGISTRY.counter(
+    'silent_print_s3_throttled_total', "Ответы S3 с требованием снизить нагрузку", ('operation',))
+S3_RETRIES = REGISTRY.counter(
+    'silent_print_s3_retries_total', "Решения о повторе запросов к S3", ('outcome',))
+
+class AdaptiveRateLimiter:
+    """Ограничитель темпа запросов по схеме AIMD.
+
+    Запросы равномерно распределяются во времени с текущим темпом rate.
+    Каждый успешный ответ увеличивает темп на increase / rate (то есть
+    примерно на increase за секунду работы на полном темпе), троттлинг
+    уменьшает его в decrease раз, но не чаще раза в cooldown секунд.
+    """
+
+    def __init__(self, rate=S3_RATE_INITIAL, min_rate=S3_RATE_MIN, max_rate=S3_RATE_MAX,
+                 increase=S3_RATE_INCREASE, decrease=S3_RATE_DECREASE, cooldown=S3_DECREASE_COOLDOWN_SECONDS):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.next_time = 0.0
+        self.last_decrease = float('-inf')
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Занимает место для следующего запроса; возвращает, сколько секунд ждать."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + 1.0 / self.rate
+            return start - now
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        """Снижает темп; возвращает True, если он действительно снижен."""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < self.cooldown:
+                return False
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            return True
+
+class RetryBudget:
+    """Общий на все запросы запас повторов.
+
+    Пока хранилище отвечает, каждый успешный запрос пополняет запас на
+    ratio. При массовых отказах запас быстро заканчивается, и запросы
+    перестают повторяться, а не умножают нагрузку.
+    """
+
+    def __init__(self, capacity=S3_RETRY_BUDGET, ratio=S3_RETRY_BUDGET_RATIO):
+        self.capacity = capacity
+        self.ratio = ratio
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class S3Throttle:
+    """Ограничитель темпа и повторов перед всеми запросами клиента S3.
+
+    Подключается к клиенту boto3 (attach) или aiobotocore (attach_async)
+    через события botocore: каждая попытка запроса, включая повторы,
+    ждет своей очереди у ограничителя, а решение о повторе принимается
+    здесь же с учетом общего запаса повторов. Собственные повторы
+    botocore у таких клиентов нужно отключить (см. CLIENT_RETRIES).
+    """
+
+    def __init__(self, limiter=None, budget=None, max_attempts=S3_MAX_ATTEMPTS,
+                 backoff_base=S3_BACKOFF_BASE_SECONDS, backoff_max=S3_BACKOFF_MAX_SECONDS):
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.budget = budget or RetryBudget()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def attach(self, client):
+        client.meta.events.register('before-send.s3', self.before_send)
+        client.meta.events.register('needs-retry.s3', self.needs_retry)
+        return client
+
+    def attach_async(self, client):
+        client.meta.events.register('before-send.s3', self.before_send_async)
+        client.meta.events.register('needs-retry.s3', self.needs_retry)
+        return client
+
+    def before_send(self, **kwargs):
+        self.limiter.acquire()
+
+    async def before_send_async(self, **kwargs):
+        delay = self.limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempts):
+        """Экспоненциальная задержка со случайным разбросом."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)))
+
+    def needs_retry(self, response=None, attempts=1, caught_exception=None, operation=None, **kwargs):
+        """Обработчик botocore: секунды до повтора или None, если не повторять."""
+        status = code = None
+        if response is not None:
+            http_response, parsed = response
+            status = http_response.status_code
+            code = parsed.get('Error', {}).get('Code')
+        operation_name = getattr(operation, 'name', 'unknown')
+        if status in THROTTLE_STATUSES or code in THROTTLE_CODES:
+            S3_THROTTLED.inc(operation=operation_name)
+            if self.limiter.on_throttle():
+                logger.warning("S3 просит снизить нагрузку (%s), темп запросов снижен до %.1f/с",
+                               code or status, self.limiter.rate)
+        elif caught_exception is None and status is not None and status not in TRANSIENT_STATUSES:
+            # Ответ получен (в том числе ошибка клиента вроде 404) — хранилище не перегружено
+            self.limiter.on_success()
+            self.budget.deposit()
+            return None
+        elif caught_exception is not None and not isinstance(caught_exception, (BotocoreConnectionError, HTTPClientError)):
+            return None
+        if attempts >= self.max_attempts:
+            S3_RETRIES.inc(outcome='exhausted')
+            return None
+        if not self.budget.withdraw():
+            S3_RETRIES.inc(outcome='no_budget')
+            logger.warning("Запас повторов запросов к S3 исчерпан, %s не повторяется", operation_name)
+            return None
+        S3_RETRIES.inc(outcome='retried')
+        return self.backoff(attempts)
+
+# Собственные повторы botocore отключены: ими управляет S3Throttle
+CLIENT_RETRIES = {'total_max_attempts': 1, 'mode': 'standard'}
+
+# Общий ограничитель для всех клиентов S3 процесса
+S3_THROTTLE = S3Throttle()
+S3_REQUEST_RATE.set_function(lambda: S3_THROTTLE.limiter.rate)
+S3_RETRY_BUDGET_TOKENS.set_function(lambda: S3_THROTTLE.budget.tokens)
@@ -0,0 +1,89 @@
+import heapq
+import itertools
+import datetime
+
+LIVE_WINDOW_SECONDS = 300  # Файлы моложе этого возраста считаются «живыми» загрузками
+BACKLOG_SHARE = 0.2  # Доля заданий из бэклога, когда есть и живые задания
+DEFAULT_PREFIX_PRIORITY = 100
+PREFIX_PRIORITIES = {}  # Приоритеты по префиксу ключа, например {'vip/': 0}; меньше — раньше
+
+LIVE = 'live'
+BACKLOG = 'backlog'
+
+class JobScheduler:
+    """Планировщик заданий печати с двумя классами приоритета.
+
+    Живые задания (свежие загрузки) обслуживаются в первую очередь, но
+    бэклогу гарантируется доля backlog_share от всех выдач, пока в нем
+    есть задания. Внутри класса задания упорядочены по приоритету
+    префикса, затем по LastModified (сначала старые).
+    """
+
+    def __init__(self, backlog_share=BACKLOG_SHARE, prefix_priorities=None, live_window_seconds=LIVE_WINDOW_SECONDS):
+        self.backlog_share = backlog_share
+        self.prefix_priorities = PREFIX_PRIORITIES if prefix_priorities is None else prefix_priorities
+        self.live_window = datetime.timedelta(seconds=live_window_seconds)
+        self.queues = {LIVE: [], BACKLOG: []}
+        self.queued = set()
+        self.backlog_credit = 0.0
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queued)
+
+    def __contains__(self, key):
+        return key in self.queued
+
+    def sizes(self):
+        """Возвращает количество заданий в каждом классе."""
+        return {name: len(queue) for name, queue in self.queues.items()}
+
+    def prefix_priority(self, key):
+        """Приоритет ключа по самому длинному совпавшему префиксу."""
+        best_prefix = None
+        for prefix in self.prefix_priorities:
+            if key.startswith(prefix) and (best_prefix is None or len(prefix) > len(best_prefix)):
+                best_prefix = prefix
+        if best_prefix is None:
+            return DEFAULT_PREFIX_PRIORITY
+        return self.prefix_priorities[best_prefix]
+
+    def classify(self, last_modified, now=None):
+        """Определяет класс задания по возрасту объекта."""
+        if last_modified is None:
+            return BACKLOG
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return LIVE if now - last_modified <= self.live_window else BACKLOG
+
+    def push(self, key, last_modified=None, job_class=None):
+        """Добавляет задание. Возвращает False, если ключ уже в очереди."""
+        if key in self.queued:
+            return False
+        if job_class is None:
+            job_class = self.classify(last_modified)
+        timestamp = last_modified.timestamp() if last_modified is not None else 0.0
+        entry = (self.prefix_priority(key), timestamp, next(self.counter), key, last_modified)
+        heapq.heappush(self.queues[job_class], entry)
+        self.queued.add(key)
+        return True
+
+    def pop(self):
+        """Возвращает следующее задание (ключ, LastModified, класс) или None."""
+        live, backlog = self.queues[LIVE], self.queues[BACKLOG]
+        if live and backlog:
+            self.backlog_credit += self.backlog_share
+            if self.backlog_credit >= 1.0:
+                self.backlog_credit -= 1.0
+                job_class = BACKLOG
+            else:
+                job_class = LIVE
+        elif live:
+            job_class = LIVE
+        elif backlog:
+            job_class = BACKLOG
+        else:
+            return None
+        _, _, _, key, last_modified = heapq.heappop(self.queues[job_class])
+        self.queued.discard(key)
+        return key, last_modified, job_class
@@ -1,43 +1,167 @@
 import time
+import logging
 import os
 import sys
-import json
-import win32con
-import win32print
-import win32ui
-import win32gui
-from PIL import Image, ImageWin, ImageDraw, ImageFont
-import boto3
+import io
+from startup import lazy_import, module_available, check_modules, run_preflight
+# Тяжелые модули импортируются при первом использовании, чтобы скрипт быстро запускался
+win32con = lazy_import('win32con')
+win32print = lazy_import('win32print')
+win32ui = lazy_import('win32ui')
+win32gui = lazy_import('win32gui')
+ImageWin = lazy_import('PIL.ImageWin')
+# Без pywin32 (например, на Linux) доступен только рендеринг
+WINDOWS_PRINT_AVAILABLE = module_available('win32print')
+Image = lazy_import('PIL.Image')
+ImageFont = lazy_import('PIL.ImageFont')
+emoji = lazy_import('emoji')
+boto3 = lazy_import('boto3')
+botocore_config = lazy_import('botocore.config')
 from botocore.exceptions import ClientError
-import tempfile
 import datetime
+import queue
+import threading
+import contextlib
+from checkpoint import load_checkpoint, save_checkpoint, CHECKPOINT_FILE, CHECKPOINT_INTERVAL_SECONDS
+from snapshot_diff import Snapshot, SnapshotBuilder, iter_changes
+from scheduler import JobScheduler, LIVE, BACKLOG
+from processed_mover import ProcessedMover, MOVE_PROCESSED_OBJECTS, is_processed_key
+from metrics import (instrument_stage, time_stage, start_metrics_server, JOBS_TOTAL,
+                     QUEUE_SIZE, METRICS_ENABLED, REGISTRY)
+from job_trace import JobTrace, finish_trace, format_latency_summary
+from logging_setup import setup_logging, RATE_LIMITED
+from pipeline import RenderedPage, Sink, PreviewSink, ArchiveSink, fan_out
+from gallery import GalleryStore, GallerySink, GalleryServer
+from render_cache import RenderCache, RENDER_CACHE_ENABLED, cache_key
+from templates import TemplateRegistry, TEMPLATE_MANIFEST, TEMPLATE_METADATA_KEY
+from pillow_features import probe_pillow_features
+from line_raster import LineRasterizer
+from emoji_atlas import load_atlas, atlas_paths
+from s3_throttle import S3_THROTTLE, CLIENT_RETRIES
+from job_leases import LeaseManager, LEASES_ENABLED, LEASE_ACQUIRED, LEASE_DONE, LEASE_PREFIX
+from memory_monitor import MemoryMonitor, MEMORY_MONITOR_ENABLED
+from text_payload import (read_payload, payload_encoding, max_object_bytes, read_bundle, is_bundle_key,
+                          bundle_entry_key, PayloadError, TEXT_SUFFIXES, BUNDLE_SUFFIXES)
+
+logger = logging.getLogger(__name__)
 
-WINDOWS_PRINT_AVAILABLE = True
 S3_BUCKET_NAME = 'wikilect-ecom-expo-may-2025' 
+S3_ENDPOINT_URL = 'https://storage.yandexcloud.net'  # Endpoint Yandex Cloud S3
+S3_REGION = 'ru-central1'
 CHECK_INTERVAL_SECONDS = 1  # Проверка каждую секунду
-TXT_EXTENSION = '.txt'  # Расширение для текстовых файлов
-TEMPLATE_IMAGE = 'src\A5-front.png'  # Путь к шаблону изображения
+TXT_EXTENSION = '.txt'  # Расширение для текстовых файлов (принимаются и сжатые .txt.gz, .txt.zst)
+TEMPLATE_IMAGE = os.path.join('src', 'A5-front.png')  # Путь к шаблону изображения
+WINDOWS_FONTS_DIR = os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')  # Системные шрифты Windows
 PRINTED_LOG_FILE = 'printed_files.txt'  # Файл для хранения истории печати
+PRINTER_COMPLETION_TIMEOUT_SECONDS = 300  # Сколько ждать, пока принтер сообщит о завершении задания
+PRINTER_POLL_INTERVAL_SECONDS = 1  # Как часто опрашивать очередь принтера
+S3_WATCH_PREFIX = ''  # Отслеживаемый префикс ключей (например, 'incoming/')
+OUTPUT_SINKS = ('printer',)  # Куда отправлять готовые страницы: 'printer', 'preview', 'gallery', 'archive'
+
+# Модули, без которых скрипт не запустится: {модуль: пакет для pip}
+REQUIRED_MODULES = {'PIL': 'Pillow', 'emoji': 'emoji', 'boto3': 'boto3', 'win32print': 'pywin32'}
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'font')  # Шрифты из комплекта
+# Шрифты, от которых зависит результат рендеринга (учитываются в ключе кэша страниц)
+RENDER_FONT_FILES = (
+    [os.path.join(FONT_DIR, name) for name in ('NotoSans-Regular.ttf', 'NotoColorEmoji-Regular.ttf',
+                                               'NotoEmoji-Regular.ttf')] +
+    [os.path.join(WINDOWS_FONTS_DIR, name) for name in ('seguiemj.ttf', 'seguisym.ttf', 'segoeui.ttf', 'arial.ttf')]
+)
+# Шрифты эмодзи в порядке предпочтения; из них же собирается атлас эмодзи (build_emoji_atlas.py)
+EMOJI_FONT_FILES = [
+    os.path.join(FONT_DIR, 'NotoColorEmoji-Regular.ttf'),  # Основной шрифт для эмодзи
+    os.path.join(FONT_DIR, 'NotoEmoji-Regular.ttf'),       # Альтернативный шрифт для эмодзи
+    os.path.join(WINDOWS_FONTS_DIR, 'seguiemj.ttf'),  # Windows Segoe UI Emoji
+]
+# Шрифт эмодзи, которым рисуются эмодзи, отсутствующие в основном шрифте эмодзи
+EMOJI_FALLBACK_FONTS = [os.path.join(WINDOWS_FONTS_DIR, 'seguiemj.ttf')]
+RENDER_VERSION = 3  # Увеличьте при изменении раскладки страниц, чтобы сбросить кэш
+MAX_PAGES = 10  # Сколько страниц печатать из одного файла; остаток текста отбрасывается
+# Коды форматов бумаги DEVMODE (DMPAPER_*)
+PAPER_SIZES = {'A4': 9, 'A5': 11, 'A6': 70, 'Letter': 1}
+
+# Шаблоны страниц; манифест читается при запуске или при первом рендеринге
+TEMPLATES = TemplateRegistry(TEMPLATE_MANIFEST, TEMPLATE_IMAGE, FONT_DIR)
+
+# Результаты обработки файла
+JOB_PRINTED = 'printed'  # Файл напечатан
+JOB_FAILED = 'failed'  # Файл невозможно напечатать (не читается или не рендерится)
+JOB_RETRY = 'retry'  # Временная ошибка, файл стоит повторить позже
+RETRY_DELAY_SECONDS = 30  # Через сколько секунд повторять файл после временной ошибки
+
+BUNDLE_ENTRIES = REGISTRY.counter(
+    'silent_print_bundle_entries_total', "Сообщения из пакетов по результату", ('result',))
 
 def get_s3_client():
-    """Создает и возвращает клиент S3 для Yandex Cloud."""
+    """Создает и возвращает клиент S3 для Yandex Cloud.
+
+    Все запросы клиента проходят через общий ограничитель темпа S3_THROTTLE,
+    который замедляется при троттлинге и сам решает, повторять ли запрос.
+    """
     try:
         # Создаем клиент для Yandex Cloud S3
-        return boto3.client(
+        s3_client = boto3.client(
             's3',
-            endpoint_url='https://storage.yandexcloud.net',
-            region_name='ru-central1'
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            config=botocore_config.Config(retries=CLIENT_RETRIES)
         )
+        return S3_THROTTLE.attach(s3_client)
     except Exception as e:
-        print(f"Ошибка при создании S3 клиента: {e}")
+        logger.error("Ошибка при создании S3 клиента: %s", e)
+        return None
+
+def check_s3_credentials():
+    """Проверка при запуске: учетные данные S3 настроены. Возвращает клиент."""
+    if boto3.session.Session().get_credentials() is None:
+        raise RuntimeError("не найдены учетные данные S3, выполните 'aws configure'")
+    s3_client = get_s3_client()
+    if s3_client is None:
+        raise RuntimeError("не удалось создать S3 клиент")
+    return s3_client
+
+def check_template():
+    """Проверка при запуске: читает манифест и заранее декодирует все шаблоны."""
+    if not os.path.exists(TEMPLATE_MANIFEST) and not os.path.exists(TEMPLATE_IMAGE):
+        raise RuntimeError(f"шаблон изображения не найден по пути '{TEMPLATE_IMAGE}'")
+    return TEMPLATES.load()
+
+def check_fonts():
+    """Проверка при запуске: прогревает FreeType и таблицу эмодзи.
+
+    Отсутствие шрифта из комплекта не фатально, рендеринг перейдет на
+    системные шрифты, поэтому об этом только предупреждаем.
+    """
+    font_path = os.path.join(FONT_DIR, 'NotoSans-Regular.ttf')
+    if os.path.exists(font_path):
+        ImageFont.truetype(font_path, 24)
+    else:
+        logger.warning("Шрифт не найден по пути: %s, будут использованы системные шрифты", font_path)
+    emoji.emojize(':smile:', language='alias')
+    # Один раз определяем, какие вызовы рендеринга текста поддерживает Pillow
+    probe_pillow_features()
+    return font_path
+
+def preflight():
+    """Параллельно проверяет шаблоны, шрифты и учетные данные S3.
+
+    Возвращает S3 клиент или None, если запускаться нельзя.
+    """
+    results = run_preflight({
+        'шаблон': check_template,
+        'шрифты': check_fonts,
+        'S3': check_s3_credentials,
+    })
+    if results is None:
         return None
+    return results['S3']
 
-def load_printed_files():
+def load_printed_files(path=PRINTED_LOG_FILE):
     """Загружает список уже напечатанных файлов из лог-файла."""
     printed_files = set()
-    if os.path.exists(PRINTED_LOG_FILE):
+    if os.path.exists(path):
         try:
-            with open(PRINTED_LOG_FILE, 'r') as f:
+            with open(path, 'r') as f:
                 for line in f:
                     line = line.strip()
                     if line:
@@ -46,535 +170,433 @@ def load_printed_files():
                             file_key, _ = parts
                             printed_files.add(file_key)
         except Exception as e:
-            print(f"Ошибка при чтении лог-файла: {e}")
+            logger.error("Ошибка при чтении лог-файла: %s", e)
     return printed_files
 
-def save_printed_file(file_key):
+def save_printed_file(file_key, path=PRINTED_LOG_FILE):
     """Сохраняет информацию о напечатанном файле в лог."""
     try:
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(PRINTED_LOG_FILE, 'a') as f:
+        with open(path, 'a') as f:
             f.write(f"{file_key},{timestamp}\n")
         return True
     except Exception as e:
-        print(f"Ошибка при записи в лог-файл: {e}")
+        logger.error("Ошибка при записи в лог-файл: %s", e)
         return False
 
-def list_files_in_s3_bucket(s3_client, bucket_name):
-    """Возвращает множество ключей файлов в указанном S3 бакете с их временем последнего изменения."""
-    file_info = {}
-    if s3_client is None:
-        print("S3 клиент не инициализирован.")
-        return file_info
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                key = obj['Key']
-                last_modified = obj['LastModified']
-                file_info[key] = last_modified
-    except ClientError as e:
-        print(f"Ошибка при получении списка файлов из S3: {e}")
-    return file_info
+def is_text_key(key):
+    """Проверяет, является ли объект S3 текстовым файлом (в том числе сжатым) или пакетом сообщений.
 
-def download_file_from_s3(s3_client, bucket_name, file_key):
-    """Скачивает файл из S3 и возвращает путь к временному файлу."""
-    if s3_client is None:
-        print("S3 клиент не инициализирован.")
-        return None
+    Служебные префиксы (перенесенные файлы, аренды) не учитываются, даже
+    если S3_WATCH_PREFIX не задан и листинг охватывает весь бакет.
+    """
+    return (key.lower().endswith(TEXT_SUFFIXES + BUNDLE_SUFFIXES) and not is_processed_key(key)
+            and not key.startswith(LEASE_PREFIX))
+
+def iter_s3_listing_pages(s3_client, bucket_name):
+    """Постранично перечисляет объекты бакета (ключи в лексикографическом порядке).
+
+    Ошибки ClientError не перехватываются, чтобы вызывающий код мог
+    отличить оборванный листинг от полного.
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    yield from paginator.paginate(Bucket=bucket_name, Prefix=S3_WATCH_PREFIX)
+
+def fetch_object(s3_client, bucket_name, file_key):
+    """Скачивает небольшой объект S3 в память.
+
+    Возвращает (содержимое, метаданные, Content-Encoding) или None при
+    ошибке. Сжатое содержимое не распаковывается (см. decode_object).
+    Читается не больше max_object_bytes + 1 байт: обрезанный объект
+    затем отвергает проверка размера, а память не тратится на весь объект.
+    """
+    limit = max_object_bytes(file_key)
     try:
-        # Создаем временный файл с правильным расширением
-        _, ext = os.path.splitext(file_key)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-        temp_file.close()
-        
-        # Скачиваем файл из S3
-        s3_client.download_file(bucket_name, file_key, temp_file.name)
-        return temp_file.name
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+        if response.get('ContentLength', 0) > limit:
+            logger.warning("Файл %s больше %s байт (%s), скачиваем только начало",
+                           file_key, limit, response['ContentLength'])
+        with response['Body'] as body:
+            return body.read(limit + 1), response.get('Metadata', {}), response.get('ContentEncoding')
     except ClientError as e:
-        print(f"Ошибка при скачивании файла из S3: {e}")
+        logger.error("Ошибка при скачивании файла из S3: %s", e)
         return None
     except Exception as e:
-        print(f"Непредвиденная ошибка при скачивании файла: {e}")
+        logger.error("Непредвиденная ошибка при скачивании файла: %s", e)
         return None
 
-def read_text_from_file(file_path):
-    """Читает текст из файла."""
+def decode_text(data):
+    """Декодирует содержимое текстового файла из байтов."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        text = data.decode('utf-8')
     except UnicodeDecodeError:
         # Если UTF-8 не работает, пробуем другие кодировки
         try:
-            with open(file_path, 'r', encoding='cp1251') as f:
-                return f.read()
+            text = data.decode('cp1251')
         except Exception as e:
-            print(f"Ошибка при чтении файла с кодировкой cp1251: {e}")
+            logger.error("Ошибка при чтении файла с кодировкой cp1251: %s", e)
             return None
+    # Приводим переводы строк к виду, который дает чтение в текстовом режиме
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def decode_object(key, data, content_encoding=None):
+    """Распаковывает (по Content-Encoding или расширению ключа) и декодирует объект.
+
+    Распакованный текст ограничен MAX_TEXT_BYTES. Возвращает текст или
+    None, если объект невозможно прочитать.
+    """
+    try:
+        data = read_payload(io.BytesIO(data), payload_encoding(key, content_encoding))
+    except PayloadError as e:
+        logger.error("Не удалось прочитать файл %s: %s", key, e)
+        return None
+    return decode_text(data)
+
+@instrument_stage('read')
+def read_text_from_file(file_path):
+    """Читает текст из файла (в том числе сжатого .txt.gz или .txt.zst)."""
+    try:
+        with open(file_path, 'rb') as f:
+            return decode_text(read_payload(f, payload_encoding(file_path)))
     except Exception as e:
-        print(f"Ошибка при чтении файла: {e}")
+        logger.error("Ошибка при чтении файла: %s", e)
         return None
 
-def create_image_with_text(template_path, text_content):
-    """Создает изображение с текстом на основе шаблона с улучшенной поддержкой эмодзи."""
+def emojize_text(text_content):
+    """Преобразует текстовые коды эмодзи (:smile:, :grinning_face:) в символы."""
     try:
-        # Открываем шаблон изображения
-        img = Image.open(template_path)
-        draw = ImageDraw.Draw(img)
+        original_text = text_content
+        processed_text = text_content
+        emojized = False
         
-        # Используем шрифты Noto Sans и Noto Color Emoji для поддержки кириллицы и эмодзи
+        # Пробуем с разными вариантами синтаксиса для эмодзи
         try:
-            # Используем указанный пользователем шрифт Noto Sans для основного текста
-            custom_font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'font', 'NotoSans-Regular.ttf')
-            
-            # Проверяем наличие шрифтов для эмодзи
-            font_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'font')
-            emoji_font_candidates = [
-                os.path.join(font_dir, 'NotoColorEmoji-Regular.ttf'),  # Основной шрифт для эмодзи
-                os.path.join(font_dir, 'NotoEmoji-Regular.ttf'),       # Альтернативный шрифт для эмодзи
-                os.path.join(os.environ['WINDIR'], 'Fonts', 'seguiemj.ttf')  # Windows Segoe UI Emoji
-            ]
-            
-            # Проверяем наличие шрифтов для эмодзи
-            emoji_font_path = None
-            for candidate in emoji_font_candidates:
-                if os.path.exists(candidate):
-                    emoji_font_path = candidate
-                    emoji_font_exists = True
-                    print(f"Найден шрифт для эмодзи: {emoji_font_path}")
-                    break
-            else:
-                emoji_font_exists = False
-            
-            if os.path.exists(custom_font_path):
-                # Используем шрифт Noto Sans для основного текста
-                font = ImageFont.truetype(custom_font_path, 24)
-                print(f"Используется шрифт Noto Sans: {custom_font_path}")
-                
-                # Если доступен шрифт для эмодзи, загрузим его
-                if emoji_font_exists:
-                    try:
-                        # Используем увеличенный размер для лучшего отображения эмодзи
-                        try:
-                            # Загружаем шрифт с embedded_color=True для поддержки цветных эмодзи
-                            emoji_font = ImageFont.truetype(emoji_font_path, 36, layout_engine=ImageFont.LAYOUT_RAQM, embedded_color=True)
-                        except (TypeError, AttributeError):
-                            try:
-                                # Пробуем без layout_engine
-                                emoji_font = ImageFont.truetype(emoji_font_path, 36, embedded_color=True)
-                            except (TypeError, AttributeError):
-                                # Если embedded_color не поддерживается
-                                emoji_font = ImageFont.truetype(emoji_font_path, 36)
-                        emoji_name = os.path.basename(emoji_font_path)
-                        print(f"Используется шрифт {emoji_name} для эмодзи: {emoji_font_path}")
-                    except Exception as e:
-                        print(f"Ошибка при загрузке шрифта для эмодзи: {e}")
-                        emoji_font = None
-                else:
-                    emoji_font = None
-                    print("Не найден подходящий шрифт для эмодзи, эмодзи могут отображаться некорректно")
-            else:
-                # Если шрифт не найден, используем резервные шрифты
-                print(f"Шрифт не найден по пути: {custom_font_path}")
-                print("Используем резервные шрифты...")
-                
-                # Резервные шрифты с хорошей поддержкой кириллицы и эмодзи
-                font_candidates = [
-                    'seguiemj.ttf',  # Segoe UI Emoji (отличная поддержка эмодзи)
-                    'seguisym.ttf',  # Segoe UI Symbol (хорошая поддержка эмодзи и кириллицы)
-                    'segoeui.ttf',   # Segoe UI (хорошая поддержка кириллицы)
-                ]
-                
-                font_path = None
-                for font_name in font_candidates:
-                    candidate_path = os.path.join(os.environ['WINDIR'], 'Fonts', font_name)
-                    if os.path.exists(candidate_path):
-                        font_path = candidate_path
-                        break
-                
-                if font_path:
-                    font = ImageFont.truetype(font_path, 24)
-                    print(f"Используется резервный шрифт: {font_path}")
-                else:
-                    # Если ни один шрифт не найден, используем стандартный
-                    raise Exception("Не найден подходящий шрифт")
+            processed_text = emoji.emojize(text_content, language='alias')
+            if processed_text != text_content:
+                text_content = processed_text
+                emojized = True
+                logger.debug("Эмодзи успешно преобразованы с помощью alias (:smile:)")
         except Exception as e:
-            print(f"Ошибка при загрузке шрифта: {e}, пробуем запасной вариант")
-            try:
-                # Пробуем использовать Arial, который точно поддерживает кириллицу
-                arial_path = os.path.join(os.environ['WINDIR'], 'Fonts', 'arial.ttf')
-                if os.path.exists(arial_path):
-                    font = ImageFont.truetype(arial_path, 24)
-                    print(f"Используется запасной шрифт: {arial_path}")
-                else:
-                    # Если Arial не найден, используем стандартный шрифт
-                    font = ImageFont.load_default()
-                    print("Используется стандартный шрифт (может не поддерживать кириллицу)")
-            except Exception as e2:
-                print(f"Ошибка при загрузке запасного шрифта: {e2}, используем стандартный шрифт")
-                font = ImageFont.load_default()
+            logger.warning("Ошибка при преобразовании эмодзи с alias: %s", e, extra=RATE_LIMITED)
         
-        text_x = 52  # Левая граница
-        text_y = 140  # Верхняя граница
-        text_width = 776 - 52  # Ширина текстовой области
-        text_height = 960 - 140  # Высота текстовой области
+        # 2. Со стандартным языком (длинные коды: :grinning_face:)
+        try:
+            processed_text = emoji.emojize(text_content)
+            if processed_text != text_content:
+                text_content = processed_text
+                emojized = True
+                logger.debug("Эмодзи успешно преобразованы со стандартными кодами (:grinning_face:)")
+        except Exception as e:
+            logger.warning("Ошибка при преобразовании эмодзи со стандартными кодами: %s", e, extra=RATE_LIMITED)
         
-        # Преобразуем текст для правильного отображения эмодзи с использованием разных вариантов синтаксиса
+        # 3. Пробуем все варианты синтаксиса сразу
         try:
-            original_text = text_content
-            processed_text = text_content
-            emojized = False
-            
-            # Пробуем с разными вариантами синтаксиса для эмодзи
-            try:
-                processed_text = emoji.emojize(text_content, language='alias')
-                if processed_text != text_content:
-                    text_content = processed_text
-                    emojized = True
-                    print("Эмодзи успешно преобразованы с помощью alias (:smile:)")
-            except Exception as e:
-                print(f"Ошибка при преобразовании эмодзи с alias: {e}")
-            
-            # 2. Со стандартным языком (длинные коды: :grinning_face:)
-            try:
-                processed_text = emoji.emojize(text_content)
+            if not emojized:
+                # Использование варианта со всеми доступными вариантами синтаксиса
+                processed_text = emoji.emojize(text_content, variant="emoji_type", language="alias")
                 if processed_text != text_content:
                     text_content = processed_text
                     emojized = True
-                    print("Эмодзи успешно преобразованы со стандартными кодами (:grinning_face:)")
-            except Exception as e:
-                print(f"Ошибка при преобразовании эмодзи со стандартными кодами: {e}")
-            
-            # 3. Пробуем все варианты синтаксиса сразу
-            try:
-                if not emojized:
-                    # Использование варианта со всеми доступными вариантами синтаксиса
-                    processed_text = emoji.emojize(text_content, variant="emoji_type", language="alias")
-                    if processed_text != text_content:
-                        text_content = processed_text
-                        emojized = True
-                        print("Эмодзи успешно преобразованы с использованием emoji_type")
-            except Exception as e:
-                print(f"Ошибка при преобразовании эмодзи с emoji_type: {e}")
-            
-            # Выводим информацию о результате преобразования
-            if emojized:
-                print(f"Исходный текст: {original_text[:50]}...")
-                print(f"Преобразованный текст: {text_content[:50]}...")
-            else:
-                print("Преобразование эмодзи не требовалось или не удалось выполнить")
+                    logger.debug("Эмодзи успешно преобразованы с использованием emoji_type")
         except Exception as e:
-            print(f"Предупреждение при обработке эмодзи: {e}, используем исходный текст")
-        
-        # Разбиваем текст на строки, чтобы он поместился в указанной области
-        lines = []
-        current_line = ""
-        
-        # Разбиваем по словам, учитывая пробелы и переносы строк
-        words = []
-        for line in text_content.split('\n'):
-            if line.strip():  # Если строка не пустая
-                words.extend(line.split())
-                words.append('\n')  # Добавляем маркер переноса строки
-            else:
-                words.append('\n')  # Пустая строка - просто перенос
+            logger.warning("Ошибка при преобразовании эмодзи с emoji_type: %s", e, extra=RATE_LIMITED)
         
-        for word in words:
-            if word == '\n':  # Если это маркер переноса строки
-                if current_line:
-                    lines.append(current_line)
-                    current_line = ""
-                continue
-                
+        # Выводим информацию о результате преобразования
+        if emojized:
+            logger.debug("Исходный текст: %s...", original_text[:50])
+            logger.debug("Преобразованный текст: %s...", text_content[:50])
+        else:
+            logger.debug("Преобразование эмодзи не требовалось или не удалось выполнить")
+    except Exception as e:
+        logger.warning("Предупреждение при обработке эмодзи: %s, используем исходный текст", e, extra=RATE_LIMITED)
+    return text_content
+
+def iter_wrapped_lines(draw, text_content, font, text_width, measure=None):
+    """Лениво разбивает текст на строки, которые помещаются в ширину text_width.
+
+    Пустые абзацы пропускаются. Следующая строка измеряется только тогда,
+    когда ее запрашивают, поэтому длинный текст не раскладывается целиком.
+    measure — функция ширины строки (по умолчанию ширина шрифтом font).
+    """
+    if measure is None:
+        measure = lambda line: draw.textlength(line, font=font)
+    current_line = ""
+    for paragraph in text_content.split('\n'):
+        for word in paragraph.split():
             test_line = current_line + " " + word if current_line else word
             # Проверяем, поместится ли строка по ширине
-            text_size = draw.textlength(test_line, font=font)
-            if text_size <= text_width:
+            if measure(test_line) <= text_width:
                 current_line = test_line
             else:
-                lines.append(current_line)
+                yield current_line
                 current_line = word
-        
         if current_line:
-            lines.append(current_line)
-        
-        # Рисуем текст на изображении
-        line_height = 30  # Уменьшенная высота строки для меньшего шрифта
-        
-        # Проверяем, поместится ли весь текст по высоте
-        total_text_height = len(lines) * line_height
-        if total_text_height > text_height:
-            # Если текст не помещается, уменьшаем межстрочный интервал
-            line_height = min(line_height, text_height / len(lines))
-        
-        # Рисуем текст с поддержкой эмодзи и кириллицы
-        for i, line in enumerate(lines):
-            y_position = text_y + i * line_height
-            # Проверяем, не вышли ли за нижнюю границу
-            if y_position + line_height <= text_y + text_height:
-                # Улучшенный рендеринг текста с эмодзи
-                if 'emoji_font' in locals() and emoji_font is not None:
-                    # Сначала выявляем все эмодзи и их позиции
-                    emoji_positions = []
-                    # Временная строка для отрисовки (с замененными эмодзи на пробелы)
-                    line_without_emoji = ""
-                    
-                    # Выявляем все эмодзи и их позиции
-                    for char_idx, char in enumerate(line):
-                        # Используем библиотеку emoji для более точного определения эмодзи
-                        is_emoji = False
-                        try:
-                            # Проверка по Unicode диапазонам для большинства эмодзи
-                            if len(char) == 1:  # Обрабатываем только одиночные символы
-                                # Основные диапазоны эмодзи в Unicode
-                                emoji_ranges = [
-                                    (0x1F000, 0x1FFFF),  # Основной блок эмодзи
-                                    (0x2600, 0x27BF),   # Разные символы и дингбаты
-                                    (0x2300, 0x23FF),   # Технические символы
-                                    (0x2B00, 0x2BFF),   # Разные символы и стрелки
-                                    (0x3000, 0x303F),   # CJK символы и знаки препинания
-                                    (0xFE00, 0xFE0F)    # Вариативные селекторы
-                                ]
-                                code_point = ord(char)
-                                for start, end in emoji_ranges:
-                                    if start <= code_point <= end:
-                                        is_emoji = True
-                                        break
-                            
-                            # Используем библиотеку emoji для проверки
-                            if hasattr(emoji, 'is_emoji') and emoji.is_emoji(char):
-                                is_emoji = True
-                                
-                            # Дополнительная проверка для эмодзи с модификаторами (составных эмодзи)
-                            if len(char) > 1 and any(0x1F000 <= ord(c) <= 0x1FFFF for c in char):
-                                is_emoji = True
-                        except Exception as e:
-                            # Если основные проверки не сработали, используем упрощенную проверку
-                            try:
-                                is_emoji = ord(char) > 8000
-                            except Exception:
-                                # Для составных символов, которые нельзя преобразовать в ord()
-                                pass
-                        
-                        if is_emoji:
-                            emoji_positions.append((char_idx, char))
-                            # Добавляем пробел вместо эмодзи
-                            line_without_emoji += " "
-                        else:
-                            # Добавляем обычный символ
-                            line_without_emoji += char
-                    
-                    # Рисуем текст без эмодзи (с пробелами вместо эмодзи)
-                    try:
-                        draw.text((text_x, y_position), line_without_emoji, fill="black", font=font, embedded=True, layout_engine=ImageFont.LAYOUT_RAQM)
-                    except (TypeError, AttributeError):
-                        try:
-                            draw.text((text_x, y_position), line_without_emoji, fill="black", font=font, layout_engine=ImageFont.LAYOUT_RAQM)
-                        except (TypeError, AttributeError):
-                            try:
-                                draw.text((text_x, y_position), line_without_emoji, fill="black", font=font, embedded=True)
-                            except TypeError:
-                                draw.text((text_x, y_position), line_without_emoji, fill="black", font=font)
-                    
-                    # Теперь рисуем эмодзи поверх текста, используя найденные позиции
-                    
-                    # Теперь отрисовываем каждый эмодзи с помощью специального шрифта
-                    for char_idx, char in emoji_positions:
-                        # Вычисляем позицию символа в строке
-                        char_width = draw.textlength(line[:char_idx], font=font)
-                        
-                        # Создаем затемнение под эмодзи (чтобы закрыть основной текст)
-                        try:
-                            # Определяем ширину символа эмодзи
-                            emoji_width = draw.textlength(char, font=emoji_font)
-
-                        except Exception:
-                            emoji_width = draw.textlength("😀", font=emoji_font)  # Примерная ширина
-                        
-                        # Рисуем эмодзи с использованием специального шрифта и сохранением цвета
-                        try:
-                            # Пробуем несколько вариантов отрисовки, от наиболее к наименее предпочтительному
-                            # Создаем более крупное временное изображение для отрисовки эмодзи
-                            emoji_size = 72  # Значительно увеличиваем размер для лучшего качества
-                            emoji_img = Image.new('RGBA', (emoji_size, emoji_size), (0, 0, 0, 0))  # Прозрачное изображение
-                            emoji_draw = ImageDraw.Draw(emoji_img)
-                            
-                            # Метод 1: Отрисовка на временном изображении с большим размером
-                            try:
-                                # Помещаем эмодзи в центр временного изображения
-                                try:
-                                    # Пробуем с RAQM для лучшей поддержки эмодзи
-                                    emoji_draw.text((emoji_size//4, emoji_size//4), char, font=emoji_font, fill=(0, 0, 0, 255), layout_engine=ImageFont.LAYOUT_RAQM)
-                                except (TypeError, AttributeError):
-                                    # Если RAQM не доступен, используем стандартный метод
-                                    emoji_draw.text((emoji_size//4, emoji_size//4), char, font=emoji_font, fill=(0, 0, 0, 255))
-                                
-                                # Проверяем, есть ли непрозрачные пиксели (содержимое)
-                                has_content = False
-                                for y in range(emoji_size):
-                                    for x in range(emoji_size):
-                                        pixel = emoji_img.getpixel((x, y))
-                                        if pixel[3] > 0:  # Проверка альфа-канала
-                                            has_content = True
-                                            break
-                                    if has_content:
-                                        break
-                                
-                                if has_content:
-                                    # Масштабируем до нужного размера (около 30-35 пикселей высоты)
-                                    # Уменьшаем размер, чтобы лучше соответствовать тексту
-                                    target_height = 24
-                                    ratio = target_height / emoji_size
-                                    resized_width = int(emoji_size * ratio)
-                                    emoji_img = emoji_img.resize((resized_width, target_height), Image.LANCZOS)
-                                    
-                                    # Накладываем на основное изображение со смещением на 3 пикселя влево от текущей позиции
-                                    img.paste(emoji_img, (text_x + int(char_width) - 7, y_position), emoji_img)
-                                    print(f"Отрисован эмодзи {repr(char)} методом композиции с полной обработкой")
-                                else:
-                                    # Метод 2: Если в первом методе не получилось - пробуем другой подход с Windows Emoji
-                                    try:
-                                        # Попытка использовать Windows Segoe UI Emoji с цветом
-                                        win_emoji_font_path = os.path.join(os.environ['WINDIR'], 'Fonts', 'seguiemj.ttf')
-                                        if os.path.exists(win_emoji_font_path):
-                                            try:
-                                                # Загружаем шрифт с поддержкой цветных эмодзи
-                                                win_emoji_font = ImageFont.truetype(win_emoji_font_path, 28, layout_engine=ImageFont.LAYOUT_RAQM, embedded_color=True)
-                                            except (TypeError, AttributeError):
-                                                try:
-                                                    # Пробуем без layout_engine
-                                                    win_emoji_font = ImageFont.truetype(win_emoji_font_path, 28, embedded_color=True)
-                                                except (TypeError, AttributeError):
-                                                    # Стандартный способ загрузки шрифта
-                                                    win_emoji_font = ImageFont.truetype(win_emoji_font_path, 28)
-                                            
-                                            # Создаем временное RGBA изображение для цветного эмодзи
-                                            temp_emoji_img = Image.new('RGBA', (40, 40), (255, 255, 255, 0))
-                                            temp_emoji_draw = ImageDraw.Draw(temp_emoji_img)
-                                            
-                                            # Рисуем цветной эмодзи на временном изображении
-                                            try:
-                                                # Цветные эмодзи с embedded=True и embedded_color=True
-                                                temp_emoji_draw.text((int(5), int(5)), char, font=win_emoji_font, embedded=True, embedded_color=True)
-                                            except (TypeError, AttributeError):
-                                                try: 
-                                                    # Пробуем только с embedded_color
-                                                    temp_emoji_draw.text((int(5), int(5)), char, font=win_emoji_font, embedded_color=True)
-                                                except (TypeError, AttributeError):
-                                                    try:
-                                                        # Пробуем с RAQM без цвета
-                                                        temp_emoji_draw.text((int(5), int(5)), char, font=win_emoji_font, layout_engine=ImageFont.LAYOUT_RAQM)
-                                                    except (TypeError, AttributeError):
-                                                        # Стандартный метод
-                                                        temp_emoji_draw.text((int(5), int(5)), char, font=win_emoji_font)
-                                                
-                                            # Накладываем временное изображение на основное со смещением на 7 пикселей влево от текущей позиции
-                                            img.paste(temp_emoji_img, (text_x + int(char_width) - 7, y_position), temp_emoji_img)
-                                            print(f"Отрисован цветной эмодзи {repr(char)} с использованием Windows Emoji шрифта")
-                                        else:
-                                            # Запасной вариант - просто пробуем обычную отрисовку
-                                            try:
-                                                draw.text((text_x + char_width - 7, y_position), char, font=win_emoji_font, fill=(0, 0, 0, 255), layout_engine=ImageFont.LAYOUT_RAQM)
-                                            except (TypeError, AttributeError):
-                                                draw.text((text_x + char_width - 7, y_position), char, font=win_emoji_font, fill=(0, 0, 0, 255))
-                                            print(f"Отрисован эмодзи {repr(char)} прямым методом")
-                                    except Exception as e:
-                                        print(f"Ошибка при отрисовке Windows Emoji: {e}")
-                                        draw.text((text_x + char_width - 7, y_position), char, font=font, fill=(0, 0, 0, 255))
-                                        print(f"Отрисован эмодзи {repr(char)} базовым шрифтом текста")
-                            except Exception as e:
-                                print(f"Ошибка при первичной отрисовке эмодзи: {e}, пробуем стандартный метод")
-                                draw.text((text_x + char_width - 7, y_position), char, font=font, fill=(0, 0, 0, 255))
-                                print(f"Отрисован эмодзи {repr(char)} стандартным методом")
-                        except Exception as e:
-                            print(f"Ошибка при отрисовке эмодзи {repr(char)}: {e}")
-                else:
-                    # Если шрифт Noto Color Emoji недоступен, используем стандартный метод
-                    # Но всё равно пытаемся обеспечить наилучшее отображение эмодзи
-                    try:
-                        # Проверяем, содержит ли строка эмодзи
-                        has_emoji = any(emoji.is_emoji(char) if hasattr(emoji, 'is_emoji') else (ord(char) > 8000) for char in line)
-                        if has_emoji:
-                            print(f"Строка содержит эмодзи, но специальный шрифт для эмодзи недоступен, качество отображения может быть снижено")
-                        
-                        # Пробуем с параметром embedded для лучшей поддержки Unicode
-                        draw.text((text_x, y_position), line, fill="black", font=font, embedded=True)
-                    except TypeError:
-                        # Если нет параметра embedded, используем базовый вызов
-                        draw.text((text_x, y_position), line, fill="black", font=font)
-        
-        # Сохраняем изображение во временный файл
+            yield current_line
+            current_line = ""
+
+def resolve_template(template):
+    """Шаблон по объекту Template или по пути к фоновому изображению."""
+    if isinstance(template, str):
+        return TEMPLATES.for_image(template)
+    return template
+
+_FONTS = {}  # {(шрифт, размер, размер эмодзи, load_emoji): (шрифт текста, шрифт эмодзи)}
+_FONTS_LOCK = threading.Lock()
+
+def load_fonts(template, load_emoji=True):
+    """Шрифт текста и шрифт эмодзи (или None) для шаблона, общие для процесса.
+
+    Шрифты открываются один раз на путь и размер, а не на каждый файл.
+    С load_emoji=False шрифт эмодзи не загружается (эмодзи берутся из атласа).
+    """
+    key = (template.font_path, template.font_size, template.emoji_font_size, load_emoji)
+    with _FONTS_LOCK:
+        if key not in _FONTS:
+            _FONTS[key] = _open_fonts(template, load_emoji)
+        return _FONTS[key]
+
+def _open_fonts(template, load_emoji):
+    pillow = probe_pillow_features()
+    emoji_font = None
+    # Используем шрифты Noto Sans и Noto Color Emoji для поддержки кириллицы и эмодзи
+    try:
+        # Используем указанный пользователем шрифт Noto Sans для основного текста
+        custom_font_path = template.font_path
+
+        # Проверяем наличие шрифтов для эмодзи
+        emoji_font_path = None
+        for candidate in EMOJI_FONT_FILES if load_emoji else ():
+            if os.path.exists(candidate):
+                emoji_font_path = candidate
+                emoji_font_exists = True
+                logger.debug("Найден шрифт для эмодзи: %s", emoji_font_path)
+                break
+        else:
+            emoji_font_exists = False
+
+        if os.path.exists(custom_font_path):
+            # Используем шрифт Noto Sans для основного текста
+            font = ImageFont.truetype(custom_font_path, template.font_size)
+            logger.debug("Используется шрифт Noto Sans: %s", custom_font_path)
+
+            # Если доступен шрифт для эмодзи, загрузим его
+            if emoji_font_exists:
+                try:
+                    # Используем увеличенный размер для лучшего отображения эмодзи
+                    # и RAQM для составных эмодзи, если он доступен
+                    emoji_font = ImageFont.truetype(emoji_font_path, template.emoji_font_size,
+                                                    **pillow.truetype_kwargs(complex_layout=True))
+                    emoji_name = os.path.basename(emoji_font_path)
+                    logger.debug("Используется шрифт %s для эмодзи: %s", emoji_name, emoji_font_path)
+                except Exception as e:
+                    logger.warning("Ошибка при загрузке шрифта для эмодзи: %s", e, extra=RATE_LIMITED)
+                    emoji_font = None
+            elif load_emoji:
+                emoji_font = None
+                logger.warning("Не найден подходящий шрифт для эмодзи, эмодзи могут отображаться некорректно", extra=RATE_LIMITED)
+        else:
+            # Если шрифт не найден, используем резервные шрифты
+            logger.warning("Шрифт не найден по пути: %s", custom_font_path, extra=RATE_LIMITED)
+            logger.warning("Используем резервные шрифты...", extra=RATE_LIMITED)
+
+            # Резервные шрифты с хорошей поддержкой кириллицы и эмодзи
+            font_candidates = [
+                'seguiemj.ttf',  # Segoe UI Emoji (отличная поддержка эмодзи)
+                'seguisym.ttf',  # Segoe UI Symbol (хорошая поддержка эмодзи и кириллицы)
+                'segoeui.ttf',   # Segoe UI (хорошая поддержка кириллицы)
+            ]
+
+            font_path = None
+            for font_name in font_candidates:
+                candidate_path = os.path.join(WINDOWS_FONTS_DIR, font_name)
+                if os.path.exists(candidate_path):
+                    font_path = candidate_path
+                    break
+
+            if font_path:
+                font = ImageFont.truetype(font_path, template.font_size)
+                logger.debug("Используется резервный шрифт: %s", font_path)
+            else:
+                # Если ни один шрифт не найден, используем стандартный
+                raise Exception("Не найден подходящий шрифт")
+    except Exception as e:
+        logger.warning("Ошибка при загрузке шрифта: %s, пробуем запасной вариант", e, extra=RATE_LIMITED)
         try:
-            # Создаем временный файл с расширением .png
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            temp_file.close()
-            
-            # Сохраняем изображение в файл
-            img.save(temp_file.name, 'PNG')
-            
-            return temp_file.name
-        except Exception as e:
-            print(f"Ошибка при сохранении изображения во временный файл: {e}")
-            return None
+            # Пробуем использовать Arial, который точно поддерживает кириллицу
+            arial_path = os.path.join(WINDOWS_FONTS_DIR, 'arial.ttf')
+            if os.path.exists(arial_path):
+                font = ImageFont.truetype(arial_path, template.font_size)
+                logger.debug("Используется запасной шрифт: %s", arial_path)
+            else:
+                # Если Arial не найден, используем стандартный шрифт
+                font = ImageFont.load_default()
+                logger.warning("Используется стандартный шрифт (может не поддерживать кириллицу)", extra=RATE_LIMITED)
+        except Exception as e2:
+            logger.warning("Ошибка при загрузке запасного шрифта: %s, используем стандартный шрифт", e2, extra=RATE_LIMITED)
+            font = ImageFont.load_default()
+    return font, emoji_font
+
+def iter_page_lines(template, text_content, raster, max_pages=MAX_PAGES):
+    """Лениво раскладывает текст по страницам шаблона.
+
+    Возвращает генератор списков строк, по одному на страницу. Строки не
+    сжимаются по высоте: то, что не поместилось, переходит на следующую
+    страницу. Текст дальше max_pages страниц отбрасывается с предупреждением.
+    Пустой текст дает одну пустую страницу.
+    """
+    lines_per_page = max(1, int(template.text_height // template.line_height))
+    page = []
+    produced = 0
+    # Ширина строк считается по прогонам, с настоящей шириной эмодзи
+    for line in iter_wrapped_lines(None, text_content, raster.font, template.text_width, raster.measure):
+        if len(page) == lines_per_page:
+            yield page
+            produced += 1
+            page = []
+            if produced == max_pages:
+                logger.warning("Текст не поместился на %s страниц, остаток отброшен", max_pages)
+                return
+        page.append(line)
+    if page or not produced:
+        yield page
+
+@instrument_stage('render')
+def draw_page(template, lines, raster):
+    """Рисует страницу с готовыми строками на копии фона шаблона.
+
+    Возвращает объект Image или None при ошибке.
+    """
+    try:
+        img = template.new_canvas()
+        return raster.draw_lines(img, lines, template.text_x, template.text_y, template.line_height)
     except Exception as e:
-        print(f"Ошибка при создании изображения с текстом: {e}")
+        logger.error("Ошибка при создании изображения с текстом: %s", e)
         return None
 
-def print_image_silent_gdi(image_path, printer_name=None, paper_size='A5'):
+RENDER_CACHE = RenderCache() if RENDER_CACHE_ENABLED else None
+
+def message_cache_key(template, text_content, max_pages):
+    """Ключ кэша сообщения: текст, шаблон с раскладкой, шрифты и версия рендеринга."""
+    return cache_key(text_content, template.image_path,
+                     RENDER_FONT_FILES + [template.font_path, atlas_paths(template.emoji_height)[0]],
+                     dict(template.layout(), version=RENDER_VERSION, max_pages=max_pages))
+
+def render_pages(template, text_content, max_pages=MAX_PAGES, use_cache=True):
+    """Лениво рендерит страницы текста по шаблону.
+
+    Генератор отдает страницы по одной, поэтому первую можно печатать,
+    пока следующие еще раскладываются и рисуются. При ошибке рендеринга
+    отдает None и останавливается. template — Template из реестра или путь
+    к фоновому изображению (тогда используется раскладка из манифеста или
+    по умолчанию).
+
+    С use_cache сообщение ищется в RENDER_CACHE до загрузки шрифтов и
+    раскладки: повторная загрузка того же текста или перепечатка после
+    замятия отдает сохраненные страницы без рендеринга. В кэш сообщение
+    попадает, только если отрендерены все его страницы. Возвращенные
+    изображения нельзя изменять.
+    """
+    key = cached = None
+    try:
+        template = resolve_template(template)
+        if use_cache and RENDER_CACHE is not None:
+            key = message_cache_key(template, text_content, max_pages)
+            cached = RENDER_CACHE.get_message(key)
+        if cached is None:
+            # С собранным атласом эмодзи шрифт эмодзи не нужен: спрайты берутся
+            # из общего для процесса отображения файла атласа
+            atlas = load_atlas(template.emoji_height)
+            font, emoji_font = load_fonts(template, load_emoji=atlas is None)
+            raster = LineRasterizer(template, font, emoji_font, EMOJI_FALLBACK_FONTS, atlas)
+            # Преобразуем текст для правильного отображения эмодзи
+            text_content = emojize_text(text_content)
+            pages = iter_page_lines(template, text_content, raster, max_pages)
+    except Exception as e:
+        logger.error("Ошибка при создании изображения с текстом: %s", e)
+        yield None
+        return
+    if cached is not None:
+        yield from cached
+        return
+    rendered = []
+    for lines in pages:
+        img = draw_page(template, lines, raster)
+        yield img
+        if img is None:
+            return
+        rendered.append(img)
+    if key is not None:
+        RENDER_CACHE.put_message(key, rendered)
+
+def render_text_image(template, text_content):
+    """Рендерит первую страницу текста без кэша. Возвращает Image или None."""
+    return next(render_pages(template, text_content, max_pages=1, use_cache=False))
+
+@instrument_stage('print')
+def print_image_silent_gdi(image_path, printer_name=None, paper_size='A5', trace=None, document_name=None):
     """Тихая печать изображения на лист указанного формата.
     Обрезает и масштабирует изображение под printable area принтера.
     
     Аргументы:
-        image_path: путь к изображению для печати
+        image_path: путь к изображению для печати или уже готовый объект Image
+            (он не изменяется и не закрывается)
         printer_name: имя принтера (если None, будет использован принтер по умолчанию)
-        paper_size: формат бумаги ('A5' по умолчанию)
+        paper_size: формат бумаги из PAPER_SIZES ('A5' по умолчанию)
+        trace: JobTrace, в котором отмечаются начало и конец постановки в спулер
+        document_name: имя задания в очереди принтера (по умолчанию имя файла)
     """
     if not sys.platform.startswith('win32'):
-        print("Печать доступна только на Windows.")
+        logger.error("Печать доступна только на Windows.")
         return False
     if not WINDOWS_PRINT_AVAILABLE:
-        print("Ошибка: нет pywin32/Pillow.")
+        logger.error("Ошибка: нет pywin32/Pillow.")
         return False
-    if not os.path.exists(image_path):
-        print(f"Ошибка: файл '{image_path}' не найден.")
+    from_file = isinstance(image_path, str)
+    if from_file and not os.path.exists(image_path):
+        logger.error("Ошибка: файл '%s' не найден.", image_path)
         return False
+    if document_name is None:
+        document_name = os.path.basename(image_path) if from_file else 'page.png'
     try:
-        img = Image.open(image_path)
-        if img.mode == 'RGBA' or 'A' in img.info.get('transparency', ()):
-            bg = Image.new("RGB", img.size, (255,255,255))
-            bg.paste(img, mask=img.split()[3])
-            img = bg
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+        source = Image.open(image_path) if from_file else image_path
+        if source.mode == 'RGBA' or 'A' in source.info.get('transparency', ()):
+            img = Image.new("RGB", source.size, (255,255,255))
+            img.paste(source, mask=source.split()[3])
+        elif source.mode != 'RGB':
+            img = source.convert('RGB')
+        else:
+            # Чужое изображение не закрываем, работаем с копией
+            img = source if from_file else source.copy()
+        if from_file and img is not source:
+            source.close()
     except Exception as e:
-        print(f"Ошибка открытия '{image_path}': {e}")
+        logger.error("Ошибка открытия '%s': %s", document_name, e)
         return False
     if printer_name is None:
         try:
             printer_name = win32print.GetDefaultPrinter()
         except Exception as e:
-            print(f"Не удалось получить принтер по умолчанию: {e}")
+            logger.error("Не удалось получить принтер по умолчанию: %s", e)
             img.close()
             return False
     try:
         hprinter = win32print.OpenPrinter(printer_name)
     except Exception as e:
-        print(f"Не удалось открыть принтер '{printer_name}': {e}")
+        logger.error("Не удалось открыть принтер '%s': %s", printer_name, e)
         img.close()
         return False
         
     # Настраиваем формат бумаги, если указан
-    if paper_size == 'A5':
+    if paper_size in PAPER_SIZES:
         try:
             # Получаем текущие настройки принтера
             devmode = win32print.GetPrinter(hprinter, 2).get('pDevMode')
             if devmode:
-                # Устанавливаем формат бумаги A5 (код 11)
-                devmode.PaperSize = 11  # DMPAPER_A5
+                devmode.PaperSize = PAPER_SIZES[paper_size]
                 win32print.SetPrinter(hprinter, 2, None, devmode)
-                print(f"Установлен формат бумаги A5 для принтера '{printer_name}'")
+                logger.info("Установлен формат бумаги %s для принтера '%s'", paper_size, printer_name)
         except Exception as e:
-            print(f"Не удалось установить формат бумаги A5: {e}")
+            logger.warning("Не удалось установить формат бумаги %s: %s", paper_size, e)
             # Продолжаем печать с текущими настройками
     success = False
     hdc = mem_dc = bitmap = None
@@ -598,7 +620,10 @@ def print_image_silent_gdi(image_path, printer_name=None, paper_size='A5'):
             src_y = (ih - src_h) // 2
         crop_box = (src_x, src_y, src_x + src_w, src_y + src_h)
         img_cropped = img.crop(crop_box)
-        hdc.StartDoc(f"Print: {os.path.basename(image_path)}")
+        if trace and 'spool_start' not in trace.events:
+            # Для многостраничного файла отмечаем начало первой страницы
+            trace.mark('spool_start')
+        job_id = hdc.StartDoc(f"Print: {document_name}")
         hdc.StartPage()
         mem_dc = hdc.CreateCompatibleDC()
         bitmap = win32ui.CreateBitmap()
@@ -615,9 +640,12 @@ def print_image_silent_gdi(image_path, printer_name=None, paper_size='A5'):
         hdc.EndPage()
         hdc.EndDoc()
         success = True
-        print(f"'{os.path.basename(image_path)}' напечатано на '{printer_name}'")
+        if trace:
+            trace.mark('spool_end')
+            trace.print_job = (printer_name, job_id)
+        logger.info("'%s' напечатано на '%s'", document_name, printer_name)
     except Exception as e:
-        print(f"Ошибка печати GDI: {e}")
+        logger.error("Ошибка печати GDI: %s", e)
         try:
             if hdc and hdc.GetSafeHdc():
                 hdc.AbortDoc()
@@ -646,141 +674,511 @@ def print_image_silent_gdi(image_path, printer_name=None, paper_size='A5'):
             pass
     return success
 
-def main():
-    if not sys.platform.startswith('win32'):
-        print("Скрипт работает только на Windows.")
-        return
-    if not WINDOWS_PRINT_AVAILABLE:
-        print("Установите 'pywin32' и 'Pillow'.")
+class PrinterSink(Sink):
+    """Печатает готовые страницы на принтере через GDI."""
+    name = 'printer'
+
+    def __init__(self, printer_name=None, required=True):
+        super().__init__(required)
+        self.printer_name = printer_name
+
+    def handle(self, page):
+        document_name = os.path.basename(page.key)
+        if page.number > 1:
+            document_name = f"{document_name}, стр. {page.number}"
+        return print_image_silent_gdi(page.image, self.printer_name, page.paper_size, page.trace, document_name)
+
+def output_name(output):
+    """Имя получателя: строка из OUTPUT_SINKS или имя готового объекта Sink."""
+    return output.name if isinstance(output, Sink) else output
+
+def build_sinks(s3_client, outputs=OUTPUT_SINKS):
+    """Создает и запускает получателей страниц по списку outputs.
+
+    Если среди них есть принтер, файл считается обработанным после печати,
+    остальные получатели работают в фоне. Без принтера обязательны все.
+    Кроме имен, outputs может содержать готовые объекты Sink (например,
+    имитацию принтера для нагрузочных тестов) — они используются как есть.
+    """
+    required = 'printer' not in [output_name(output) for output in outputs]
+    sinks = []
+    for output in outputs:
+        if isinstance(output, Sink):
+            sinks.append(output)
+        elif output == 'printer':
+            sinks.append(PrinterSink())
+        elif output == 'preview':
+            sinks.append(PreviewSink(required=required))
+        elif output == 'gallery':
+            store = GalleryStore()
+            GalleryServer(store).start()
+            sinks.append(GallerySink(store, required=required))
+        elif output == 'archive':
+            sinks.append(ArchiveSink(s3_client, S3_BUCKET_NAME, required=required))
+        else:
+            raise ValueError(f"Неизвестный получатель страниц: {output}")
+    for sink in sinks:
+        sink.start()
+        QUEUE_SIZE.set_function(sink.queue.qsize, queue=f"sink_{sink.name}")
+    return sinks
+
+class PrintJobWatcher:
+    """Отслеживает задания в очереди принтера и отмечает момент их завершения.
+
+    Работает в фоновом потоке, чтобы ожидание принтера не задерживало
+    постановку следующих заданий. Задание считается завершенным, когда
+    спулер помечает его напечатанным или удаляет из очереди. Если принтер
+    не ответил за PRINTER_COMPLETION_TIMEOUT_SECONDS, за завершение
+    принимается окончание постановки в спулер.
+    """
+
+    def __init__(self, on_complete):
+        self.on_complete = on_complete
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='print-job-watcher', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def watch(self, trace):
+        self.queue.put(trace)
+
+    def job_finished(self, printer_name, job_id):
+        """Проверяет, завершено ли задание принтера."""
+        done_mask = (getattr(win32print, 'JOB_STATUS_PRINTED', 0x80) |
+                     getattr(win32print, 'JOB_STATUS_COMPLETE', 0x1000))
+        hprinter = win32print.OpenPrinter(printer_name)
+        try:
+            job = win32print.GetJob(hprinter, job_id, 1)
+        except Exception:
+            # Задания больше нет в очереди — оно напечатано
+            return True
+        finally:
+            win32print.ClosePrinter(hprinter)
+        return bool(job['Status'] & done_mask)
+
+    def run(self):
+        active = []
+        while True:
+            # Ждем новых заданий; пока есть незавершенные — не дольше интервала опроса
+            try:
+                trace = self.queue.get(timeout=PRINTER_POLL_INTERVAL_SECONDS if active else None)
+                active.append((trace, time.monotonic() + PRINTER_COMPLETION_TIMEOUT_SECONDS))
+            except queue.Empty:
+                pass
+            still_active = []
+            for trace, deadline in active:
+                try:
+                    finished = self.job_finished(*trace.print_job)
+                except Exception as e:
+                    logger.warning("Не удалось проверить задание принтера для %s: %s", trace.key, e)
+                    finished = None
+                if finished:
+                    trace.mark('completed')
+                    self.on_complete(trace, 'printer')
+                elif finished is None or time.monotonic() >= deadline:
+                    self.on_complete(trace, 'spool')
+                else:
+                    still_active.append((trace, deadline))
+            active = still_active
+
+def on_print_job_completed(trace, completion_source):
+    """Завершает трассировку напечатанного задания и выводит задержки."""
+    finish_trace(trace, JOB_PRINTED, completion_source)
+    seconds = trace.end_to_end_seconds()
+    if seconds is not None:
+        logger.info("Файл %s вышел из принтера через %.1f с после загрузки (%s)",
+                    trace.key, seconds, format_latency_summary())
+
+class MessagePages:
+    """Страницы одного сообщения: при итерации рендерит их по одной.
+
+    failed — текст не рендерится; проверять после окончания итерации.
+    """
+
+    def __init__(self, key, text_content, template, trace):
+        self.key = key
+        self.text_content = text_content
+        self.template = template
+        self.trace = trace
+        self.failed = False
+
+    def __iter__(self):
+        self.trace.mark('render_start')
+        for number, img in enumerate(render_pages(self.template, self.text_content), 1):
+            if img is None:
+                self.failed = True
+                return
+            yield RenderedPage(self.key, img, self.trace, self.template.paper_size, number)
+        self.trace.mark('render_end')
+
+def message_result(pages, delivered):
+    """Результат задания по отрендеренному сообщению и итогу fan_out."""
+    if pages.failed:
+        return JOB_FAILED
+    return JOB_PRINTED if delivered else JOB_RETRY
+
+def deliver_message(key, text_content, template, sinks, trace):
+    """Рендерит текст по шаблону и отдает страницы получателям по мере готовности.
+
+    Возвращает JOB_PRINTED, если обязательные получатели справились,
+    JOB_FAILED, если текст не рендерится, и JOB_RETRY при ошибке печати.
+    """
+    pages = MessagePages(key, text_content, template, trace)
+    # Отдаем страницы получателям (принтер, предпросмотр, архив) по мере
+    # готовности: первая печатается, пока рендерятся следующие
+    delivered = fan_out(iter(pages), sinks)
+    return message_result(pages, delivered)
+
+def process_file(s3_client, key, printed_files, sinks, mover=None, trace=None, printed_log_file=PRINTED_LOG_FILE):
+    """Скачивает и рендерит один текстовый файл из S3 и отдает страницы получателям.
+
+    Файл скачивается и рендерится один раз, сколько бы получателей (принтер,
+    предпросмотр, архив) ни было включено. Возвращает JOB_PRINTED, если
+    обязательные получатели справились и файл записан в историю, JOB_FAILED,
+    если файл невозможно прочитать или отрендерить, и JOB_RETRY при временных
+    ошибках (скачивание, печать). Если передан mover, обработанные и
+    испорченные файлы переносятся из отслеживаемого префикса. Пакеты
+    сообщений обрабатывает process_bundle.
+    В trace (JobTrace) отмечаются начало и конец каждого этапа.
+    """
+    if trace is None:
+        trace = JobTrace(key)
+    # Скачиваем файл из S3 сразу в память
+    trace.mark('fetch_start')
+    fetched = fetch_object(s3_client, S3_BUCKET_NAME, key)
+    trace.mark('fetch_end')
+    if fetched is None:
+        return JOB_RETRY
+    data, metadata, content_encoding = fetched
+    try:
+        if is_bundle_key(key):
+            return process_bundle(key, data, metadata, content_encoding, printed_files, sinks, mover, trace,
+                                  printed_log_file)
+        with time_stage('read'):
+            text_content = decode_object(key, data, content_encoding)
+        if text_content is None:
+            if mover:
+                mover.move(key, failed=True)
+            return JOB_FAILED
+        # Рендерим страницы по шаблону, выбранному по метаданным или префиксу ключа
+        template = TEMPLATES.select(key, metadata)
+        result = deliver_message(key, text_content, template, sinks, trace)
+        if result == JOB_FAILED:
+            if mover:
+                mover.move(key, failed=True)
+        elif result == JOB_PRINTED:
+            # Сохраняем информацию о печати
+            save_printed_file(key, printed_log_file)
+            printed_files.add(key)
+            if mover:
+                mover.move(key)
+            logger.info("Файл %s успешно обработан", key)
+        return result
+    except Exception as e:
+        logger.error("Ошибка при обработке файла %s: %s", key, e)
+        return JOB_RETRY
+
+def process_bundle(key, data, metadata, content_encoding, printed_files, sinks, mover=None, trace=None,
+                   printed_log_file=PRINTED_LOG_FILE, deliver=deliver_message):
+    """Печатает сообщения пакета key по порядку.
+
+    Каждое напечатанное сообщение записывается в историю под ключом
+    пакет#id, поэтому после ошибки печати пакет повторяется с первого
+    ненапечатанного сообщения. Сообщение, которое не читается или не
+    рендерится, пропускается. Когда пройдены все сообщения, в историю
+    записывается и сам пакет. Возвращает JOB_PRINTED, JOB_FAILED (пакет не
+    читается) или JOB_RETRY (сообщение не напечатано). Сообщения печатает
+    deliver — функция с сигнатурой deliver_message.
+    """
+    if trace is None:
+        trace = JobTrace(key)
+    with time_stage('read'):
+        try:
+            entries = read_bundle(key, data, content_encoding, decode_text)
+        except PayloadError as e:
+            logger.error("Не удалось прочитать пакет %s: %s", key, e)
+            entries = None
+    if entries is None:
+        if mover:
+            mover.move(key, failed=True)
+        return JOB_FAILED
+    done = sum(1 for entry in entries if bundle_entry_key(key, entry.id) in printed_files)
+    logger.info("Пакет %s: %s сообщений, напечатано ранее %s", key, len(entries), done)
+    printed = failed = 0
+    for entry in entries:
+        entry_key = bundle_entry_key(key, entry.id)
+        if entry_key in printed_files:
+            continue
+        result = JOB_FAILED
+        if entry.text is not None:
+            # Шаблон сообщения важнее шаблона из метаданных пакета
+            entry_metadata = dict(metadata, **{TEMPLATE_METADATA_KEY: entry.template}) if entry.template else metadata
+            result = deliver(entry_key, entry.text, TEMPLATES.select(entry_key, entry_metadata), sinks, trace)
+        BUNDLE_ENTRIES.inc(result=result)
+        if result == JOB_RETRY:
+            logger.warning("Пакет %s: сообщение %s не напечатано, пакет будет повторен", key, entry.id)
+            return JOB_RETRY
+        if result == JOB_FAILED:
+            logger.error("Пакет %s: сообщение %s невозможно напечатать, пропускаем", key, entry.id)
+            failed += 1
+            continue
+        save_printed_file(entry_key, printed_log_file)
+        printed_files.add(entry_key)
+        printed += 1
+    save_printed_file(key, printed_log_file)
+    printed_files.add(key)
+    if mover:
+        mover.move(key)
+    logger.info("Пакет %s обработан: напечатано %s, ранее %s, с ошибками %s", key, printed, done, failed)
+    return JOB_PRINTED
+
+def poll_s3_changes(s3_client, known_files, printed_files, scheduler, pending, traces, lock=None):
+    """Сравнивает листинг бакета со снимком и ставит новые файлы в очередь.
+
+    Возвращает новый снимок. Если листинг оборвался, возвращает прежний.
+    lock защищает scheduler, pending и traces, если их читает другой поток.
+    """
+    # Сравниваем листинг со снимком потоково: в памяти остаются только
+    # компактный снимок и новые или измененные файлы
+    current_files = SnapshotBuilder()
+    try:
+        with time_stage('list'):
+            for key, last_modified in iter_changes(iter_s3_listing_pages(s3_client, S3_BUCKET_NAME),
+                                                   known_files, current_files, is_text_key):
+                # Пропускаем файлы, которые уже были напечатаны
+                if key in printed_files:
+                    continue
+                with lock or contextlib.nullcontext():
+                    # Файл уже в очереди, печатается или ждет повтора: после
+                    # оборванного листинга снимок прежний, и он снова виден как новый
+                    if pending.get(key) == last_modified:
+                        continue
+                    if scheduler.push(key, last_modified):
+                        logger.info("Новый текстовый файл в S3: %s", key)
+                        traces[key] = JobTrace(key, last_modified)
+                    pending[key] = last_modified
+    except ClientError as e:
+        logger.error("Ошибка при получении списка файлов из S3: %s", e, extra=RATE_LIMITED)
+        return known_files
+    return current_files.build()
+
+class ListingPoller:
+    """Опрашивает бакет в отдельном потоке и ставит новые файлы в планировщик.
+
+    Листинг не зависит от печати: бэклог из многих файлов разбирается без
+    полного листинга перед каждым заданием, а свежие загрузки попадают в
+    очередь, пока печатается текущий файл. Следующий листинг начинается
+    через interval секунд после окончания предыдущего. scheduler, pending
+    и traces общие с основным циклом и изменяются только под lock.
+    """
+
+    def __init__(self, s3_client, known_files, printed_files, scheduler, pending, traces,
+                 interval=CHECK_INTERVAL_SECONDS):
+        self.s3_client = s3_client
+        self.known_files = known_files
+        self.printed_files = printed_files
+        self.scheduler = scheduler
+        self.pending = pending
+        self.traces = traces
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()  # Устанавливается после каждого листинга
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='s3-poller', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает опрос, дождавшись текущего листинга."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.known_files = poll_s3_changes(self.s3_client, self.known_files, self.printed_files,
+                                                   self.scheduler, self.pending, self.traces, self.lock)
+            except Exception as e:
+                logger.error("Ошибка при опросе S3: %s", e)
+            self.wakeup.set()
+            self.stopped.wait(self.interval)
+
+def main(outputs=OUTPUT_SINKS, printed_log_file=PRINTED_LOG_FILE, checkpoint_file=CHECKPOINT_FILE):
+    """Отслеживает бакет и отдает каждую новую страницу получателям outputs.
+
+    printed_log_file и checkpoint_file позволяют запускать режимы с разными
+    получателями (например, только предпросмотр) с отдельной историей.
+    """
+    setup_logging()
+    if 'printer' in outputs and not sys.platform.startswith('win32'):
+        logger.error("Печать работает только на Windows.")
         return
-    
-    # Проверяем наличие шаблона изображения
-    if not os.path.exists(TEMPLATE_IMAGE):
-        print(f"Ошибка: шаблон изображения не найден по пути '{TEMPLATE_IMAGE}'")
+    required_modules = dict(REQUIRED_MODULES)
+    if 'printer' not in outputs:
+        del required_modules['win32print']
+    if 'gallery' in outputs:
+        required_modules['aiohttp'] = 'aiohttp'
+    if not check_modules(required_modules):
         return
     
-    # Инициализация S3 клиента
-    s3_client = get_s3_client()
+    # Шаблон, шрифты и S3 клиент проверяются параллельно
+    s3_client = preflight()
     if s3_client is None:
-        print("Невозможно продолжить без S3 клиента.")
+        logger.error("Невозможно продолжить, исправьте ошибки выше.")
         return
     
     # Загрузка истории печати
-    printed_files = load_printed_files()
-    print(f"Загружено {len(printed_files)} записей о ранее напечатанных файлах.")
+    printed_files = load_printed_files(printed_log_file)
+    logger.info("Загружено %s записей о ранее напечатанных файлах.", len(printed_files))
     
-    # Получаем начальное состояние бакета
-    print(f"Отслеживаем S3 бакет '{S3_BUCKET_NAME}' на наличие TXT файлов...")
-    current_files = list_files_in_s3_bucket(s3_client, S3_BUCKET_NAME)
+    logger.info("Отслеживаем S3 бакет '%s' на наличие TXT файлов...", S3_BUCKET_NAME)
+    scheduler = JobScheduler()
+    checkpoint = load_checkpoint(checkpoint_file)
+    if checkpoint is not None:
+        # Возобновляемся с сохраненного снимка: полный обход бакета не нужен,
+        # новые файлы найдет первая же итерация мониторинга
+        known_files = checkpoint['snapshot']
+        pending = {key: last_modified for key, last_modified in checkpoint['pending'].items()
+                   if key not in printed_files}
+        logger.info("Восстановлена контрольная точка: %s файлов, водяной знак %s, %s необработанных",
+                    len(known_files), checkpoint['watermark'], len(pending))
+        # Необработанные файлы из контрольной точки уходят в бэклог
+        for key, last_modified in pending.items():
+            scheduler.push(key, last_modified, BACKLOG)
+    else:
+        # Без контрольной точки начинаем с пустого снимка: первая итерация
+        # мониторинга поставит в очередь все ненапечатанные файлы в бакете
+        logger.info("Контрольная точка не найдена, будут проверены все файлы в S3 бакете")
+        known_files = Snapshot()
+        pending = {}
     
-    # При запуске обрабатываем все ненапечатанные файлы
-    print("Проверка всех файлов в S3 бакете на наличие необработанных...")
-    for key, last_modified in current_files.items():
-        # Проверяем, является ли файл текстовым
-        if not key.lower().endswith(TXT_EXTENSION):
-            continue
-            
-        # Проверяем, был ли файл уже обработан
-        if key not in printed_files:
-            print(f"Найден необработанный файл в S3: {key}")
-            
-            # Скачиваем файл из S3
-            temp_txt_path = download_file_from_s3(s3_client, S3_BUCKET_NAME, key)
-            if temp_txt_path:
-                try:
-                    # Читаем текст из файла
-                    text_content = read_text_from_file(temp_txt_path)
-                    if text_content is not None:
-                        # Создаем изображение с текстом на основе шаблона
-                        image_with_text_path = create_image_with_text(TEMPLATE_IMAGE, text_content)
-                        if image_with_text_path:
-                            try:
-                                # Печатаем изображение
-                                if print_image_silent_gdi(image_with_text_path):
-                                    # Сохраняем информацию о печати
-                                    save_printed_file(key)
-                                    printed_files.add(key)
-                                    print(f"Файл {key} успешно обработан и напечатан")
-                            finally:
-                                # Удаляем временный файл с изображением
-                                try:
-                                    os.unlink(image_with_text_path)
-                                except Exception as e:
-                                    print(f"Ошибка при удалении временного файла изображения: {e}")
-                finally:
-                    # Удаляем временный текстовый файл
-                    try:
-                        os.unlink(temp_txt_path)
-                    except Exception as e:
-                        print(f"Ошибка при удалении временного текстового файла: {e}")
+    output_names = [output_name(output) for output in outputs]
+    printing = 'printer' in output_names
+    # Перенос обработанных объектов из отслеживаемого префикса (по желанию) и
+    # аренды заданий, если бакет делят несколько станций печати; режимы без
+    # принтера (предпросмотр) не должны уносить или забирать файлы у станций
+    mover = ProcessedMover(s3_client, S3_BUCKET_NAME).start() if MOVE_PROCESSED_OBJECTS and printing else None
+    leases = None
+    if LEASES_ENABLED and printing:
+        leases = LeaseManager(s3_client, S3_BUCKET_NAME).start()
+        logger.info("Задания распределяются между станциями через аренды (станция %s)", leases.owner)
+    # Получатели готовых страниц, каждый со своей очередью
+    sinks = build_sinks(s3_client, outputs)
+    logger.info("Получатели страниц: %s", ', '.join(output_names))
     
-    print("Проверка завершена, переходим в режим мониторинга новых файлов")
+    # Метрики этапов и размеров очередей
+    QUEUE_SIZE.set_function(lambda: scheduler.sizes()[LIVE], queue=LIVE)
+    QUEUE_SIZE.set_function(lambda: scheduler.sizes()[BACKLOG], queue=BACKLOG)
+    QUEUE_SIZE.set_function(lambda: len(pending), queue='pending')
+    if mover:
+        QUEUE_SIZE.set_function(mover.queue.qsize, queue='move')
+    if METRICS_ENABLED:
+        start_metrics_server()
     
-    # Сохраняем текущее состояние бакета
-    known_files = current_files
-    last_check_time = datetime.datetime.now(datetime.timezone.utc)
+    # Трассировка заданий: от загрузки в S3 до выхода страницы из принтера
+    traces = {}
+    job_watcher = PrintJobWatcher(on_print_job_completed).start()
+    # Файлы после временной ошибки: {ключ: (время повтора, LastModified)}
+    retries = {}
+    
+    # Листинг бакета идет в своем потоке и не задерживает печать
+    poller = ListingPoller(s3_client, known_files, printed_files, scheduler, pending, traces)
+    
+    # Память процесса и размеры коллекций, которые растут с каждым файлом
+    memory = None
+    if MEMORY_MONITOR_ENABLED:
+        memory = MemoryMonitor().start()
+        memory.track('printed_files', lambda: len(printed_files))
+        memory.track('known_files', lambda: len(poller.known_files))
+        memory.track('pending', lambda: len(pending))
+        memory.track('traces', lambda: len(traces))
+    
+    logger.info("Переходим в режим мониторинга новых файлов")
+    last_checkpoint_time = time.monotonic()
+    poller.start()
     
     try:
         while True:
-            time.sleep(CHECK_INTERVAL_SECONDS)
-            
-            # Получаем текущее состояние бакета
-            current_files = list_files_in_s3_bucket(s3_client, S3_BUCKET_NAME)
-            
-            # Проверяем новые или измененные файлы
-            for key, last_modified in current_files.items():
-                # Проверяем, является ли файл текстовым
-                if not key.lower().endswith(TXT_EXTENSION):
-                    continue
+            with poller.lock:
+                # Возвращаем в очередь файлы, которым пора повторить попытку
+                now = time.monotonic()
+                for key, (retry_time, last_modified) in list(retries.items()):
+                    if retry_time <= now:
+                        del retries[key]
+                        if key in pending:
+                            scheduler.push(key, last_modified, BACKLOG)
                 
-                # Проверяем, новый ли это файл или был ли он изменен с момента последней проверки
-                is_new = key not in known_files
-                is_modified = (key in known_files and last_modified > known_files[key])
-                is_not_printed = key not in printed_files
+                # Периодически сохраняем контрольную точку
+                if now - last_checkpoint_time >= CHECKPOINT_INTERVAL_SECONDS:
+                    save_checkpoint(poller.known_files, pending, checkpoint_file)
+                    last_checkpoint_time = time.monotonic()
                 
-                # Если файл новый или изменен и не был напечатан ранее
-                if (is_new or is_modified) and is_not_printed:
-                    print(f"Новый текстовый файл в S3: {key}")
-                    
-                    # Скачиваем файл из S3
-                    temp_txt_path = download_file_from_s3(s3_client, S3_BUCKET_NAME, key)
-                    if temp_txt_path:
-                        try:
-                            # Читаем текст из файла
-                            text_content = read_text_from_file(temp_txt_path)
-                            if text_content is not None:
-                                # Создаем изображение с текстом на основе шаблона
-                                image_with_text_path = create_image_with_text(TEMPLATE_IMAGE, text_content)
-                                if image_with_text_path:
-                                    try:
-                                        # Печатаем изображение
-                                        if print_image_silent_gdi(image_with_text_path):
-                                            # Сохраняем информацию о печати
-                                            save_printed_file(key)
-                                            printed_files.add(key)
-                                    finally:
-                                        # Удаляем временный файл с изображением
-                                        try:
-                                            os.unlink(image_with_text_path)
-                                        except Exception as e:
-                                            print(f"Ошибка при удалении временного файла изображения: {e}")
-                        except Exception as e:
-                            print(f"Ошибка при обработке файла {key}: {e}")
-                        finally:
-                            # Удаляем временный текстовый файл
-                            if temp_txt_path and os.path.exists(temp_txt_path):
-                                try:
-                                    os.unlink(temp_txt_path)
-                                except Exception as e:
-                                    print(f"Ошибка при удалении временного текстового файла: {e}")
+                job = scheduler.pop()
+            if job is None:
+                # Ждем следующего листинга (или времени повтора)
+                poller.wakeup.wait(CHECK_INTERVAL_SECONDS)
+                poller.wakeup.clear()
+                continue
             
-            # Обновляем известные файлы
-            known_files = current_files
+            key, last_modified, job_class = job
+            if leases:
+                lease = leases.acquire(key)
+                if lease == LEASE_DONE:
+                    # Файл уже обработан другой станцией, запоминаем его локально
+                    save_printed_file(key, printed_log_file)
+                    printed_files.add(key)
+                    with poller.lock:
+                        pending.pop(key, None)
+                        traces.pop(key, None)
+                    continue
+                if lease != LEASE_ACQUIRED:
+                    # Файл печатает другая станция: проверим позже, закончила ли она
+                    retries[key] = (time.monotonic() + RETRY_DELAY_SECONDS, last_modified)
+                    continue
+            logger.info("Обработка файла %s (очередь: %s, осталось %s)", key, job_class, len(scheduler))
+            with poller.lock:
+                trace = traces.pop(key, None) or JobTrace(key, last_modified)
+            with memory.job(key) if memory else contextlib.nullcontext():
+                result = process_file(s3_client, key, printed_files, sinks, mover, trace, printed_log_file)
+            JOBS_TOTAL.inc(result=result)
+            if leases:
+                if result == JOB_RETRY:
+                    leases.release(key)
+                else:
+                    leases.complete(key, failed=result == JOB_FAILED)
+            if result == JOB_PRINTED and trace.print_job:
+                job_watcher.watch(trace)
+            else:
+                finish_trace(trace, result)
+            if result == JOB_RETRY:
+                # Не теряем файл до следующего изменения или перезапуска
+                retries[key] = (time.monotonic() + RETRY_DELAY_SECONDS, last_modified)
+            else:
+                with poller.lock:
+                    pending.pop(key, None)
             
     except KeyboardInterrupt:
-        print("Остановлено.")
+        logger.info("Остановлено.")
     except Exception as e:
-        print(f"Критическая ошибка: {e}")
+        logger.error("Критическая ошибка: %s", e)
+    finally:
+        # Дожидаемся листинга, получателей и переноса обработанных
+        # объектов и сохраняем контрольную точку
+        poller.stop()
+        for sink in sinks:
+            sink.stop()
+        if mover:
+            mover.stop()
+        if leases:
+            leases.stop()
+        if memory:
+            memory.stop()
+        save_checkpoint(poller.known_files, pending, checkpoint_file)
 
 if __name__ == "__main__":
     main()
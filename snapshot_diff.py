@@ -0,0 +1,107 @@
+import array
+import bisect
+import base64
+import hashlib
+import datetime
+
+def key_hash(key):
+    """Возвращает 64-битный хеш ключа S3."""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class Snapshot:
+    """Компактный снимок бакета.
+
+    Хранит два параллельных массива, отсортированных по хешу ключа:
+    64-битные хеши ключей и время последнего изменения (Unix time).
+    Это около 16 байт на объект вместо словаря строк и datetime.
+    """
+
+    def __init__(self, hashes=None, mtimes=None):
+        self.hashes = hashes if hashes is not None else array.array('Q')
+        self.mtimes = mtimes if mtimes is not None else array.array('d')
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get(self, h):
+        """Возвращает время изменения для хеша ключа или None, если ключа нет в снимке."""
+        i = bisect.bisect_left(self.hashes, h)
+        if i < len(self.hashes) and self.hashes[i] == h:
+            return self.mtimes[i]
+        return None
+
+    def watermark(self):
+        """Максимальное LastModified в снимке (водяной знак листинга) или None."""
+        if not self.mtimes:
+            return None
+        return datetime.datetime.fromtimestamp(max(self.mtimes), datetime.timezone.utc)
+
+    @classmethod
+    def from_items(cls, items):
+        """Строит снимок из пар (ключ, LastModified)."""
+        builder = SnapshotBuilder()
+        for key, last_modified in items:
+            builder.add(key_hash(key), last_modified.timestamp())
+        return builder.build()
+
+    def to_dict(self):
+        """Сериализует снимок для контрольной точки."""
+        return {
+            'hashes': base64.b64encode(self.hashes.tobytes()).decode('ascii'),
+            'mtimes': base64.b64encode(self.mtimes.tobytes()).decode('ascii'),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает снимок из результата to_dict."""
+        hashes = array.array('Q')
+        hashes.frombytes(base64.b64decode(data['hashes']))
+        mtimes = array.array('d')
+        mtimes.frombytes(base64.b64decode(data['mtimes']))
+        if len(hashes) != len(mtimes):
+            raise ValueError("Размеры массивов снимка не совпадают")
+        return cls(hashes, mtimes)
+
+class SnapshotBuilder:
+    """Накапливает следующий снимок по мере чтения страниц листинга."""
+
+    def __init__(self):
+        self.hashes = array.array('Q')
+        self.mtimes = array.array('d')
+
+    def add(self, h, mtime):
+        self.hashes.append(h)
+        self.mtimes.append(mtime)
+
+    def build(self):
+        """Сортирует накопленные записи по хешу и возвращает Snapshot."""
+        order = sorted(range(len(self.hashes)), key=self.hashes.__getitem__)
+        hashes = array.array('Q', (self.hashes[i] for i in order))
+        mtimes = array.array('d', (self.mtimes[i] for i in order))
+        return Snapshot(hashes, mtimes)
+
+def iter_changes(pages, snapshot, builder, key_filter=None):
+    """Потоково сравнивает страницы листинга со снимком.
+
+    Аргументы:
+        pages: итератор страниц ответа list_objects_v2 (в лексикографическом порядке ключей)
+        snapshot: предыдущий Snapshot
+        builder: SnapshotBuilder, в который записывается новый снимок
+        key_filter: функция отбора ключей (если None, учитываются все ключи)
+
+    Возвращает генератор пар (ключ, LastModified) только для новых и
+    измененных объектов. Новый снимок доступен через builder.build()
+    после того, как генератор исчерпан.
+    """
+    for page in pages:
+        for obj in page.get('Contents', ()):
+            key = obj['Key']
+            if key_filter is not None and not key_filter(key):
+                continue
+            last_modified = obj['LastModified']
+            h = key_hash(key)
+            mtime = last_modified.timestamp()
+            builder.add(h, mtime)
+            previous = snapshot.get(h)
+            if previous is None or mtime > previous:
+                yield key, last_modified
@@ -0,0 +1,103 @@
+import time
+import logging
+import importlib
+import importlib.util
+import threading
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+STARTED = time.perf_counter()  # Момент начала импорта скриптов (этот модуль импортируется первым)
+PREFLIGHT_TIMEOUT_SECONDS = 30  # Сколько ждать завершения проверок при запуске
+
+IMPORT_SECONDS = {}  # Время отложенного импорта тяжелых модулей по имени
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к атрибуту.
+
+    Тяжелые зависимости (boto3, Pillow, pywin32, emoji) не замедляют
+    запуск скрипта и загружаются, только когда действительно нужны.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                started = time.perf_counter()
+                self._module = importlib.import_module(self._name)
+                IMPORT_SECONDS[self._name] = time.perf_counter() - started
+                logger.debug("Модуль %s импортирован за %.3f с", self._name, IMPORT_SECONDS[self._name])
+            return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'загружен' if self._module is not None else 'не загружен'
+        return f"<LazyModule {self._name} ({state})>"
+
+def lazy_import(name):
+    """Возвращает модуль name, импорт которого отложен до первого использования."""
+    return LazyModule(name)
+
+def module_available(name):
+    """Проверяет, установлен ли модуль, не импортируя его."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+def check_modules(requirements):
+    """Проверяет, что все модули установлены, не импортируя их.
+
+    requirements — словарь {имя модуля: имя пакета для pip}. Вместо
+    установки пакетов на лету сразу сообщает, чего не хватает.
+    Возвращает True, если все на месте.
+    """
+    missing = sorted({package for name, package in requirements.items() if not module_available(name)})
+    if missing:
+        logger.error("Не установлены пакеты, выполните: pip install %s", ' '.join(missing))
+        return False
+    return True
+
+def run_preflight(checks):
+    """Параллельно выполняет проверки перед запуском.
+
+    checks — словарь {название: функция без аргументов}. Функция возвращает
+    результат (например, готовый клиент) или выбрасывает исключение с
+    понятным описанием проблемы. Возвращает словарь результатов или None,
+    если хотя бы одна проверка не прошла.
+    """
+    started = time.perf_counter()
+    results = {}
+    failed = False
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(checks) or 1,
+                                                     thread_name_prefix='preflight')
+    try:
+        futures = {name: executor.submit(check) for name, check in checks.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(timeout=PREFLIGHT_TIMEOUT_SECONDS)
+            except concurrent.futures.TimeoutError:
+                logger.error("Проверка '%s' не завершилась за %s с", name, PREFLIGHT_TIMEOUT_SECONDS)
+                failed = True
+            except Exception as e:
+                logger.error("Проверка '%s' не пройдена: %s", name, e)
+                failed = True
+    finally:
+        # Зависшую проверку не ждем: при ошибке скрипт все равно завершается
+        executor.shutdown(wait=not failed, cancel_futures=True)
+    if failed:
+        return None
+    finished = time.perf_counter()
+    imports = ', '.join(f"{name} {seconds:.2f}" for name, seconds in sorted(IMPORT_SECONDS.items()))
+    logger.info("Готов к работе за %.2f с (проверки %.2f с; отложенный импорт, с: %s)",
+                finished - STARTED, finished - started, imports or '—')
+    return results
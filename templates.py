@@ -0,0 +1,163 @@
+import os
+import json
+import logging
+import threading
+
+from startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_MANIFEST = os.path.join('src', 'templates.json')  # Описание шаблонов и текстовых областей
+TEMPLATE_METADATA_KEY = 'template'  # Метаданные объекта S3 (x-amz-meta-template) с именем шаблона
+
+# Параметры раскладки по умолчанию (исходный шаблон A5-front.png)
+DEFAULT_LAYOUT = {
+    'paper_size': 'A5',
+    'text_region': {'x': 52, 'y': 140, 'width': 776 - 52, 'height': 960 - 140},
+    'font': 'NotoSans-Regular.ttf',
+    'font_size': 24,
+    'line_height': 30,
+    'color': 'black',
+    'emoji_font_size': 36,  # Размер шрифта, которым рисуются эмодзи
+    'emoji_height': 24,  # Высота эмодзи на странице
+}
+
+class Template:
+    """Шаблон страницы: фоновое изображение и параметры раскладки текста.
+
+    Фон декодируется один раз (compile), а каждое задание получает его
+    копию, поэтому на задание не приходится ни чтения, ни разбора файлов.
+    """
+
+    def __init__(self, name, image_path, layout, font_dir='', prefixes=()):
+        self.name = name
+        self.image_path = image_path
+        self.prefixes = tuple(prefixes)
+        params = dict(DEFAULT_LAYOUT, **layout)
+        region = dict(DEFAULT_LAYOUT['text_region'], **params['text_region'])
+        self.paper_size = params['paper_size']
+        self.text_x = int(region['x'])
+        self.text_y = int(region['y'])
+        self.text_width = int(region['width'])
+        self.text_height = int(region['height'])
+        font = params['font']
+        self.font_path = font if os.path.isabs(font) else os.path.join(font_dir, font)
+        self.font_size = int(params['font_size'])
+        self.line_height = params['line_height']
+        self.color = params['color']
+        self.emoji_font_size = int(params['emoji_font_size'])
+        self.emoji_height = int(params['emoji_height'])
+        self.base = None
+        self.lock = threading.Lock()
+
+    def compile(self):
+        """Декодирует фоновое изображение (один раз)."""
+        with self.lock:
+            if self.base is None:
+                base = Image.open(self.image_path)
+                base.load()
+                self.base = base
+        return self.base
+
+    def new_canvas(self):
+        """Копия фона, на которой рисуется страница."""
+        return (self.base or self.compile()).copy()
+
+    def layout(self):
+        """Параметры, от которых зависит результат рендеринга (для ключа кэша)."""
+        return {
+            'paper_size': self.paper_size,
+            'text_region': [self.text_x, self.text_y, self.text_width, self.text_height],
+            'font': self.font_path,
+            'font_size': self.font_size,
+            'line_height': self.line_height,
+            'color': self.color,
+            'emoji_font_size': self.emoji_font_size,
+            'emoji_height': self.emoji_height,
+        }
+
+class TemplateRegistry:
+    """Шаблоны из манифеста и выбор шаблона для файла.
+
+    Манифест (JSON):
+        {"default": "a5-front",
+         "templates": {"a5-front": {"image": "A5-front.png", "prefixes": ["cards/"],
+                                    "paper_size": "A5",
+                                    "text_region": {"x": 52, "y": 140, "width": 724, "height": 820},
+                                    "font": "NotoSans-Regular.ttf", "font_size": 24, ...}}}
+    Пути к изображениям берутся относительно манифеста, шрифты — относительно
+    font_dir. Без манифеста доступен один шаблон default_image с раскладкой
+    DEFAULT_LAYOUT.
+    """
+
+    def __init__(self, manifest_path=TEMPLATE_MANIFEST, default_image=None, font_dir=''):
+        self.manifest_path = manifest_path
+        self.default_image = default_image
+        self.font_dir = font_dir
+        self.templates = None
+        self.default = None
+        self.by_image = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Читает манифест и компилирует все шаблоны. Ошибки манифеста выбрасываются."""
+        with self.lock:
+            if self.templates is not None:
+                return self
+            templates = {}
+            default_name = 'default'
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                base_dir = os.path.dirname(self.manifest_path)
+                for name, spec in manifest['templates'].items():
+                    spec = dict(spec)
+                    image = spec.pop('image')
+                    prefixes = spec.pop('prefixes', ())
+                    templates[name] = Template(name, os.path.join(base_dir, image), spec, self.font_dir, prefixes)
+                default_name = manifest.get('default', next(iter(templates)))
+                if default_name not in templates:
+                    raise ValueError(f"шаблон по умолчанию '{default_name}' не описан в манифесте")
+            else:
+                templates[default_name] = Template(default_name, self.default_image, {}, self.font_dir)
+            for template in templates.values():
+                template.compile()
+            self.templates = templates
+            self.default = templates[default_name]
+            self.by_image = {os.path.abspath(template.image_path): template for template in templates.values()}
+            logger.info("Загружено шаблонов: %s (по умолчанию '%s')", len(templates), default_name)
+            return self
+
+    def get(self, name):
+        self.load()
+        return self.templates.get(name)
+
+    def select(self, key, metadata=None):
+        """Шаблон для объекта: по метаданным, затем по самому длинному префиксу ключа."""
+        self.load()
+        name = (metadata or {}).get(TEMPLATE_METADATA_KEY)
+        if name:
+            template = self.templates.get(name)
+            if template is not None:
+                return template
+            logger.warning("Шаблон '%s' из метаданных %s не найден, используем шаблон по умолчанию", name, key)
+        best = self.default
+        best_length = -1
+        for template in self.templates.values():
+            for prefix in template.prefixes:
+                if key.startswith(prefix) and len(prefix) > best_length:
+                    best, best_length = template, len(prefix)
+        return best
+
+    def for_image(self, image_path):
+        """Шаблон с указанным фоном; для незнакомого файла — раскладка по умолчанию."""
+        self.load()
+        path = os.path.abspath(image_path)
+        with self.lock:
+            template = self.by_image.get(path)
+            if template is None:
+                template = self.by_image[path] = Template(os.path.basename(image_path), image_path,
+                                                          {}, self.font_dir)
+        return template
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import silent_print_s3
+import job_trace
+from pipeline import Sink
+from s3_throttle import CLIENT_RETRIES
+
+BUCKET_NAME = 'test-bucket'
+SLOWDOWN_BODY = (b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>SlowDown</Code>'
+                 b'<Message>Please reduce your request rate.</Message></Error>')
+
+class RawBody:
+    """Тело готового ответа botocore (AWSResponse.raw)."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+def slowdown_response(request):
+    """Ответ 503 SlowDown на запрос, как от перегруженного хранилища."""
+    from botocore.awsrequest import AWSResponse
+    return AWSResponse(request.url, 503, {'Content-Type': 'application/xml'}, RawBody(SLOWDOWN_BODY))
+
+class RecordingPrinter(Sink):
+    """Имитация принтера: запоминает страницы и не печатает ключи из fail."""
+    name = 'printer'
+
+    def __init__(self, fail=()):
+        super().__init__(required=True)
+        self.fail = set(fail)
+        self.printed = []
+
+    def handle(self, page):
+        if page.key in self.fail:
+            return False
+        self.printed.append(page.key)
+        return True
+
+@pytest.fixture
+def s3_client():
+    """Клиент S3 поверх moto с пустым бакетом BUCKET_NAME и повторами, как в production."""
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    from botocore.config import Config
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1', config=Config(retries=CLIENT_RETRIES))
+        client.create_bucket(Bucket=BUCKET_NAME)
+        yield client
+
+@pytest.fixture
+def watcher_env(tmp_path, monkeypatch):
+    """Рабочая директория для рендеринга; возвращает путь журнала напечатанных файлов."""
+    # Шаблоны и шрифты лежат в src/ относительно корня репозитория
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(silent_print_s3, 'RENDER_CACHE', None)
+    # Трассировки заданий не должны дописываться в корень репозитория
+    monkeypatch.setattr(job_trace.TRACE_WRITER, 'path', str(tmp_path / 'job_traces.jsonl'))
+    return str(tmp_path / 'printed_files.txt')
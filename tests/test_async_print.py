@@ -0,0 +1,138 @@
+import json
+import time
+import asyncio
+import datetime
+
+from PIL import Image
+
+import silent_print_s3
+import async_print_s3
+from async_print_s3 import AsyncWatcher
+from silent_print_s3 import TEMPLATES, load_printed_files, JOB_PRINTED, JOB_RETRY
+from text_payload import bundle_entry_key
+from job_trace import JobTrace
+from conftest import RecordingPrinter
+
+class FakeBody:
+    """Тело ответа get_object aiobotocore."""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self, size=-1):
+        return self.data if size < 0 else self.data[:size]
+
+class FakeAsyncS3:
+    """Клиент aiobotocore с фиксированным набором объектов {ключ: содержимое}."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc)
+
+    def get_paginator(self, operation):
+        return self
+
+    async def _pages(self):
+        yield {'Contents': [{'Key': key, 'LastModified': self.last_modified} for key in sorted(self.objects)]}
+
+    def paginate(self, **kwargs):
+        return self._pages()
+
+    async def get_object(self, Bucket, Key):
+        return {'Body': FakeBody(self.objects[Key]), 'Metadata': {}, 'ContentEncoding': None}
+
+def slow_render_pages(template, text_content):
+    """Три страницы, каждая рендерится заметное время."""
+    for _ in range(3):
+        time.sleep(0.02)
+        yield Image.new('1', (8, 8), 1)
+
+def make_watcher(client, sinks, **kwargs):
+    watcher = AsyncWatcher(client, sinks, **kwargs)
+    for sink in sinks:
+        sink.start()
+    return watcher
+
+async def close_watcher(watcher):
+    watcher.render_executor.shutdown()
+    watcher.delivery_executor.shutdown()
+    for sink in watcher.sinks:
+        await asyncio.to_thread(sink.stop)
+
+def test_concurrent_messages_reach_printer_whole(watcher_env, monkeypatch):
+    # Страницы двух сообщений готовятся вперемешку
+    monkeypatch.setattr(silent_print_s3, 'render_pages', slow_render_pages)
+    monkeypatch.setattr(async_print_s3, 'RENDER_WORKERS', 4)
+    printer = RecordingPrinter()
+
+    async def run():
+        watcher = make_watcher(None, [printer], printed_log_file=watcher_env)
+        try:
+            messages = [(key, JobTrace(key)) for key in ('a.txt', 'b.txt')]
+            return await asyncio.gather(*(
+                watcher.print_message(key, 'текст', TEMPLATES.select(key, {}), trace)
+                for key, trace in messages))
+        finally:
+            await close_watcher(watcher)
+
+    assert asyncio.run(run()) == [JOB_PRINTED, JOB_PRINTED]
+    assert printer.printed.count('a.txt') == 3
+    assert printer.printed.count('b.txt') == 3
+    # Страницы одного сообщения идут подряд, не вперемешку с другим
+    first = printer.printed[0]
+    second = 'b.txt' if first == 'a.txt' else 'a.txt'
+    assert printer.printed == [first] * 3 + [second] * 3
+
+def test_bundle_goes_through_process_bundle(watcher_env):
+    key = 'messages/badges.jsonl'
+    data = '\n'.join(json.dumps({'id': entry_id, 'text': name}, ensure_ascii=False)
+                     for entry_id, name in ((1, 'Анна'), (2, 'Борис'))).encode('utf-8')
+    entry_keys = [bundle_entry_key(key, entry_id) for entry_id in (1, 2)]
+
+    def run(printer):
+        async def bundle():
+            watcher = make_watcher(None, [printer], printed_log_file=watcher_env)
+            try:
+                return await watcher.print_bundle(key, data, {}, None, JobTrace(key))
+            finally:
+                await close_watcher(watcher)
+        return asyncio.run(bundle())
+
+    printer = RecordingPrinter(fail={entry_keys[1]})
+    assert run(printer) == JOB_RETRY
+    assert printer.printed == entry_keys[:1]
+    assert load_printed_files(watcher_env) == set(entry_keys[:1])
+
+    # Повтор продолжает со второго сообщения и записывает сам пакет
+    printer = RecordingPrinter()
+    assert run(printer) == JOB_PRINTED
+    assert printer.printed == entry_keys[1:]
+    assert load_printed_files(watcher_env) == set(entry_keys) | {key}
+
+def test_listed_files_are_printed_and_recorded(watcher_env):
+    client = FakeAsyncS3({'messages/1.txt': 'Анна'.encode('utf-8'), 'messages/2.txt': 'Борис'.encode('utf-8'),
+                          'messages/skip.png': b'x'})
+    printer = RecordingPrinter()
+
+    async def run():
+        watcher = make_watcher(client, [printer], printed_log_file=watcher_env)
+        dispatcher = asyncio.create_task(watcher.dispatch())
+        try:
+            await watcher.poll_once()
+            while watcher.in_flight or len(watcher.scheduler):
+                await asyncio.sleep(0.01)
+            return watcher
+        finally:
+            dispatcher.cancel()
+            await close_watcher(watcher)
+
+    watcher = asyncio.run(asyncio.wait_for(run(), 30))
+    assert sorted(printer.printed) == ['messages/1.txt', 'messages/2.txt']
+    assert watcher.pending == {}
+    assert load_printed_files(watcher_env) == {'messages/1.txt', 'messages/2.txt'}
@@ -0,0 +1,75 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from silent_print_s3 import process_bundle, load_printed_files, decode_text, JOB_PRINTED, JOB_RETRY, JOB_FAILED
+from conftest import RecordingPrinter
+from text_payload import read_bundle, bundle_entry_key, strip_text_suffix, PayloadError, MAX_BUNDLE_BYTES
+
+BUNDLE_KEY = 'messages/badges.jsonl'
+
+def jsonl(*records):
+    return '\n'.join(json.dumps(record, ensure_ascii=False) for record in records).encode('utf-8')
+
+def run_bundle(data, printed_files, printer, printed_log):
+    printer.start()
+    try:
+        return process_bundle(BUNDLE_KEY, data, {}, None, printed_files, [printer], printed_log_file=printed_log)
+    finally:
+        printer.stop()
+
+def test_partly_printed_bundle_resumes_at_first_unprinted_entry(watcher_env):
+    data = jsonl({'id': 1, 'text': 'Анна'}, {'id': 2, 'text': 'Борис'}, {'id': 3, 'text': 'Вера'},
+                 {'id': 4, 'text': 'Глеб'})
+    keys = [bundle_entry_key(BUNDLE_KEY, entry_id) for entry_id in (1, 2, 3, 4)]
+    printed_files = set()
+
+    printer = RecordingPrinter(fail={keys[2]})
+    assert run_bundle(data, printed_files, printer, watcher_env) == JOB_RETRY
+    assert printer.printed == keys[:2]
+    # Сообщения после неудачного не печатались
+    assert printed_files == set(keys[:2])
+    assert load_printed_files(watcher_env) == set(keys[:2])
+
+    # После перезапуска история читается из файла, пакет продолжается с третьего сообщения
+    printed_files = load_printed_files(watcher_env)
+    printer = RecordingPrinter()
+    assert run_bundle(data, printed_files, printer, watcher_env) == JOB_PRINTED
+    assert printer.printed == keys[2:]
+    assert load_printed_files(watcher_env) == set(keys) | {BUNDLE_KEY}
+
+def test_entries_without_text_are_skipped(watcher_env):
+    data = jsonl({'id': 'a', 'text': 'Первый'}, {'id': 'b'}, {'id': 'a', 'text': 'Повтор'}, {'text': 'Без id'})
+    printer = RecordingPrinter()
+    printed_files = set()
+    assert run_bundle(data, printed_files, printer, watcher_env) == JOB_PRINTED
+    # Без id сообщение называется по номеру строки
+    assert printer.printed == [bundle_entry_key(BUNDLE_KEY, 'a'), bundle_entry_key(BUNDLE_KEY, 4)]
+
+def test_unreadable_bundle_fails(watcher_env):
+    printer = RecordingPrinter()
+    assert run_bundle(b'not json at all', set(), printer, watcher_env) == JOB_FAILED
+    assert printer.printed == []
+
+def test_zip_bundle_members(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('guests/anna.txt', 'Анна'.encode('cp1251'))
+        archive.writestr('boris.txt', 'Борис'.encode('utf-8'))
+        archive.writestr('readme.md', 'не сообщение')
+    entries = read_bundle('party.zip', buffer.getvalue(), decode=decode_text)
+    assert [(entry.id, entry.text) for entry in entries] == [('guests_anna', 'Анна'), ('boris', 'Борис')]
+    assert strip_text_suffix('party.zip#boris') == 'party#boris'
+
+def test_zip_bundle_total_size_is_capped():
+    # Каждый файл меньше MAX_TEXT_BYTES, но вместе они больше MAX_BUNDLE_BYTES
+    member = b'a' * (4 * 1024 * 1024 - 1)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(MAX_BUNDLE_BYTES // len(member) + 1):
+            archive.writestr(f"{i}.txt", member)
+    assert len(buffer.getvalue()) < 1024 * 1024
+    with pytest.raises(PayloadError):
+        read_bundle('bomb.zip', buffer.getvalue())
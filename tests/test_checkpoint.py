@@ -0,0 +1,67 @@
+import json
+import datetime
+
+from checkpoint import load_checkpoint, save_checkpoint, CHECKPOINT_VERSION
+from snapshot_diff import Snapshot, key_hash
+
+UTC = datetime.timezone.utc
+OLD = datetime.datetime(2026, 10, 1, 12, 0, tzinfo=UTC)
+NEW = datetime.datetime(2026, 10, 2, 8, 30, tzinfo=UTC)
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    snapshot = Snapshot.from_items([('messages/a.txt', OLD), ('messages/b.txt', NEW)])
+    assert save_checkpoint(snapshot, {'messages/b.txt': NEW, 'messages/c.txt': None}, str(path))
+
+    checkpoint = load_checkpoint(str(path))
+    assert checkpoint['watermark'] == NEW
+    assert len(checkpoint['snapshot']) == 2
+    assert checkpoint['snapshot'].get(key_hash('messages/a.txt')) == OLD.timestamp()
+    assert checkpoint['snapshot'].get(key_hash('messages/missing.txt')) is None
+    assert checkpoint['pending'] == {'messages/b.txt': NEW, 'messages/c.txt': None}
+
+def test_empty_snapshot_has_no_watermark(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    save_checkpoint(Snapshot(), {}, str(path))
+    checkpoint = load_checkpoint(str(path))
+    assert checkpoint['watermark'] is None
+    assert len(checkpoint['snapshot']) == 0
+
+def test_missing_file(tmp_path):
+    assert load_checkpoint(str(tmp_path / 'missing.json')) is None
+
+def test_other_version_is_ignored(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    save_checkpoint(Snapshot.from_items([('messages/a.txt', OLD)]), {}, str(path))
+    data = json.loads(path.read_text(encoding='utf-8'))
+    data['version'] = CHECKPOINT_VERSION - 1
+    path.write_text(json.dumps(data), encoding='utf-8')
+    assert load_checkpoint(str(path)) is None
+
+def test_corrupted_file_is_ignored(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    save_checkpoint(Snapshot.from_items([('messages/a.txt', OLD), ('messages/b.txt', NEW)]), {}, str(path))
+    text = path.read_text(encoding='utf-8')
+    # Снимок, в котором времен изменения меньше, чем ключей
+    data = json.loads(text)
+    data['snapshot']['mtimes'] = Snapshot.from_items([('messages/a.txt', OLD)]).to_dict()['mtimes']
+    path.write_text(json.dumps(data), encoding='utf-8')
+    assert load_checkpoint(str(path)) is None
+    # Оборванная запись
+    path.write_text(text[:40], encoding='utf-8')
+    assert load_checkpoint(str(path)) is None
+
+def test_failed_save_keeps_previous_checkpoint(tmp_path, monkeypatch):
+    path = tmp_path / 'checkpoint.json'
+    save_checkpoint(Snapshot.from_items([('messages/a.txt', OLD)]), {}, str(path))
+
+    def disk_full(data, f, **kwargs):
+        f.write('{"version": ')
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr('checkpoint.json.dump', disk_full)
+    assert not save_checkpoint(Snapshot(), {}, str(path))
+    monkeypatch.undo()
+    assert len(load_checkpoint(str(path))['snapshot']) == 1
+    # Временный файл убран
+    assert [entry.name for entry in tmp_path.iterdir()] == ['checkpoint.json']
@@ -0,0 +1,62 @@
+import time
+
+from botocore.exceptions import ClientError
+
+from job_leases import LeaseManager, LEASE_ACQUIRED, LEASE_BUSY, LEASE_DONE
+from conftest import BUCKET_NAME
+
+def test_only_one_station_gets_the_lease(s3_client):
+    first = LeaseManager(s3_client, BUCKET_NAME, owner='first')
+    second = LeaseManager(s3_client, BUCKET_NAME, owner='second')
+    assert first.acquire('messages/a.txt') == LEASE_ACQUIRED
+    assert second.acquire('messages/a.txt') == LEASE_BUSY
+    assert second.acquire('messages/b.txt') == LEASE_ACQUIRED
+
+def test_stale_lease_takeover(s3_client):
+    first = LeaseManager(s3_client, BUCKET_NAME, ttl=0.2, owner='first')
+    second = LeaseManager(s3_client, BUCKET_NAME, ttl=0.2, owner='second')
+    key = 'messages/stale.txt'
+    assert first.acquire(key) == LEASE_ACQUIRED
+    assert second.acquire(key) == LEASE_BUSY
+    # Первая станция «упала» и не продлевает аренду
+    time.sleep(0.3)
+    assert second.acquire(key) == LEASE_ACQUIRED
+    assert not first.renew(key)
+    assert second.complete(key)
+    assert first.acquire(key) == LEASE_DONE
+
+def test_released_lease_is_taken_immediately(s3_client):
+    first = LeaseManager(s3_client, BUCKET_NAME, owner='first')
+    second = LeaseManager(s3_client, BUCKET_NAME, owner='second')
+    key = 'messages/retry.txt'
+    assert first.acquire(key) == LEASE_ACQUIRED
+    assert first.renew(key)
+    assert first.release(key)
+    assert second.acquire(key) == LEASE_ACQUIRED
+
+def test_failed_file_is_done_for_everyone(s3_client):
+    first = LeaseManager(s3_client, BUCKET_NAME, owner='first')
+    second = LeaseManager(s3_client, BUCKET_NAME, owner='second')
+    key = 'messages/broken.txt'
+    assert first.acquire(key) == LEASE_ACQUIRED
+    assert first.complete(key, failed=True)
+    assert second.acquire(key) == LEASE_DONE
+
+def test_failed_completion_is_retried_instead_of_renewed(s3_client, monkeypatch):
+    first = LeaseManager(s3_client, BUCKET_NAME, owner='first')
+    second = LeaseManager(s3_client, BUCKET_NAME, owner='second')
+    key = 'messages/flaky.txt'
+    assert first.acquire(key) == LEASE_ACQUIRED
+    put = first._put
+
+    def broken_put(*args, **kwargs):
+        raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'try again'}}, 'PutObject')
+
+    monkeypatch.setattr(first, '_put', broken_put)
+    assert not first.complete(key)
+    monkeypatch.setattr(first, '_put', put)
+    # Продление не затирает файл, который уже напечатан
+    assert not first.renew(key)
+    first.beat()
+    assert first.held == {} and first.unsent == {}
+    assert second.acquire(key) == LEASE_DONE
@@ -0,0 +1,103 @@
+import threading
+
+from PIL import Image
+
+from pipeline import RenderedPage, Sink, PageStream, fan_out
+from conftest import RecordingPrinter
+
+def make_page(number):
+    return RenderedPage(f"page-{number}", Image.new('1', (8, 8), 1), number=number)
+
+class GatedPrinter(RecordingPrinter):
+    """Принтер, который ждет gate перед первой страницей и не печатает ключи из fail."""
+
+    def __init__(self, fail=()):
+        super().__init__(fail)
+        self.gate = threading.Event()
+        self.handled = threading.Event()
+
+    def handle(self, page):
+        self.gate.wait(5)
+        try:
+            return super().handle(page)
+        finally:
+            self.handled.set()
+
+class FailingSink(Sink):
+    name = 'preview'
+
+    def handle(self, page):
+        raise OSError("диск заполнен")
+
+def run_fan_out(pages, sinks):
+    for sink in sinks:
+        sink.start()
+    try:
+        return fan_out(pages, sinks)
+    finally:
+        for sink in sinks:
+            sink.stop()
+
+def test_failed_page_cancels_queued_pages():
+    printer = GatedPrinter(fail={'page-1'})
+
+    def pages():
+        yield from (make_page(number) for number in (1, 2, 3))
+        # Все страницы уже в очереди принтера, когда первая не печатается
+        printer.gate.set()
+
+    assert not run_fan_out(pages(), [printer])
+    assert printer.printed == []
+
+def test_failure_stops_rendering():
+    printer = GatedPrinter(fail={'page-1'})
+    printer.gate.set()
+    rendered = []
+    closed = threading.Event()
+
+    def pages():
+        try:
+            for number in range(1, 10):
+                rendered.append(number)
+                yield make_page(number)
+                printer.handled.wait(5)
+        finally:
+            closed.set()
+
+    assert not run_fan_out(pages(), [printer])
+    assert printer.printed == []
+    # Генератор закрыт, остальные страницы не рендерились
+    assert closed.is_set()
+    assert len(rendered) < 9
+
+def test_optional_sink_failure_does_not_fail_the_file():
+    printer = RecordingPrinter()
+    preview = FailingSink()
+    assert run_fan_out([make_page(1), make_page(2)], [printer, preview])
+    assert printer.printed == ['page-1', 'page-2']
+
+def test_single_page_is_accepted():
+    printer = RecordingPrinter()
+    assert run_fan_out(make_page(1), [printer])
+    assert printer.printed == ['page-1']
+
+def test_page_stream_hands_pages_between_threads():
+    stream = PageStream()
+    filler = threading.Thread(target=stream.fill, args=([make_page(1), make_page(2)],))
+    filler.start()
+    assert [page.number for page in stream] == [1, 2]
+    filler.join()
+
+def test_closed_page_stream_stops_filling():
+    stream = PageStream()
+    taken = []
+
+    def pages():
+        for number in range(1, 10):
+            taken.append(number)
+            yield make_page(number)
+
+    stream.close()
+    stream.fill(pages())
+    assert list(stream) == []
+    assert taken == [1]
@@ -0,0 +1,65 @@
+from botocore.exceptions import ClientError
+
+import processed_mover
+from processed_mover import ProcessedMover, PRINTED_PREFIX, FAILED_PREFIX
+from silent_print_s3 import is_text_key
+from conftest import BUCKET_NAME
+
+def keys(client):
+    response = client.list_objects_v2(Bucket=BUCKET_NAME)
+    return sorted(obj['Key'] for obj in response.get('Contents', ()))
+
+def put(client, *names):
+    for name in names:
+        client.put_object(Bucket=BUCKET_NAME, Key=name, Body=b'x')
+
+def move_all(client, *moves):
+    mover = ProcessedMover(client, BUCKET_NAME).start()
+    for key, failed in moves:
+        mover.move(key, failed)
+    mover.stop()
+    return mover
+
+def test_printed_and_failed_objects_are_moved(s3_client):
+    put(s3_client, 'messages/a.txt', 'messages/b.txt', 'messages/c.txt')
+    move_all(s3_client, ('messages/a.txt', False), ('messages/b.txt', True))
+    assert keys(s3_client) == [FAILED_PREFIX + 'messages/b.txt', 'messages/c.txt', PRINTED_PREFIX + 'messages/a.txt']
+
+def test_failed_copy_keeps_the_original(s3_client):
+    put(s3_client, 'messages/a.txt')
+    # Первого объекта нет: копирование не удается, но перенос продолжается
+    move_all(s3_client, ('messages/missing.txt', False), ('messages/a.txt', False))
+    assert keys(s3_client) == [PRINTED_PREFIX + 'messages/a.txt']
+
+def test_failed_delete_leaves_both_copies(s3_client, monkeypatch):
+    put(s3_client, 'messages/a.txt')
+
+    def broken_delete(**kwargs):
+        raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'try again'}}, 'DeleteObjects')
+
+    monkeypatch.setattr(s3_client, 'delete_objects', broken_delete)
+    mover = move_all(s3_client, ('messages/a.txt', False))
+    assert keys(s3_client) == ['messages/a.txt', PRINTED_PREFIX + 'messages/a.txt']
+    assert mover.to_delete == []
+
+def test_originals_are_deleted_in_batches(s3_client, monkeypatch):
+    names = [f"messages/{i}.txt" for i in range(5)]
+    put(s3_client, *names)
+    batches = []
+    delete_objects = s3_client.delete_objects
+
+    def recording_delete(**kwargs):
+        batches.append(len(kwargs['Delete']['Objects']))
+        return delete_objects(**kwargs)
+
+    monkeypatch.setattr(processed_mover, 'MOVE_BATCH_SIZE', 2)
+    monkeypatch.setattr(s3_client, 'delete_objects', recording_delete)
+    move_all(s3_client, *[(name, False) for name in names])
+    assert sum(batches) == 5 and max(batches) == 2
+    assert keys(s3_client) == sorted(PRINTED_PREFIX + name for name in names)
+
+def test_watcher_ignores_its_own_prefixes():
+    assert is_text_key('messages/a.txt')
+    assert not is_text_key(PRINTED_PREFIX + 'messages/a.txt')
+    assert not is_text_key(FAILED_PREFIX + 'messages/a.txt')
+    assert not is_text_key('leases/notes.txt')
@@ -0,0 +1,79 @@
+import os
+
+from PIL import Image
+
+import silent_print_s3
+from silent_print_s3 import TEMPLATES, load_fonts, render_pages
+from render_cache import RenderCache
+
+TEXT = 'Привет, мир'
+
+def page(color):
+    return Image.new('L', (16, 16), color)
+
+def test_fonts_are_opened_once_per_template_font(watcher_env, monkeypatch):
+    opened = []
+    open_fonts = silent_print_s3._open_fonts
+
+    def counting_open_fonts(template, load_emoji):
+        opened.append(template.font_path)
+        return open_fonts(template, load_emoji)
+
+    monkeypatch.setattr(silent_print_s3, '_FONTS', {})
+    monkeypatch.setattr(silent_print_s3, '_open_fonts', counting_open_fonts)
+    template = TEMPLATES.select('messages/1.txt', {})
+    fonts = load_fonts(template)
+    assert load_fonts(template) is fonts
+    assert len(opened) == 1
+    # Без шрифта эмодзи — другая запись
+    assert load_fonts(template, load_emoji=False)[1] is None
+    assert len(opened) == 2
+
+def test_cached_message_skips_fonts_and_layout(watcher_env, tmp_path, monkeypatch):
+    monkeypatch.setattr(silent_print_s3, 'RENDER_CACHE', RenderCache(str(tmp_path / 'cache')))
+    template = TEMPLATES.select('messages/1.txt', {})
+    first = list(render_pages(template, TEXT))
+
+    def no_fonts(*args, **kwargs):
+        raise AssertionError("шрифты не должны загружаться при попадании в кэш")
+
+    monkeypatch.setattr(silent_print_s3, 'load_fonts', no_fonts)
+    assert list(render_pages(template, TEXT)) == first
+    # Другой текст — промах, и без шрифтов он не рендерится
+    assert list(render_pages(template, TEXT + '!')) == [None]
+
+def test_message_survives_restart_via_disk(tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = RenderCache(directory)
+    cache.put_message('msg', [page(0), page(128), page(255)])
+    cache.flush()
+    pages = RenderCache(directory).get_message('msg')
+    assert [img.getpixel((0, 0)) for img in pages] == [0, 128, 255]
+
+def test_partial_message_is_a_miss(tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = RenderCache(directory)
+    cache.put_message('msg', [page(0), page(255)])
+    cache.flush()
+    os.unlink(os.path.join(directory, 'msg-2.png'))
+    assert RenderCache(directory).get_message('msg') is None
+    assert cache.get_message('other') is None
+
+def test_memory_eviction_keeps_newest(tmp_path):
+    # Каждая страница 16x16 в оттенках серого занимает 256 байт
+    cache = RenderCache(str(tmp_path / 'cache'), memory_bytes=512)
+    for name in ('a', 'b', 'c'):
+        cache.put(name, page(0))
+    assert list(cache.memory) == ['b', 'c']
+    assert cache.memory_used == 512
+
+def test_corrupt_disk_entry_is_dropped(tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = RenderCache(directory)
+    cache.put_message('msg', [page(0)])
+    cache.flush()
+    with open(os.path.join(directory, 'msg-1.png'), 'wb') as f:
+        f.write(b'not a png')
+    fresh = RenderCache(directory)
+    assert fresh.get_message('msg') is None
+    assert 'msg-1' not in fresh.disk
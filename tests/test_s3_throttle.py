@@ -0,0 +1,64 @@
+import pytest
+
+from s3_throttle import S3Throttle, AdaptiveRateLimiter, RetryBudget
+from conftest import BUCKET_NAME, slowdown_response
+
+OBJECTS = 3
+
+class SlowDownStub:
+    """Отвечает SlowDown на все запросы клиента, не отправляя их в moto."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def attach(self, client):
+        # Раньше moto, иначе ответ moto будет выбран первым
+        client.meta.events.register_first('before-send.s3', self.before_send)
+        return self
+
+    def before_send(self, request, **kwargs):
+        self.requests += 1
+        return slowdown_response(request)
+
+@pytest.fixture
+def s3_client(s3_client):
+    for i in range(OBJECTS):
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=f"messages/{i}.txt", Body=b'x')
+    return s3_client
+
+def test_retry_budget_stops_retry_storm(s3_client):
+    from botocore.exceptions import ClientError
+    budget = RetryBudget(capacity=3, ratio=0.1)
+    S3Throttle(AdaptiveRateLimiter(rate=1000), budget, backoff_base=0.001).attach(s3_client)
+    stub = SlowDownStub().attach(s3_client)
+    for i in range(5):
+        with pytest.raises(ClientError):
+            s3_client.get_object(Bucket=BUCKET_NAME, Key=f"messages/{i % OBJECTS}.txt")
+    # Без успешных ответов повторов не больше запаса
+    assert stub.requests == 5 + 3
+
+def test_successes_refill_retry_budget(s3_client):
+    budget = RetryBudget(capacity=2, ratio=0.5)
+    budget.tokens = 0
+    S3Throttle(AdaptiveRateLimiter(rate=1000), budget).attach(s3_client)
+    for i in range(OBJECTS):
+        s3_client.get_object(Bucket=BUCKET_NAME, Key=f"messages/{i}.txt")['Body'].read()
+    assert budget.tokens == 1.5
+    assert budget.withdraw() and not budget.withdraw()
+
+def test_throttle_halves_rate_once_per_cooldown():
+    limiter = AdaptiveRateLimiter(rate=100, min_rate=10, decrease=0.5, cooldown=60)
+    assert limiter.on_throttle()
+    # Остальные отказы той же волны темп не снижают
+    assert not limiter.on_throttle()
+    assert limiter.rate == 50
+    limiter.on_success()
+    assert limiter.rate > 50
+
+def test_rate_stays_within_bounds():
+    limiter = AdaptiveRateLimiter(rate=12, min_rate=10, max_rate=12.1, cooldown=0)
+    limiter.on_throttle()
+    assert limiter.rate == 10
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 12.1
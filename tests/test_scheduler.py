@@ -0,0 +1,96 @@
+import datetime
+
+from botocore.exceptions import ClientError
+
+from scheduler import JobScheduler, LIVE, BACKLOG, DEFAULT_PREFIX_PRIORITY
+from snapshot_diff import Snapshot
+from silent_print_s3 import poll_s3_changes
+
+UTC = datetime.timezone.utc
+NOW = datetime.datetime.now(UTC)
+OLD = NOW - datetime.timedelta(days=1)
+
+def drain(scheduler):
+    jobs = []
+    while (job := scheduler.pop()) is not None:
+        jobs.append(job)
+    return jobs
+
+def test_backlog_gets_its_share():
+    scheduler = JobScheduler(backlog_share=0.25)
+    for i in range(40):
+        scheduler.push(f"live/{i:02d}.txt", NOW, LIVE)
+        scheduler.push(f"old/{i:02d}.txt", OLD, BACKLOG)
+    classes = [job_class for _, _, job_class in drain(scheduler)[:40]]
+    # Пока есть оба класса, каждое четвертое задание — из бэклога
+    assert classes.count(BACKLOG) == 10
+    assert classes[:4] == [LIVE, LIVE, LIVE, BACKLOG]
+
+def test_backlog_runs_alone_when_no_live_jobs():
+    scheduler = JobScheduler(backlog_share=0.2)
+    for i in range(3):
+        scheduler.push(f"old/{i}.txt", OLD, BACKLOG)
+    assert [job_class for _, _, job_class in drain(scheduler)] == [BACKLOG] * 3
+
+def test_classify_by_age():
+    scheduler = JobScheduler(live_window_seconds=300)
+    assert scheduler.classify(NOW - datetime.timedelta(seconds=10), NOW) == LIVE
+    assert scheduler.classify(NOW - datetime.timedelta(seconds=600), NOW) == BACKLOG
+    assert scheduler.classify(None) == BACKLOG
+
+def test_prefix_priority_then_oldest_first():
+    scheduler = JobScheduler(prefix_priorities={'vip/': 0, 'vip/late/': 200})
+    scheduler.push('messages/1.txt', NOW - datetime.timedelta(seconds=30), LIVE)
+    scheduler.push('vip/2.txt', NOW - datetime.timedelta(seconds=5), LIVE)
+    scheduler.push('vip/1.txt', NOW - datetime.timedelta(seconds=20), LIVE)
+    scheduler.push('vip/late/1.txt', NOW - datetime.timedelta(seconds=60), LIVE)
+    assert [key for key, _, _ in drain(scheduler)] == ['vip/1.txt', 'vip/2.txt', 'messages/1.txt', 'vip/late/1.txt']
+
+def test_longest_prefix_wins():
+    scheduler = JobScheduler(prefix_priorities={'a/': 5, 'a/b/': 1})
+    assert scheduler.prefix_priority('a/b/c.txt') == 1
+    assert scheduler.prefix_priority('a/c.txt') == 5
+    assert scheduler.prefix_priority('z.txt') == DEFAULT_PREFIX_PRIORITY
+
+def test_duplicate_push_is_ignored():
+    scheduler = JobScheduler()
+    assert scheduler.push('messages/1.txt', NOW)
+    assert not scheduler.push('messages/1.txt', NOW)
+    assert len(scheduler) == 1 and 'messages/1.txt' in scheduler
+    scheduler.pop()
+    assert len(scheduler) == 0
+    assert scheduler.push('messages/1.txt', NOW)
+
+class BrokenListing:
+    """Клиент S3, чей листинг обрывается после первой страницы, пока broken."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.broken = True
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, **kwargs):
+        yield self.pages[0]
+        if self.broken:
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'listing failed'}}, 'ListObjectsV2')
+        yield from self.pages[1:]
+
+def test_poll_after_broken_listing_skips_pending_keys():
+    client = BrokenListing([{'Contents': [{'Key': 'messages/1.txt', 'LastModified': NOW}]},
+                            {'Contents': [{'Key': 'messages/2.txt', 'LastModified': NOW}]}])
+    scheduler = JobScheduler()
+    pending, traces = {}, {}
+    known_files = poll_s3_changes(client, Snapshot(), set(), scheduler, pending, traces)
+    # Листинг оборвался: снимок прежний, но первый файл уже в очереди
+    assert len(known_files) == 0
+    assert pending == {'messages/1.txt': NOW}
+    # Файл взят в печать, а следующий листинг снова видит его как новый
+    assert scheduler.pop()[0] == 'messages/1.txt'
+    traces.clear()
+    client.broken = False
+    known_files = poll_s3_changes(client, known_files, set(), scheduler, pending, traces)
+    assert len(known_files) == 2
+    assert [key for key, _, _ in drain(scheduler)] == ['messages/2.txt']
+    assert set(traces) == {'messages/2.txt'}
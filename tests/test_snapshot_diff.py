@@ -0,0 +1,52 @@
+import datetime
+
+from snapshot_diff import Snapshot, SnapshotBuilder, iter_changes, key_hash
+
+UTC = datetime.timezone.utc
+T0 = datetime.datetime(2025, 5, 1, tzinfo=UTC)
+T1 = T0 + datetime.timedelta(minutes=5)
+
+def listing(*objects, page_size=2):
+    """Страницы ответа list_objects_v2 из пар (ключ, LastModified)."""
+    contents = [{'Key': key, 'LastModified': last_modified} for key, last_modified in objects]
+    return [{'Contents': contents[i:i + page_size]} for i in range(0, len(contents), page_size)]
+
+def diff(pages, snapshot, key_filter=None):
+    builder = SnapshotBuilder()
+    changes = list(iter_changes(pages, snapshot, builder, key_filter))
+    return changes, builder.build()
+
+def test_first_listing_reports_every_key_in_listing_order():
+    objects = [('a.txt', T0), ('b.txt', T1), ('c.txt', T0)]
+    changes, snapshot = diff(listing(*objects), Snapshot())
+    assert changes == objects
+    assert len(snapshot) == 3
+
+def test_only_added_and_changed_keys_are_reported():
+    _, snapshot = diff(listing(('a.txt', T0), ('b.txt', T0)), Snapshot())
+    changes, _ = diff(listing(('a.txt', T0), ('b.txt', T1), ('c.txt', T0)), snapshot)
+    assert changes == [('b.txt', T1), ('c.txt', T0)]
+
+def test_deleted_keys_leave_the_snapshot():
+    _, snapshot = diff(listing(('a.txt', T0), ('b.txt', T0)), Snapshot())
+    changes, snapshot = diff(listing(('b.txt', T0)), snapshot)
+    assert changes == []
+    assert snapshot.get(key_hash('a.txt')) is None
+    # Вернувшийся файл снова считается новым
+    changes, _ = diff(listing(('a.txt', T0), ('b.txt', T0)), snapshot)
+    assert changes == [('a.txt', T0)]
+
+def test_older_last_modified_is_not_a_change():
+    _, snapshot = diff(listing(('a.txt', T1)), Snapshot())
+    changes, _ = diff(listing(('a.txt', T0)), snapshot)
+    assert changes == []
+
+def test_filtered_keys_are_neither_reported_nor_remembered():
+    is_text = lambda key: key.endswith('.txt')
+    changes, snapshot = diff(listing(('a.png', T0), ('b.txt', T0)), Snapshot(), is_text)
+    assert changes == [('b.txt', T0)]
+    assert len(snapshot) == 1
+
+def test_empty_pages_give_empty_snapshot():
+    changes, snapshot = diff([{}, {'Contents': []}], Snapshot())
+    assert changes == [] and len(snapshot) == 0
@@ -0,0 +1,53 @@
+import io
+import gzip
+
+import pytest
+
+from text_payload import (payload_encoding, read_payload, strip_text_suffix, max_object_bytes, PayloadError,
+                          MAX_TEXT_BYTES, MAX_BUNDLE_BYTES)
+from silent_print_s3 import decode_object, fetch_object
+
+def test_decode_rejects_gzip_bomb():
+    # Сжимается в десятки килобайт, но распаковывается больше предела
+    bomb = gzip.compress(b'\0' * (MAX_TEXT_BYTES * 4))
+    assert len(bomb) < MAX_TEXT_BYTES // 50
+    assert decode_object('messages/bomb.txt.gz', bomb) is None
+
+def test_read_payload_limit():
+    assert read_payload(io.BytesIO(b'x' * 10), limit=10) == b'x' * 10
+    with pytest.raises(PayloadError):
+        read_payload(io.BytesIO(b'x' * 11), limit=10)
+    with pytest.raises(PayloadError):
+        read_payload(io.BytesIO(b'not gzip'), 'gzip')
+
+def test_content_encoding_overrides_suffix():
+    assert payload_encoding('a.txt', 'gzip') == 'gzip'
+    assert payload_encoding('a.txt.gz', 'x-gzip') == 'gzip'
+    assert payload_encoding('a.txt.gz', 'identity') == 'gzip'
+    assert payload_encoding('a.txt') is None
+
+def test_unknown_content_encoding_falls_back_to_suffix():
+    assert payload_encoding('a.txt', 'aws-chunked') is None
+    assert payload_encoding('a.txt.gz', 'br') == 'gzip'
+    assert decode_object('messages/a.txt', 'привет'.encode('utf-8'), 'aws-chunked') == 'привет'
+
+def test_decode_gzip_with_content_encoding():
+    data = gzip.compress('Привет,\r\nмир'.encode('cp1251'))
+    assert decode_object('messages/a.txt', data, 'gzip') == 'Привет,\nмир'
+
+def test_strip_text_suffix():
+    assert strip_text_suffix('a/msg.txt') == 'a/msg'
+    assert strip_text_suffix('a/msg.txt.gz') == 'a/msg'
+    assert strip_text_suffix('a/badges.jsonl.gz#42') == 'a/badges#42'
+
+def test_fetch_object_reads_at_most_the_limit():
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='test-payload')
+        client.put_object(Bucket='test-payload', Key='messages/big.txt', Body=b'a' * (MAX_TEXT_BYTES + 4096))
+        data, _, content_encoding = fetch_object(client, 'test-payload', 'messages/big.txt')
+    assert len(data) == max_object_bytes('messages/big.txt') + 1
+    assert decode_object('messages/big.txt', data, content_encoding) is None
+    assert max_object_bytes('messages/badges.jsonl') == MAX_BUNDLE_BYTES
@@ -0,0 +1,199 @@
+import io
+import os
+import re
+import gzip
+import json
+import zlib
+import logging
+import zipfile
+
+from startup import lazy_import, module_available
+
+zstandard = lazy_import('zstandard')
+# Без пакета zstandard файлы .txt.zst не принимаются
+ZSTD_AVAILABLE = module_available('zstandard')
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_BYTES = 4 * 1024 * 1024  # Предел размера текста после распаковки (защита от zip-бомб)
+READ_CHUNK_BYTES = 64 * 1024  # По сколько байт распаковывать за раз
+
+# Сжатие по расширению ключа
+COMPRESSED_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+# Сжатие по заголовку Content-Encoding; identity означает «без сжатия»
+CONTENT_ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd', 'identity': None}
+# Окончания ключей текстовых файлов, которые берутся в печать
+TEXT_SUFFIXES = ('.txt', '.txt.gz') + (('.txt.zst',) if ZSTD_AVAILABLE else ())
+# Пакеты из многих сообщений: JSONL (строка {"id": ..., "text": ..., "template": ...}) или zip с .txt
+BUNDLE_SUFFIXES = ('.jsonl', '.jsonl.gz') + (('.jsonl.zst',) if ZSTD_AVAILABLE else ()) + ('.zip',)
+MAX_BUNDLE_BYTES = 32 * 1024 * 1024  # Предел размера пакета после распаковки
+MAX_BUNDLE_ENTRIES = 2000  # Сколько сообщений может быть в одном пакете
+ENTRY_SEPARATOR = '#'  # Ключ сообщения пакета: <ключ пакета>#<id сообщения>
+# Символы, недопустимые в id сообщения (разделители истории печати и путей)
+ENTRY_ID_UNSAFE = re.compile(r'[\s,#/\\]+')
+
+class PayloadError(ValueError):
+    """Содержимое объекта невозможно распаковать или оно слишком велико."""
+
+def payload_encoding(key, content_encoding=None):
+    """Сжатие объекта: 'gzip', 'zstd' или None.
+
+    Заголовок Content-Encoding важнее расширения ключа. Файл .txt.gz,
+    загруженный с Content-Encoding: gzip, сжат один раз. Неизвестный
+    заголовок игнорируется с предупреждением.
+    """
+    if content_encoding:
+        name = content_encoding.strip().lower()
+        if CONTENT_ENCODINGS.get(name) is not None:
+            return CONTENT_ENCODINGS[name]
+        if name not in CONTENT_ENCODINGS:
+            # Незнакомые заголовки (например, aws-chunked) не означают сжатие:
+            # такие объекты печатались и раньше, сжатие определяем по расширению
+            logger.warning("Файл %s: неизвестный Content-Encoding '%s', определяем сжатие по расширению",
+                           key, content_encoding)
+    return COMPRESSED_SUFFIXES.get(os.path.splitext(key.lower())[1])
+
+def strip_text_suffix(key):
+    """Ключ без расширения текстового файла или пакета.
+
+    'a/msg.txt.gz' -> 'a/msg', 'a/badges.jsonl#42' -> 'a/badges#42'.
+    """
+    bundle, separator, entry_id = key.rpartition(ENTRY_SEPARATOR)
+    if separator and is_bundle_key(bundle):
+        return strip_text_suffix(bundle) + separator + entry_id
+    base, extension = os.path.splitext(key)
+    if extension.lower() in COMPRESSED_SUFFIXES:
+        base, extension = os.path.splitext(base)
+    return base
+
+def max_object_bytes(key):
+    """Сколько байт объекта key имеет смысл скачивать: больше не пройдет проверку размера."""
+    return MAX_BUNDLE_BYTES if is_bundle_key(key) else MAX_TEXT_BYTES
+
+def open_payload(stream, encoding):
+    """Поток распакованных байт поверх stream (файла или тела ответа S3)."""
+    if encoding is None:
+        return stream
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise PayloadError("для файлов zstd установите пакет: pip install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    raise PayloadError(f"неизвестное сжатие '{encoding}'")
+
+def read_payload(stream, encoding=None, limit=MAX_TEXT_BYTES):
+    """Читает и распаковывает содержимое по частям, не больше limit байт.
+
+    Распакованные данные читаются кусками по READ_CHUNK_BYTES, поэтому
+    сильно сжатый файл (zip-бомба) отвергается, как только превысит
+    предел, а не после распаковки целиком. Выбрасывает PayloadError.
+    """
+    reader = open_payload(stream, encoding)
+    chunks = []
+    total = 0
+    try:
+        while True:
+            chunk = reader.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > limit:
+                raise PayloadError(f"текст больше {limit} байт после распаковки")
+            chunks.append(chunk)
+    except (OSError, EOFError, zlib.error) as e:
+        raise PayloadError(f"поврежденные сжатые данные ({encoding}): {e}") from e
+    except Exception as e:
+        if ZSTD_AVAILABLE and encoding == 'zstd' and isinstance(e, zstandard.ZstdError):
+            raise PayloadError(f"поврежденные сжатые данные ({encoding}): {e}") from e
+        raise
+    return b''.join(chunks)
+
+def is_bundle_key(key):
+    """Проверяет, является ли ключ пакетом сообщений (JSONL или zip)."""
+    return key.lower().endswith(BUNDLE_SUFFIXES)
+
+def bundle_entry_key(bundle_key, entry_id):
+    """Ключ сообщения пакета в истории печати, очередях принтера и архиве."""
+    return f"{bundle_key}{ENTRY_SEPARATOR}{entry_id}"
+
+class BundleEntry:
+    """Сообщение из пакета: id, текст (None, если не читается) и имя шаблона."""
+
+    def __init__(self, entry_id, text, template=None):
+        self.id = entry_id
+        self.text = text
+        self.template = template
+
+def _entry_id(value):
+    return ENTRY_ID_UNSAFE.sub('_', str(value).strip()).strip('_')
+
+def _iter_jsonl_entries(key, data):
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError as e:
+        raise PayloadError(f"пакет JSONL не в UTF-8: {e}") from e
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            logger.warning("Пакет %s, строка %s: не JSON (%s), пропускаем", key, number, e)
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get('text'), str):
+            logger.warning("Пакет %s, строка %s: нет поля text, пропускаем", key, number)
+            continue
+        # Без id сообщение называется по номеру строки
+        yield record.get('id', number), record['text'].replace('\r\n', '\n').replace('\r', '\n'), record.get('template')
+
+def _iter_zip_entries(key, data, decode):
+    # Размеры в каталоге zip можно подделать, поэтому общий предел
+    # считается по фактически распакованным байтам
+    total = 0
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(TEXT_SUFFIXES):
+                    continue
+                if info.file_size > MAX_TEXT_BYTES:
+                    logger.warning("Пакет %s: %s больше %s байт, пропускаем", key, info.filename, MAX_TEXT_BYTES)
+                    continue
+                with archive.open(info) as member:
+                    member_data = read_payload(member, payload_encoding(info.filename))
+                total += len(member_data)
+                if total > MAX_BUNDLE_BYTES:
+                    raise PayloadError(f"пакет больше {MAX_BUNDLE_BYTES} байт после распаковки")
+                yield strip_text_suffix(info.filename), decode(member_data), None
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, RuntimeError, NotImplementedError) as e:
+        # RuntimeError — зашифрованный архив, NotImplementedError — неизвестное сжатие
+        raise PayloadError(f"поврежденный или неподдерживаемый zip: {e}") from e
+
+def read_bundle(key, data, content_encoding=None, decode=None):
+    """Разбирает пакет сообщений key. Возвращает список BundleEntry по порядку.
+
+    data — содержимое объекта (JSONL может быть сжат, как и текстовые
+    файлы), decode — функция, декодирующая байты .txt из zip в текст.
+    Сообщения с повторяющимся id пропускаются. Выбрасывает PayloadError,
+    если пакет не читается, пуст, в нем больше MAX_BUNDLE_ENTRIES сообщений
+    или больше MAX_BUNDLE_BYTES после распаковки (для zip — всех файлов вместе).
+    """
+    data = read_payload(io.BytesIO(data), payload_encoding(key, content_encoding), MAX_BUNDLE_BYTES)
+    if key.lower().endswith('.zip'):
+        records = _iter_zip_entries(key, data, decode or (lambda member_data: member_data.decode('utf-8')))
+    else:
+        records = _iter_jsonl_entries(key, data)
+    entries = []
+    seen = set()
+    for raw_id, text, template in records:
+        entry_id = _entry_id(raw_id)
+        if not entry_id or entry_id in seen:
+            logger.warning("Пакет %s: пустой или повторяющийся id %r, сообщение пропущено", key, raw_id)
+            continue
+        if len(entries) == MAX_BUNDLE_ENTRIES:
+            raise PayloadError(f"в пакете больше {MAX_BUNDLE_ENTRIES} сообщений")
+        seen.add(entry_id)
+        entries.append(BundleEntry(entry_id, text, template))
+    if not entries:
+        raise PayloadError("в пакете нет ни одного сообщения")
+    return entries